@@ -1,40 +1,34 @@
 # -*- coding: utf-8 -*-
 
-import os
-import sys
-import shlex
-import subprocess
+from runner import Run
 
 
 def execute(cmd, working_dir):
+    '''
+    Runs a command in the given directory, echoing its output, and waits for
+    it to finish. Use :class:`~runner.Run` directly to run in the background.
 
-    olddir = os.getcwd()
+    :param str cmd: The command line
+    :param str working_dir: The directory in which to run the command
 
-    try:
-        os.chdir(working_dir)
+    :returns: The finished run
+    :rtype: runner.Run
+    '''
 
-        args = shlex.split(cmd)
-        proc = subprocess.Popen(args, stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE)
-
-        for line in iter(proc.stdout.readline, b''):
-            sys.stdout.write(line)
-            sys.stdout.flush()
-
-        for line in iter(proc.stderr.readline, b''):
-            sys.stderr.write(line)
-            sys.stderr.flush()
-
-        proc.communicate()
-
-    finally:
-        os.chdir(olddir)
+    run = Run(cmd, working_dir)
+    run.wait()
+    return run
 
 
 from cgs import *
 from star import *
+from stellarsrc import *
 from dust import *
 from grid import *
 from simulation import *
+from sweep import Sweep, SweepResult
+from advisor import GridAdvisor
+from camera import Camera, ImageBatch, SedBatch
+from child import ChildSession, SessionPool
 
 # vim: set ft=python:
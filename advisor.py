@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from grid import RegularGrid, cell_lengths
+
+
+class GridAdvisor(object):
+    '''
+    Suggests the axes of a :class:`~grid.RegularGrid` for a set of dust
+    species. The densities are sampled on a fine grid of the same extent and
+    coordinate system, and every sampled cell is given a refinement demand
+    along each axis: the relative variation of the total density across it
+    divided by the tolerance, or its optical depth divided by the largest
+    allowed, whichever is larger. A proposed axis places its points so that
+    each of its cells covers one unit of demand (equidistribution), which
+    gives the fewest cells that meet both targets everywhere. For a
+    power-law disk this yields logarithmic radii, and latitudes that crowd
+    around the midplane where the disk is thin.
+
+    For example:
+
+    .. code-block:: python
+
+       sample = r3d.RegularGrid()
+       sample.coordsys = r3d.SphericalCoordinates
+       sample.u = np.logspace(np.log10(r_in), np.log10(r_out), 1001)
+       sample.v = np.linspace(0.1, np.pi - 0.1, 501)
+       sample.w = np.array([0., 2. * np.pi])
+
+       advisor = r3d.GridAdvisor(sample, sim.dust, kappa=1.e3)
+       print advisor.statistics()
+       sim.grid = advisor.propose(tolerance=0.1, taumax=1.)
+       print advisor.estimate(sim.grid, sim.io)
+
+    :param RegularGrid grid: The sampling grid; it should be finer than any
+        grid the advisor is expected to propose
+    :param dict dust: The dust species, such as a
+        :class:`~dust.DustContainer`
+    :param kappa: Opacity (in :math:`\\textrm{cm}^2 / \\textrm{g}`), either
+        a single value for all species or a dictionary keyed like
+        :code:`dust`; if :code:`None`, optical depth is not considered
+    :param float floor: Density below which variations are ignored, so that
+        the far tails of a model are not resolved needlessly
+    :param int chunksize: Number of cells sampled at a time; see
+        :attr:`~fileio.Io.chunksize`
+    '''
+
+    def __init__(self, grid, dust, kappa=None, floor=0., chunksize=None):
+
+        self._grid = grid
+        self._dust = dust
+        self._kappa = kappa
+        self._floor = floor
+        self._chunksize = chunksize
+        self._samples = None
+
+
+    def sample(self):
+        '''
+        Evaluates the total density and the total extinction coefficient
+        (the sum of opacity times density over the species) on every cell of
+        the sampling grid. The result is cached.
+
+        :returns: The density and extinction arrays, in the shape of the
+            sampling grid
+        :rtype: tuple
+        '''
+
+        if self._samples is not None:
+            return self._samples
+
+        grid = self._grid
+        rho = np.zeros(grid.shape, order='F')
+        alpha = np.zeros(grid.shape, order='F')
+
+        for name, species in self._dust.items():
+            kappa = self._kappa.get(name, 0.) \
+                if isinstance(self._kappa, dict) else self._kappa
+
+            for start, coords, shape in grid.chunks(self._chunksize):
+                k0 = start // (grid.nu * grid.nv)
+                k1 = k0 + shape[2]
+                density = np.broadcast_to(species.density(coords), shape)
+                rho[:,:,k0:k1] += density
+                if kappa: alpha[:,:,k0:k1] += kappa * density
+
+        self._samples = (rho, alpha)
+        return self._samples
+
+
+    def variation(self, axis):
+        '''
+        Computes the relative variation of the total density across each
+        sampled cell along one axis: the larger of the variations between
+        the cell and either neighbour, relative to the larger density.
+
+        :param int axis: 0, 1 or 2 for `u`, `v` or `w`
+
+        :returns: The variations, in the shape of the sampling grid
+        :rtype: np.ndarray
+        '''
+
+        rho, _ = self.sample()
+        ret = np.zeros(rho.shape)
+        if rho.shape[axis] < 2: return ret
+
+        lo = [slice(None)] * 3
+        hi = [slice(None)] * 3
+        lo[axis] = slice(None, -1)
+        hi[axis] = slice(1, None)
+        lo, hi = tuple(lo), tuple(hi)
+
+        scale = np.maximum(np.maximum(rho[lo], rho[hi]), self._floor)
+        step = np.where(scale > self._floor, np.abs(rho[hi] - rho[lo]) /
+            np.where(scale > 0., scale, 1.), 0.)
+
+        ret[lo] = step
+        ret[hi] = np.maximum(ret[hi], step)
+        return ret
+
+
+    def optical_depth(self, axis):
+        '''
+        Computes the optical depth across each sampled cell along one axis.
+
+        :param int axis: 0, 1 or 2 for `u`, `v` or `w`
+
+        :returns: The optical depths, in the shape of the sampling grid
+        :rtype: np.ndarray
+        '''
+
+        _, alpha = self.sample()
+        grid = self._grid
+        widths = [np.diff(a) for a in (grid.u, grid.v, grid.w)]
+
+        lengths = cell_lengths(grid.cellcoords, (widths[0][:,None,None],
+            widths[1][None,:,None], widths[2][None,None,:]))
+        return alpha * lengths[axis]
+
+
+    def statistics(self):
+        '''
+        Summarizes the density variation and optical depth of the sampled
+        cells along each axis.
+
+        :returns: For each of :code:`u`, :code:`v` and :code:`w`, a
+            dictionary giving the median and largest :code:`variation` and
+            :code:`tau` per sampled cell
+        :rtype: dict
+        '''
+
+        ret = dict()
+
+        for axis, name in enumerate('uvw'):
+            var = self.variation(axis)
+            tau = self.optical_depth(axis)
+            ret[name] = { 'variation' : (np.median(var), var.max()),
+                          'tau' : (np.median(tau), tau.max()) }
+
+        return ret
+
+
+    def demand(self, axis, tolerance, taumax):
+        '''
+        Computes the number of cells needed per sampled cell along one axis:
+        the largest, over the other two axes, of the relative variation over
+        the tolerance and of the optical depth over the largest allowed.
+
+        :param int axis: 0, 1 or 2 for `u`, `v` or `w`
+        :param float tolerance: Largest relative density variation per cell
+        :param float taumax: Largest optical depth per cell, or :code:`None`
+
+        :returns: The demand of each sampled cell along the axis
+        :rtype: np.ndarray
+        '''
+
+        m = self.variation(axis) / tolerance
+        if taumax is not None and self._kappa is not None:
+            m = np.maximum(m, self.optical_depth(axis) / taumax)
+
+        others = tuple(i for i in range(3) if i != axis)
+        return m.max(axis=others)
+
+
+    def propose_axis(self, axis, tolerance=0.1, taumax=1., mincells=1):
+        '''
+        Proposes the points of one axis by equidistributing its demand; see
+        :func:`demand`.
+
+        :param int axis: 0, 1 or 2 for `u`, `v` or `w`
+        :param float tolerance: Largest relative density variation per cell
+        :param float taumax: Largest optical depth per cell, or :code:`None`
+        :param int mincells: Smallest number of cells along the axis
+
+        :returns: The points of the axis
+        :rtype: np.ndarray
+        '''
+
+        points = (self._grid.u, self._grid.v, self._grid.w)[axis]
+        if points.shape[0] < 3: return points.copy()
+
+        m = self.demand(axis, tolerance, taumax)
+        cumulative = np.concatenate([[0.], np.cumsum(m)])
+        n = max(int(np.ceil(cumulative[-1])), mincells)
+
+        if cumulative[-1] <= 0.:
+            return np.linspace(points[0], points[-1], n + 1)
+
+        return np.interp(np.linspace(0., cumulative[-1], n + 1), cumulative,
+            points)
+
+
+    def propose(self, tolerance=0.1, taumax=1., mincells=1):
+        '''
+        Proposes a grid meeting the targets with the fewest cells; see
+        :func:`propose_axis`.
+
+        :param float tolerance: Largest relative density variation per cell
+        :param float taumax: Largest optical depth per cell, or :code:`None`
+        :param int mincells: Smallest number of cells along each axis
+
+        :returns: The proposed grid, in the coordinate system of the sampling
+            grid
+        :rtype: RegularGrid
+        '''
+
+        ret = RegularGrid()
+        ret.coordsys = self._grid.coordsys
+
+        for axis, name in enumerate('uvw'):
+            setattr(ret, name, self.propose_axis(axis, tolerance, taumax,
+                mincells))
+
+        return ret
+
+
+    def estimate(self, grid, io):
+        '''
+        Estimates the cost of a grid before anything is written.
+
+        :param grid.Grid grid: The grid, such as one returned by
+            :func:`propose`
+        :param fileio.Io io: The I/O context the files would be written with
+
+        :returns: A dictionary giving the number of cells (:code:`nrcells`),
+            the size in bytes of the dust density file (:code:`filesize`),
+            and the memory in bytes RADMC3D needs at least to hold the
+            density and temperature of each species (:code:`memory`)
+        :rtype: dict
+        '''
+
+        nspecies = len(self._dust)
+        nvalues = grid.nrcells * nspecies
+
+        if io.binary:
+            filesize = 4 * 8 + nvalues * np.dtype(io.dtype).itemsize
+        else:
+            filesize = len('1\n%d\n%d\n' % (grid.nrcells, nspecies)) + \
+                nvalues * (io.digits + 7)
+
+        return { 'nrcells' : grid.nrcells,
+                 'filesize' : filesize,
+                 'memory' : 2 * nvalues * 8 }
+
+
+    @property
+    def grid(self):
+        '''Read-only; gives the sampling grid.'''
+        return self._grid
+
+    @property
+    def kappa(self):
+        '''The opacity of the species; see the class description.'''
+        return self._kappa
+
+    @kappa.setter
+    def kappa(self, val):
+        self._kappa = val
+        self._samples = None
+
+# vim: set ft=python:
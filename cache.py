@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import time
+import shutil
+import hashlib
+import tempfile
+
+
+class ResultCache(object):
+    '''
+    On-disk cache of RADMC3D results, keyed by a hash of the content of all
+    input files in the output directory and of the command that was run.
+    Since the configuration (including :code:`iseed`) is one of the inputs,
+    a hit means RADMC3D would compute exactly the cached results, which are
+    then restored instead of running it again. Entries are evicted least
+    recently used first once the cache grows beyond its maximum size.
+
+    Restored files are always copies, so that modifying them, in place or
+    not, never changes the cache entry. Outputs are copied into the cache
+    too, unless linking is asked for; a stored file then shares its content
+    with the entry, and must be replaced rather than rewritten in place, as
+    :func:`clear_outputs` does before every run.
+
+    :param str root: The cache directory; created if it does not exist
+    :param int maxsize: Maximum total size of the cache in bytes, or
+        :code:`None` for no limit
+    :param bool link: If :code:`True`, outputs are hard linked into the
+        cache where the filesystem allows it, and copied otherwise; if
+        :code:`False`, they are always copied
+    '''
+
+    inputs = ['radmc3d.inp', 'amr_grid.*inp', 'wavelength_micron.inp',
+        'camera_wavelength_micron.inp', 'stars.inp', 'external_source.inp',
+        'stellarsrc_*.*inp', 'dustopac.inp', 'dustkap*.inp', 'dust_density.*inp',
+        'line.inp', 'molecule_*.inp', 'numberdens_*.*inp', 'gas_*.*inp',
+        'microturbulence.*inp']
+    '''File name patterns of the input files that make up the key.'''
+
+    outputs = { 'mctherm' : ['dust_temperature.*dat', 'photon_statistics.out'] }
+    '''File name patterns of the output files of each command.'''
+
+    racy = 2.
+    '''
+    Minimum age in seconds of a file, when it is hashed, for its digest to be
+    reused while its size and modification time are unchanged. Files
+    modified more recently are hashed again every time, since a rewrite of
+    the same size within the granularity of modification times (a second,
+    or more on some file systems) would otherwise go unnoticed.
+    '''
+
+
+    def __init__(self, root, maxsize=None, link=False):
+
+        self._root = root
+        self._maxsize = maxsize
+        self._link = link
+        self._digests = dict()
+
+        if not os.path.isdir(root): os.makedirs(root)
+
+
+    def digest(self, path):
+        '''
+        Private function. Hashes the content of a file, reusing the previous
+        digest if its size and modification time have not changed and it
+        was already older than :attr:`racy` when it was hashed.
+        '''
+
+        st = os.stat(path)
+        stamp = (st.st_size, st.st_mtime)
+        cached = self._digests.get(path)
+
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        hashed = time.time()
+        h = hashlib.sha1()
+
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+
+        if hashed - st.st_mtime > self.racy:
+            self._digests[path] = (stamp, h.hexdigest())
+        else:
+            self._digests.pop(path, None)
+
+        return h.hexdigest()
+
+
+    def matching(self, io, patterns):
+        '''
+        Private function. Lists the files in the output directory matching
+        any of the given patterns.
+        '''
+
+        names = set()
+
+        for p in patterns:
+            names.update(os.path.basename(f)
+                for f in glob.glob(io.fullpath(p)))
+
+        return sorted(names)
+
+
+    def key(self, io, command):
+        '''
+        Computes the cache key of the current inputs.
+
+        :param Io io: Current I/O context
+        :param str command: The RADMC3D command
+
+        :returns: The key
+        :rtype: str
+        '''
+
+        h = hashlib.sha1(command.encode())
+
+        for name in self.matching(io, self.inputs):
+            h.update(('%s %s\n' % (name,
+                self.digest(io.fullpath(name)))).encode())
+
+        return h.hexdigest()
+
+
+    def transfer(self, src, dst, link=False):
+        '''Private function. Hard links or copies one file.'''
+
+        if os.path.lexists(dst): os.remove(dst)
+
+        if link:
+            try:
+                os.link(src, dst)
+                return
+            except OSError:
+                pass
+
+        shutil.copy2(src, dst)
+
+
+    def clear_outputs(self, io, command):
+        '''
+        Removes the output files of a command from the output directory, so
+        that files stored by linking are never overwritten in place.
+
+        :param Io io: Current I/O context
+        :param str command: The RADMC3D command
+        '''
+
+        for name in self.matching(io, self.outputs.get(command, [])):
+            io.file_remove(name)
+
+
+    def fetch(self, io, command, key=None):
+        '''
+        Restores the cached outputs for the current inputs, if any.
+
+        :param Io io: Current I/O context
+        :param str command: The RADMC3D command
+        :param str key: The key of the current inputs, if it has already
+            been computed with :func:`key`
+
+        :returns: :code:`True` on a hit, :code:`False` on a miss
+        :rtype: bool
+        '''
+
+        if key is None: key = self.key(io, command)
+        entry = os.path.join(self._root, key)
+        if not os.path.isdir(entry): return False
+
+        for name in os.listdir(entry):
+            io.safe_check_clobber(name)
+            self.transfer(os.path.join(entry, name), io.fullpath(name))
+            io.update_index(name)
+
+        os.utime(entry, None)
+        return True
+
+
+    def store(self, io, command, key=None):
+        '''
+        Stores the outputs of a finished run, then evicts old entries if the
+        cache is too large.
+
+        :param Io io: Current I/O context
+        :param str command: The RADMC3D command
+        :param str key: The key of the inputs of the run, as computed by
+            :func:`key` before it was started; defaults to the key of the
+            current inputs, which is only correct if they have not changed
+            since
+        '''
+
+        if key is None: key = self.key(io, command)
+        entry = os.path.join(self._root, key)
+        if os.path.isdir(entry): return
+
+        tmp = tempfile.mkdtemp(dir=self._root, prefix='.tmp')
+
+        try:
+            for name in self.matching(io, self.outputs.get(command, [])):
+                self.transfer(io.fullpath(name), os.path.join(tmp, name),
+                    self._link)
+            os.rename(tmp, entry)
+
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(entry): raise
+
+        self.evict()
+
+
+    def evict(self):
+        '''
+        Removes least recently used entries until the cache is no larger
+        than :attr:`maxsize`.
+        '''
+
+        if self._maxsize is None: return
+
+        entries = list()
+
+        for name in os.listdir(self._root):
+            path = os.path.join(self._root, name)
+            if name.startswith('.') or not os.path.isdir(path): continue
+
+            size = sum(os.path.getsize(os.path.join(path, f))
+                for f in os.listdir(path))
+            entries.append((os.stat(path).st_mtime, size, path))
+
+        entries.sort()
+        total = sum(e[1] for e in entries)
+
+        while entries and total > self._maxsize:
+            _, size, path = entries.pop(0)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+    @property
+    def root(self):
+        '''Read-only; gives the cache directory.'''
+        return self._root
+
+    @property
+    def maxsize(self):
+        '''
+        Maximum total size of the cache in bytes, or :code:`None` for no
+        limit.
+        '''
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, val):
+        self._maxsize = val
+        self.evict()
+
+# vim: set ft=python:
@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+
+import os
+import multiprocessing.pool
+import numpy as np
+from runner import Run
+from mapper import Mapper
+from image import Image
+
+
+class Camera(object):
+    '''
+    Specification of an image to be made by RADMC3D: the viewing angles, the
+    size of the image, and either its wavelengths or, for line images, the
+    line and the velocity range. For example, to view a model at 50
+    inclinations, each at a set of continuum wavelengths:
+
+    .. code-block:: python
+
+       cams = [r3d.Camera(incl=i, npix=256, sizeau=200., lmbda=[10., 100.])
+               for i in np.linspace(0., 90., 50)]
+
+       for result in sim.images(cams, maxprocs=8):
+           print result.camera.incl, result.image.data.max()
+
+    :param float incl: Inclination (in degrees)
+    :param float phi: Azimuthal viewing angle (in degrees)
+    :param npix: Number of pixels along each side, or a tuple of the numbers
+        of pixels along `x` and `y`
+    :param float sizeau: Size of the image (in AU), or :code:`None` to let
+        RADMC3D fit the model
+    :param lmbda: A wavelength (in microns), a list of wavelengths, which are
+        written to :code:`camera_wavelength_micron.inp`, or :code:`None`
+    :param int iline: Index of the line in the molecule data file, for line
+        images
+    :param int imolspec: Index of the molecule in :code:`line.inp`
+    :param float widthkms: Velocity range of a line image (in km/s)
+    :param int linenlam: Number of wavelengths of a line image
+    :param float posang: Position angle of the camera (in degrees)
+    :param list options: Further arguments for RADMC3D, such as
+        :code:`nostar` or :code:`imageunform` (which makes binary images)
+    '''
+
+    def __init__(self, incl=0., phi=0., npix=100, sizeau=None, lmbda=None,
+    iline=None, imolspec=None, widthkms=None, linenlam=None, posang=None,
+    options=()):
+
+        self.incl = incl
+        self.phi = phi
+        self.npix = npix
+        self.sizeau = sizeau
+        self.lmbda = lmbda
+        self.iline = iline
+        self.imolspec = imolspec
+        self.widthkms = widthkms
+        self.linenlam = linenlam
+        self.posang = posang
+        self.options = list(options)
+
+
+    def args(self, command='image'):
+        '''
+        Gives the arguments of a RADMC3D command for this camera.
+
+        :param str command: The command, such as :code:`image` or
+            :code:`spectrum`
+
+        :returns: The arguments, starting with the command
+        :rtype: list
+        '''
+
+        ret = [command]
+
+        if isinstance(self.npix, (tuple, list)):
+            ret += ['npixx', '%d' % self.npix[0], 'npixy', '%d' % self.npix[1]]
+        else:
+            ret += ['npix', '%d' % self.npix]
+
+        ret += ['incl', repr(float(self.incl)), 'phi', repr(float(self.phi))]
+
+        for key in ['sizeau', 'posang', 'widthkms']:
+            val = getattr(self, key)
+            if val is not None: ret += [key, repr(float(val))]
+
+        for key in ['iline', 'imolspec', 'linenlam']:
+            val = getattr(self, key)
+            if val is not None: ret += [key, '%d' % val]
+
+        if self.lambdas() is not None:
+            ret += ['loadlambda']
+        elif self.lmbda is not None:
+            ret += ['lambda', repr(float(self.lmbda))]
+
+        return ret + self.options
+
+
+    def lambdas(self):
+        '''
+        Gives the wavelengths to write to
+        :code:`camera_wavelength_micron.inp`.
+
+        :returns: The wavelengths, or :code:`None` if this camera does not
+            need the file
+        :rtype: np.ndarray
+        '''
+
+        if self.lmbda is None or np.ndim(self.lmbda) == 0:
+            return None
+
+        return np.asarray(self.lmbda, dtype=np.float64)
+
+
+    @property
+    def binary(self):
+        '''Read-only; :code:`True` if RADMC3D writes a binary image.'''
+        return 'imageunform' in self.options
+
+
+
+class CameraResult(object):
+    '''
+    Outcome of one camera of an :class:`ImageBatch` or a :class:`SedBatch`.
+
+    :param int index: Position of the camera in the batch
+    :param Camera camera: The camera
+    '''
+
+    def __init__(self, index, camera):
+
+        self.index = index
+        self.camera = camera
+        self.run = None
+        self.image = None
+        self.spectrum = None
+        self.error = None
+
+
+    @property
+    def ok(self):
+        '''
+        Read-only; :code:`True` if the image or the spectrum was made and
+        read.
+        '''
+        return self.error is None and \
+            (self.image is not None or self.spectrum is not None)
+
+
+
+class ImageBatch(object):
+    '''
+    Makes the images of a list of cameras for one model. Each camera is run
+    by its own RADMC3D process, in its own :class:`~fileio.RunDirectory`
+    sharing the inputs of the model, so several can run at once; the
+    resulting cubes are moved back to the output directory as
+    :code:`stem_0000.out` (or :code:`.bout`), and so on, one per camera.
+    If all the cameras with several wavelengths share the same ones,
+    :code:`camera_wavelength_micron.inp` is written once and shared too.
+
+    :param Io io: The I/O context of the model, which must already be
+        committed (and have dust temperatures for continuum images)
+    :param list cameras: The cameras
+    :param int maxprocs: Maximum number of RADMC3D processes running at once
+    :param int threads: Number of threads per RADMC3D process, or
+        :code:`None` to leave it to RADMC3D
+    :param str stem: Name of the collected cubes, without the index
+    '''
+
+    def __init__(self, io, cameras, maxprocs=1, threads=None, stem='image'):
+
+        self._io = io
+        self._cameras = list(cameras)
+        self._maxprocs = maxprocs
+        self._threads = threads
+        self._stem = stem
+
+
+    def prepare(self):
+        '''
+        Private function. Writes :code:`camera_wavelength_micron.inp` to the
+        output directory if all the cameras that need it share it.
+
+        :returns: :code:`True` if the file was written and is shared
+        :rtype: bool
+        '''
+
+        lists = [c.lambdas() for c in self._cameras]
+        lists = [l for l in lists if l is not None]
+
+        if not lists or any(l.shape != lists[0].shape or
+        not np.array_equal(l, lists[0]) for l in lists):
+            return False
+
+        write_lambdas(self._io, lists[0])
+        return True
+
+
+    def run(self):
+        '''
+        Makes the images of all the cameras.
+
+        :returns: A :class:`CameraResult` per camera, in the order in which
+            the runs finish
+        :rtype: generator
+
+        :raises RuntimeError: if the user aborts clobbering a collected cube
+        '''
+
+        for fname in self.targets():
+            self._io.safe_check_clobber(fname)
+
+        shared = self.prepare()
+        pool = multiprocessing.pool.ThreadPool(self._maxprocs)
+
+        try:
+            tasks = [(i, c, shared) for i, c in enumerate(self._cameras)]
+            for result in pool.imap_unordered(self.run_camera, tasks):
+                yield result
+
+        finally:
+            pool.close()
+            pool.join()
+
+
+    def run_camera(self, args):
+        '''
+        Private function. Makes the image of one camera in a run directory
+        and collects it.
+        '''
+
+        index, camera, shared = args
+        result = CameraResult(index, camera)
+
+        try:
+            with self._io.rundir() as rd:
+                if camera.lambdas() is not None and not shared:
+                    write_lambdas(rd.io, camera.lambdas())
+
+                result.run = self.execute(camera.args(), rd)
+
+                ext = 'bout' if camera.binary else 'out'
+                fname = self.target(index, camera)
+                rd.collect('image.%s' % ext, fname, check=False)
+
+            result.image = Image(self._io, fname, camera.binary)
+
+        except Exception as e:
+            result.error = e
+
+        return result
+
+
+    def target(self, index, camera):
+        '''
+        Private function. Gives the name under which the image of a camera
+        is collected.
+        '''
+
+        ext = 'bout' if camera.binary else 'out'
+        return '%s_%04d.%s' % (self._stem, index, ext)
+
+
+    def targets(self):
+        '''
+        Private function. Lists the files collected into the output
+        directory, which are checked for clobbering before any run starts,
+        rather than in the worker threads.
+        '''
+
+        return [self.target(i, c) for i, c in enumerate(self._cameras)]
+
+
+    def execute(self, args, rd):
+        '''
+        Private function. Runs RADMC3D with the given arguments in a run
+        directory and waits for it to finish.
+
+        :raises RuntimeError: if RADMC3D fails
+        '''
+
+        cmd = ['radmc3d'] + args
+        env = None
+
+        if self._threads is not None:
+            cmd += ['setthreads', str(self._threads)]
+            env = dict(os.environ, OMP_NUM_THREADS=str(self._threads))
+
+        run = Run(cmd, rd.path, echo=False, env=env)
+
+        if run.wait() != 0:
+            raise RuntimeError('radmc3d exited with status %d' %
+                run.returncode)
+
+        return run
+
+
+    @property
+    def cameras(self):
+        '''Read-only; gives the cameras of this batch.'''
+        return self._cameras
+
+
+
+class SedBatch(ImageBatch):
+    '''
+    Makes the spectral energy distributions of a model, at the wavelengths
+    of :code:`wavelength_micron.inp`, seen from a list of viewing angles.
+    As for an :class:`ImageBatch`, each view is run by its own RADMC3D
+    process in its own :class:`~fileio.RunDirectory`, so several can run at
+    once; each :code:`spectrum.out` is read in its run directory, and
+    nothing is written to the output directory. Results can be taken as
+    they finish with :func:`run`, or all together with :func:`stack`:
+
+    .. code-block:: python
+
+       batch = r3d.SedBatch(sim.io, incl=np.linspace(0., 90., 10))
+
+       for result in batch.run():
+           print result.camera.incl, result.spectrum.flux.max()
+
+    :param Io io: The I/O context of the model, which must already be
+        committed, with dust temperatures
+    :param incl: Inclinations (in degrees)
+    :param phi: Azimuthal viewing angles (in degrees), broadcast against the
+        inclinations
+    :param int maxprocs: Maximum number of RADMC3D processes running at once
+    :param int threads: Number of threads per RADMC3D process, or
+        :code:`None` to leave it to RADMC3D
+    :param list options: Further arguments for RADMC3D, such as
+        :code:`nostar`
+    '''
+
+    def __init__(self, io, incl, phi=0., maxprocs=1, threads=None,
+    options=()):
+
+        incl, phi = np.broadcast_arrays(np.atleast_1d(incl), phi)
+        cameras = [Camera(incl=i, phi=p, options=options)
+            for i, p in zip(incl, phi)]
+
+        super(SedBatch, self).__init__(io, cameras, maxprocs, threads)
+
+
+    def targets(self):
+        '''Private function. Nothing is collected into the output directory.'''
+        return []
+
+
+    def run_camera(self, args):
+        '''
+        Private function. Makes the spectrum of one view in a run directory
+        and reads it.
+        '''
+
+        index, camera, _ = args
+        result = CameraResult(index, camera)
+
+        try:
+            with self._io.rundir() as rd:
+                result.run = self.execute(sed_args(camera), rd)
+                result.spectrum = Mapper().read_spectrum(rd.io)
+
+                if result.spectrum is None:
+                    raise RuntimeError('radmc3d wrote no spectrum.out')
+
+        except Exception as e:
+            result.error = e
+
+        return result
+
+
+    def stack(self):
+        '''
+        Makes the spectra of all the views and stacks them.
+
+        :returns: The fluxes (in :math:`\\textrm{erg} / \\textrm{s} /
+            \\textrm{cm}^2 / \\textrm{Hz}` at a distance of 1 parsec), with
+            one row per view and one column per wavelength of
+            :code:`wavelength_micron.inp`
+        :rtype: np.ndarray
+
+        :raises RuntimeError: if any of the views failed, or if their
+            spectra do not share the same wavelengths
+        '''
+
+        results = sorted(self.run(), key=lambda r: r.index)
+
+        for r in results:
+            if not r.ok:
+                raise RuntimeError('sed at incl %g, phi %g failed: %s' %
+                    (r.camera.incl, r.camera.phi, r.error))
+
+            if not np.array_equal(r.spectrum.lmbda,
+            results[0].spectrum.lmbda):
+                raise RuntimeError('sed at incl %g, phi %g has other '
+                    'wavelengths' % (r.camera.incl, r.camera.phi))
+
+        return np.stack([r.spectrum.flux for r in results])
+
+
+
+def sed_args(camera):
+    '''
+    Private function. Gives the arguments of the RADMC3D :code:`sed` command
+    for the viewing angles and options of a camera.
+    '''
+
+    return ['sed', 'incl', repr(float(camera.incl)),
+        'phi', repr(float(camera.phi))] + camera.options
+
+
+
+def write_lambdas(io, lmbda):
+    '''
+    Private function. Writes :code:`camera_wavelength_micron.inp`.
+    '''
+
+    with io.file_open_write('camera_wavelength_micron.inp') as f:
+        f.write('%d\n' % lmbda.shape[0])
+        io.write_ascii(f, lmbda)
+
+# vim: set ft=python:
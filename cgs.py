@@ -81,6 +81,11 @@ class cgs(object):
         '''Solar mass, g'''
         return 1.9885e33
 
+    @classproperty
+    def pc(self):
+        '''Parsec, cm'''
+        return 3.0856775814913673e18
+
     @classproperty
     def REarth(self):
         '''Earth radius, cm'''
@@ -91,6 +96,11 @@ class cgs(object):
         '''Solar radius, cm'''
         return 6.9551e10
 
+    @classproperty
+    def h(self):
+        '''Planck constant, erg s'''
+        return 6.6260755e-27
+
     @classproperty
     def k(self):
         '''Boltzmann constant, erg/K'''
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import subprocess
+from image import Image, Spectrum
+from camera import write_lambdas, sed_args
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class ChildSession(object):
+    '''
+    A RADMC3D process kept alive in child mode (:code:`radmc3d child`), in
+    which it reads the model once and then takes commands on its standard
+    input, writing results to its standard output. Making many images or
+    spectra of one model through a session therefore pays for loading the
+    grid, densities, temperatures and opacities only once, and results are
+    parsed straight from the pipe without temporary files.
+
+    Each session runs in its own :class:`~fileio.RunDirectory`, so that the
+    wavelength files it writes for its cameras do not disturb other
+    sessions. A session serves one request at a time; use a
+    :class:`SessionPool` to share sessions between threads. If a request
+    fails, its reply may be partly unread, so the process is killed and the
+    session can no longer be used. Sessions must be closed, or used in a
+    :code:`with` block.
+
+    :param Io io: The I/O context of the model, which must already be
+        committed
+    :param int threads: Number of threads of the RADMC3D process, or
+        :code:`None` to leave it to RADMC3D
+    '''
+
+    def __init__(self, io, threads=None):
+
+        self._lock = threading.Lock()
+        self._stderr = list()
+        self._rundir = io.rundir()
+
+        cmd = ['radmc3d', 'child']
+        env = None
+
+        if threads is not None:
+            cmd += ['setthreads', str(threads)]
+            env = dict(os.environ, OMP_NUM_THREADS=str(threads))
+
+        try:
+            self._proc = subprocess.Popen(cmd, cwd=self._rundir.path, env=env,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, universal_newlines=True)
+        except Exception:
+            self._rundir.cleanup()
+            raise
+
+        t = threading.Thread(target=self.pump)
+        t.daemon = True
+        t.start()
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, *exc):
+
+        self.close()
+
+
+    def pump(self):
+        '''
+        Private function. Collects the standard error of the process, so
+        that a full pipe can never stall it.
+        '''
+
+        for line in iter(self._proc.stderr.readline, ''):
+            self._stderr.append(line)
+
+
+    def send(self, args):
+        '''
+        Private function. Sends a command to the process, one argument per
+        line, followed by :code:`enter`.
+
+        :raises RuntimeError: if the process has exited
+        '''
+
+        if self._proc.poll() is not None:
+            raise RuntimeError('radmc3d child exited with status %d' %
+                self._proc.returncode)
+
+        self._proc.stdin.write(''.join('%s\n' % a for a in args + ['enter']))
+        self._proc.stdin.flush()
+
+
+    def prepare(self, camera):
+        '''
+        Private function. Writes the wavelengths of a camera, if it has
+        several, to the run directory of this session.
+        '''
+
+        if camera.lambdas() is not None:
+            write_lambdas(self._rundir.io, camera.lambdas())
+
+
+    def image(self, camera):
+        '''
+        Makes an image.
+
+        :param camera.Camera camera: The camera; binary output options are
+            ignored, since results are read from the pipe
+
+        :returns: The image cube, in memory
+        :rtype: image.Image
+        '''
+
+        with self._lock:
+            try:
+                self.prepare(camera)
+                self.send([a for a in camera.args('image')
+                    if a != 'imageunform'])
+                self.send(['writeimage'])
+                return Image.from_stream(self._proc.stdout)
+
+            except Exception:
+                self.abort()
+                raise
+
+
+    def spectrum(self, camera, command='spectrum'):
+        '''
+        Makes a spectrum.
+
+        :param camera.Camera camera: The camera, giving the viewing angles
+            and the wavelengths
+        :param str command: :code:`spectrum`, or :code:`sed` for the
+            wavelengths of the model
+
+        :returns: The spectrum
+        :rtype: image.Spectrum
+        '''
+
+        with self._lock:
+            try:
+                if command == 'sed':
+                    self.send(sed_args(camera))
+                else:
+                    self.prepare(camera)
+                    self.send(camera.args(command))
+
+                self.send(['writespec'])
+                return Spectrum.from_stream(self._proc.stdout)
+
+            except Exception:
+                self.abort()
+                raise
+
+
+    def abort(self):
+        '''
+        Private function. Kills the process after a failed request, so that
+        what is left of its reply is never read as the reply to another.
+        '''
+
+        if self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+
+
+    def close(self):
+        '''
+        Ends the process and removes the run directory of this session.
+        '''
+
+        with self._lock:
+            try:
+                if self._proc.poll() is None:
+                    self._proc.stdin.write('quit\n')
+                    self._proc.stdin.flush()
+                    self._proc.stdin.close()
+                    self._proc.wait()
+            except (IOError, OSError):
+                self._proc.kill()
+                self._proc.wait()
+            finally:
+                self._rundir.cleanup()
+
+
+    @property
+    def running(self):
+        '''Read-only; :code:`True` while the process is running.'''
+        return self._proc.poll() is None
+
+    @property
+    def stderr(self):
+        '''Read-only; gives the standard error of the process so far.'''
+        return ''.join(self._stderr)
+
+
+
+class SessionPool(object):
+    '''
+    Pool of :class:`ChildSession` objects for one model, shared between
+    threads. Sessions are started on demand, up to the size of the pool, and
+    handed to one thread at a time, so requests from many threads are served
+    concurrently by at most that many RADMC3D processes. For example, to
+    make 100 images of one model with 4 processes:
+
+    .. code-block:: python
+
+       with r3d.SessionPool(sim.io, size=4) as pool:
+           workers = multiprocessing.pool.ThreadPool(4)
+           images = workers.map(pool.image, cameras)
+
+    :param Io io: The I/O context of the model, which must already be
+        committed
+    :param int size: Maximum number of sessions
+    :param int threads: Number of threads of each RADMC3D process, or
+        :code:`None` to leave it to RADMC3D
+    '''
+
+    def __init__(self, io, size=1, threads=None):
+
+        self._io = io
+        self._size = size
+        self._threads = threads
+        self._sessions = list()
+        self._lock = threading.Lock()
+        self._idle = self.slots()
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, *exc):
+
+        self.close()
+
+
+    def slots(self):
+        '''
+        Private function. Makes the queue of idle sessions, holding one
+        :code:`None` per session yet to be started. The queue is last in,
+        first out, so that the session released last is reused first and
+        further sessions are only started when all others are busy.
+        '''
+
+        idle = queue.LifoQueue()
+        for _ in range(self._size): idle.put(None)
+        return idle
+
+
+    def acquire(self):
+        '''
+        Takes an idle session, starting one if fewer than :attr:`size` are
+        running, or waiting for one to be released otherwise.
+
+        :returns: The session, which must be handed back with
+            :func:`release`
+        :rtype: ChildSession
+        '''
+
+        idle = self._idle
+        session = idle.get()
+        if session is not None: return session
+
+        try:
+            session = ChildSession(self._io, self._threads)
+        except Exception:
+            idle.put(None)
+            raise
+
+        with self._lock:
+            self._sessions.append(session)
+
+        return session
+
+
+    def release(self, session, failed=False):
+        '''
+        Hands a session back to the pool. A session that failed, or whose
+        process has exited, is closed instead, and another is started in its
+        place on demand: after an error, its output may hold the rest of a
+        reply that would be taken for the next one.
+
+        :param ChildSession session: The session
+        :param bool failed: :code:`True` if the request made with the
+            session raised an exception
+        '''
+
+        if not failed and session.running:
+            self._idle.put(session)
+            return
+
+        session.close()
+
+        with self._lock:
+            if session not in self._sessions: return
+            self._sessions.remove(session)
+
+        self._idle.put(None)
+
+
+    def image(self, camera):
+        '''
+        Makes an image with an idle session; see :func:`ChildSession.image`.
+        '''
+
+        session = self.acquire()
+
+        try:
+            ret = session.image(camera)
+        except Exception:
+            self.release(session, failed=True)
+            raise
+
+        self.release(session)
+        return ret
+
+
+    def spectrum(self, camera, command='spectrum'):
+        '''
+        Makes a spectrum with an idle session; see
+        :func:`ChildSession.spectrum`.
+        '''
+
+        session = self.acquire()
+
+        try:
+            ret = session.spectrum(camera, command)
+        except Exception:
+            self.release(session, failed=True)
+            raise
+
+        self.release(session)
+        return ret
+
+
+    def close(self):
+        '''Closes all the sessions of this pool.'''
+
+        with self._lock:
+            sessions, self._sessions = self._sessions, list()
+
+        for session in sessions:
+            session.close()
+
+        self._idle = self.slots()
+
+
+    @property
+    def size(self):
+        '''Read-only; gives the maximum number of sessions.'''
+        return self._size
+
+# vim: set ft=python:
@@ -1,55 +1,359 @@
 # -*- coding: utf-8 -*-
 
 import abc
+import threading
+import collections
 import numpy as np
 
 
+class TransformCache(object):
+    '''
+    Memoizes transformed coordinate arrays, keyed by the target coordinate
+    system, so that each transformation is computed at most once while its
+    source coordinates stay the same. Every coordinate container has its own
+    unbounded cache; a grid shares one cache for its cell coordinates and
+    clears it whenever its axes change.
+
+    :param int maxbytes: Optional cap on the total size, in bytes, of the
+        cached arrays; the least recently used entries are evicted to stay
+        below it, and results larger than the cap are never stored
+    '''
+
+    def __init__(self, maxbytes=None):
+
+        self._entries = collections.OrderedDict()
+        self._nbytes = 0
+        self._maxbytes = maxbytes
+        self._lock = threading.Lock()
+
+
+    def __getstate__(self):
+        '''
+        Only the cap is kept when pickling or fingerprinting; the cached
+        arrays can always be computed again.
+        '''
+        return { 'maxbytes' : self._maxbytes }
+
+
+    def __setstate__(self, state):
+
+        self.__init__(state['maxbytes'])
+
+
+    def get(self, key):
+        '''
+        Looks up a cached transformation, marking it as recently used.
+
+        :param key: The target coordinate system
+
+        :returns: The cached arrays, or :code:`None` if there are none
+        :rtype: tuple
+        '''
+
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                return None
+
+            self._entries[key] = value
+            return value[0]
+
+
+    def put(self, key, value):
+        '''
+        Stores a transformation, evicting older entries as needed to honor
+        :attr:`maxbytes`.
+
+        :param key: The target coordinate system
+        :param tuple value: The transformed arrays
+        '''
+
+        nbytes = sum(np.asarray(a).nbytes for a in value)
+
+        with self._lock:
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key)[1]
+
+            if self._maxbytes is not None and nbytes > self._maxbytes:
+                return
+
+            self._entries[key] = (value, nbytes)
+            self._nbytes += nbytes
+            self.shrink()
+
+
+    def pop(self, key):
+        '''
+        Drops a cached transformation, if there is one.
+
+        :param key: The target coordinate system
+        '''
+
+        with self._lock:
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key)[1]
+
+
+    def evict(self):
+        '''Drops least recently used entries until under :attr:`maxbytes`.'''
+
+        with self._lock:
+            self.shrink()
+
+
+    def shrink(self):
+        '''Private function; :func:`evict` with the lock held.'''
+
+        while self._maxbytes is not None and self._nbytes > self._maxbytes:
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self._nbytes -= nbytes
+
+
+    def scope(self, scope):
+        '''
+        Gives a view of this cache in which keys are qualified by a scope, so
+        that several coordinate containers, such as the slabs of a grid, can
+        share this cache without their entries colliding.
+
+        :param scope: Any hashable value identifying the coordinates
+
+        :returns: The view, usable as the :attr:`~Coordinates.cache` of a
+            container
+        :rtype: CacheScope
+        '''
+
+        return CacheScope(self, scope)
+
+
+    def clear(self):
+        '''Drops all cached transformations.'''
+
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+
+    @property
+    def nbytes(self):
+        '''Read-only; gives the total size of the cached arrays in bytes.'''
+        return self._nbytes
+
+    @property
+    def maxbytes(self):
+        '''
+        Cap on the total size of the cached arrays in bytes, or :code:`None`
+        for no cap.
+        '''
+        return self._maxbytes
+
+    @maxbytes.setter
+    def maxbytes(self, val):
+        self._maxbytes = val
+        self.evict()
+
+
+
+class CacheScope(object):
+    '''
+    View of a :class:`TransformCache` for one scope; see
+    :func:`TransformCache.scope`. Entries count towards the
+    :attr:`~TransformCache.maxbytes` of the underlying cache, and are
+    dropped when it is cleared, or when the scope is.
+
+    :param TransformCache cache: The underlying cache
+    :param scope: The scope
+    '''
+
+    def __init__(self, cache, scope):
+
+        self._cache = cache
+        self._scope = scope
+        self._keys = set()
+
+
+    def get(self, key):
+        '''See :func:`TransformCache.get`.'''
+
+        return self._cache.get((self._scope, key))
+
+
+    def put(self, key, value):
+        '''See :func:`TransformCache.put`.'''
+
+        self._keys.add(key)
+        self._cache.put((self._scope, key), value)
+
+
+    def clear(self):
+        '''Drops the entries stored through this view.'''
+
+        for key in self._keys:
+            self._cache.pop((self._scope, key))
+
+        self._keys.clear()
+
+
+
 class Coordinates(object):
     '''
-    Base class for coordinate containers. All coordinates are expected to be
-    stored as Cartesian regardless of the coordinate system. This class is
-    then responsible for converting to any supported coordinate system.
+    Base class for coordinate containers. Each container remembers the
+    arrays it was constructed from in its own (native) coordinate system, so
+    transforming to that same system costs nothing. Other forms, including
+    the Cartesian one, are computed only when first needed and are then kept
+    in a :class:`TransformCache`; this class is responsible for converting
+    to any supported coordinate system.
     '''
 
     __metaclass__ = abc.ABCMeta
 
 
     @abc.abstractmethod
-    def __init__(self):
-        pass
+    def __init__(self, u, v, w):
+
+        self._native = (u, v, w)
+        self._cache = TransformCache()
 
 
-    def transformTo(self, sys):
+    @abc.abstractmethod
+    def to_cartesian(self):
+        '''
+        Subclasses must define this method, which computes the Cartesian
+        coordinates from the native ones.
+
+        :returns: The *x*, *y*, and *z* coordinates
+        :rtype: tuple
+        '''
+        raise NotImplementedError
+
+
+    def transformTo(self, sys, compact=False):
         '''
         Transforms the coordinates stored in this container to the coordinate
-        system specified.
+        system specified. If that is the native system of this container, the
+        original arrays are used as they were given; otherwise, the result
+        is memoized in :attr:`cache`.
+
+        A container may hold arrays that broadcast against each other rather
+        than full arrays, as grids give for their cells. By default, the
+        arrays are returned broadcast to their common shape, as read-only
+        views that take no extra memory, so they can be indexed, reshaped
+        and raveled like full arrays. Models that only combine them
+        arithmetically may ask for the arrays as they are instead, and then
+        only pay for the dimensions they use.
+
+        :param Coordinates sys: The coordinate system to transform to
+        :param bool compact: If :code:`True`, return the arrays as they are
+            stored, which may not have the full shape
+
+        :returns: The three coordinates
+        :rtype: tuple
+        '''
+
+        if sys == type(self):
+            ret = self._native
+
+        else:
+            ret = self._cache.get(sys)
+
+            if ret is None:
+                ret = self.transform(sys)
+                self._cache.put(sys, ret)
+
+        if compact or len(set(np.shape(a) for a in ret)) < 2:
+            return ret
+
+        return tuple(np.broadcast_arrays(*ret))
+
+
+    def transform(self, sys):
+        '''
+        Private function. Computes the transformation to a non-native
+        coordinate system without consulting the cache.
 
         :param Coordinates sys: The coordinate system to transform to
         '''
 
         if sys == CartesianCoordinates:
 
-            return self.x, self.y, self.z
+            return self.to_cartesian()
 
         elif sys == SphericalCoordinates:
 
-            r     = np.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
-            theta = np.mod(np.arctan2(np.sqrt(self.x * self.x +
-                self.y * self.y), self.z) + 2. * np.pi, 2. * np.pi)
-            phi   = np.mod(np.arctan2(self.y, self.x) + 2. * np.pi, 2. * np.pi)
+            if type(self) == CylindricalCoordinates:
+
+                s, phi, z = self._native
+                s, phi = wrap_polar(s, phi)
+
+                r     = np.sqrt(s * s + z * z)
+                theta = np.arctan2(s, z)
+
+                return r, theta, phi
+
+            x, y, z = self.transformTo(CartesianCoordinates, compact=True)
+
+            r     = np.sqrt(x * x + y * y + z * z)
+            theta = np.mod(np.arctan2(np.sqrt(x * x + y * y), z) +
+                2. * np.pi, 2. * np.pi)
+            phi   = np.mod(np.arctan2(y, x) + 2. * np.pi, 2. * np.pi)
 
             return r, theta, phi
 
         elif sys == CylindricalCoordinates:
 
-            s   = np.sqrt(self.x * self.x + self.y * self.y)
-            phi = np.mod(np.arctan2(self.y, self.x) + 2. * np.pi, 2. * np.pi)
+            if type(self) == SphericalCoordinates:
+
+                r, theta, phi = self._native
+                s, phi = wrap_polar(r * np.sin(theta), phi)
+
+                return s, phi, r * np.cos(theta)
 
-            return s, phi, self.z
+            x, y, z = self.transformTo(CartesianCoordinates, compact=True)
+
+            s   = np.sqrt(x * x + y * y)
+            phi = np.mod(np.arctan2(y, x) + 2. * np.pi, 2. * np.pi)
+
+            return s, phi, z
 
         raise NotImplementedError(sys)
 
 
+    @property
+    def native(self):
+        '''
+        Read-only; gives the arrays this container was constructed from, as
+        they were given.
+        '''
+        return self._native
+
+    @property
+    def cache(self):
+        '''
+        The :class:`TransformCache` holding transformations of these
+        coordinates; may be replaced to share a cache with its owner.
+        '''
+        return self._cache
+
+    @cache.setter
+    def cache(self, val):
+        self._cache = val
+
+    @property
+    def x(self):
+        '''Read-only; gives the Cartesian *x*-coordinate.'''
+        return self.transformTo(CartesianCoordinates)[0]
+
+    @property
+    def y(self):
+        '''Read-only; gives the Cartesian *y*-coordinate.'''
+        return self.transformTo(CartesianCoordinates)[1]
+
+    @property
+    def z(self):
+        '''Read-only; gives the Cartesian *z*-coordinate.'''
+        return self.transformTo(CartesianCoordinates)[2]
+
+
 
 class CartesianCoordinates(Coordinates):
     '''
@@ -62,9 +366,12 @@ class CartesianCoordinates(Coordinates):
 
     def __init__(self, x, y, z):
 
-        self.x = x
-        self.y = y
-        self.z = z
+        super(CartesianCoordinates, self).__init__(x, y, z)
+
+
+    def to_cartesian(self):
+
+        return self._native
 
 
 
@@ -79,9 +386,16 @@ class SphericalCoordinates(Coordinates):
 
     def __init__(self, r, theta, phi):
 
-        self.x = r * np.sin(theta) * np.cos(phi)
-        self.y = r * np.sin(theta) * np.sin(phi)
-        self.z = r * np.cos(theta)
+        super(SphericalCoordinates, self).__init__(r, theta, phi)
+
+
+    def to_cartesian(self):
+
+        r, theta, phi = self._native
+
+        return r * np.sin(theta) * np.cos(phi), \
+               r * np.sin(theta) * np.sin(phi), \
+               r * np.cos(theta)
 
 
 
@@ -96,6 +410,36 @@ class CylindricalCoordinates(Coordinates):
 
     def __init__(self, s, phi, z):
 
-        self.x = s * np.cos(phi)
-        self.y = s * np.sin(phi)
-        self.z = z
+        super(CylindricalCoordinates, self).__init__(s, phi, z)
+
+
+    def to_cartesian(self):
+
+        s, phi, z = self._native
+
+        return s * np.cos(phi), s * np.sin(phi), z
+
+
+
+def wrap_polar(s, phi):
+    '''
+    Private function. Brings a distance from the polar axis and an azimuth
+    into the ranges given by the transformations through Cartesian
+    coordinates: a negative distance, as found for polar angles beyond
+    :math:`\\pi`, is made positive by turning the azimuth half a turn, and
+    the azimuth is wrapped into :math:`[0, 2 \\pi)`.
+
+    :param np.ndarray s: The distance from the polar axis
+    :param np.ndarray phi: The azimuth
+
+    :returns: The distance and the azimuth
+    :rtype: tuple
+    '''
+
+    neg = np.asarray(s) < 0.
+
+    if np.any(neg):
+        phi = np.where(neg, phi + np.pi, phi)
+        s = np.abs(s)
+
+    return s, np.mod(phi, 2. * np.pi)
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import os
+import shutil
+import tempfile
 import numpy as np
+from parallel import pool_map
 
 
 class DustSpecies(object):
@@ -23,11 +27,17 @@ class DustSpecies(object):
         '''
         Evaluates the dust density (in :math:`\\textrm{g} / \\textrm{cm}^3`) at
         each of the input coordinates. Vector operations are highly advised.
+        Grid coordinates are transformed to full arrays of the grid shape by
+        default; a model that asks for them with :code:`compact=True` (see
+        :func:`~coordsys.Coordinates.transformTo`) gets arrays that broadcast
+        against each other instead, and if it depends on only some of them,
+        may return a correspondingly smaller array.
 
         :param Coordinates coords: The points at which to return the
             density
 
-        :returns: An array of densities
+        :returns: An array of densities, broadcastable to the shape of the
+            coordinates
         :rtype: np.ndarray
 
         :raises NotImplementedError: if the user does not define a density
@@ -49,16 +59,54 @@ class DustContainer(dict):
     If a duplicate name is used, the previous species will be overwritten.
     '''
 
-    def write(self, io, grid):
+    def write(self, io, grid, workers=1, executor='thread', only=None):
         '''
         Writes the current content of this container to input files for
         RADMC3D. This function uses the I/O context to determine the output
         format (binary or ASCII) and formats all files appropriately.
 
+        With more than one worker, the species are evaluated concurrently.
+        In binary mode, each worker writes its species straight into its own
+        region of the density file; in ASCII mode, each worker writes a
+        temporary file that is appended to the density file in order.
+
         :param fileio.Io io: Current I/O context
         :param grid.Grid grid: Current grid definition
+        :param int workers: Number of species to evaluate concurrently
+        :param str executor: Pool type; see :func:`parallel.make_pool`
+        :param only: Names of the species to rewrite in place in an existing
+            binary density file written for the same species and grid,
+            leaving the rest of the file untouched; :code:`None` (the
+            default) writes everything
+
+        :raises ValueError: if species are to be rewritten in ASCII mode
         '''
 
+        ext = 'binp' if io.binary else 'inp'
+        fname = '.'.join(['dust_density', ext])
+        itemsize = np.dtype(io.dtype).itemsize
+
+        hdr = np.empty((3,), dtype=np.int64)
+        hdr[0] = 1
+        hdr[1] = grid.nrcells
+        hdr[2] = len(self)
+
+        if io.binary:
+            hdr = np.insert(hdr, 1, [itemsize])
+
+        if only is not None:
+            if not io.binary:
+                raise ValueError('species can only be rewritten in binary files')
+
+            io.safe_check_clobber(fname)
+            io.file_detach(fname)
+
+            tasks = [(io, grid, d, fname, hdr.nbytes +
+                i * grid.nrcells * itemsize)
+                for i, (k, d) in enumerate(self.items()) if k in only]
+            pool_map(write_density, tasks, workers, executor)
+            return
+
         with io.file_open_write('dustopac.inp') as f:
             f.write('2\n')
             f.write('%d\n' % len(self))
@@ -69,35 +117,82 @@ class DustContainer(dict):
                 f.write('%s\n' % k)
                 f.write('%s\n' % ('=' * 80))
 
-        ext = 'binp' if io.binary else 'inp'
-        fname = '.'.join(['dust_density', ext])
-        sep = '' if io.binary else '\n'
-
         with io.file_open_write(fname) as f:
-            hdr = np.empty((3,), dtype=np.int64)
-            hdr[0] = 1
-            hdr[1] = grid.nrcells
-            hdr[2] = len(self)
+            io.write_array(f, hdr, '%d')
 
             if io.binary:
-                hdr = np.insert(hdr, 1, [np.dtype(io.dtype).itemsize])
+                io.file_reserve(f, hdr.nbytes + len(self) * grid.nrcells *
+                    itemsize)
 
-            hdr.tofile(f, sep=sep, format='%d')
-            if not io.binary: f.write('\n')
+                tasks = [(io, grid, d, fname, hdr.nbytes +
+                    i * grid.nrcells * itemsize)
+                    for i, d in enumerate(self.values())]
+                pool_map(write_density, tasks, workers, executor)
 
-            if io.binary:
-                for i, d in enumerate(self.values()):
-                    shape = grid.shape
-                    offset = hdr.nbytes + \
-                        i * grid.nrcells * np.dtype(io.dtype).itemsize
-
-                    density = io.memmap(fname, offset=offset, shape=shape,
-                        dtype=io.dtype, mode='w+')
-                    density[:] = d.density(grid.cellcoords)[:]
+            elif workers is None or workers <= 1:
+                for d in self.values():
+                    write_density((io, grid, d, f, 0))
 
             else:
-                for d in self.values():
-                    density = d.density(grid.cellcoords).ravel(order='F')
-                    density.tofile(f, sep=sep, format='%e')
+                parts = list()
+
+                try:
+                    for d in self.values():
+                        fd, part = tempfile.mkstemp(dir=io.outdir,
+                            prefix='.dust_density.')
+                        os.close(fd)
+                        parts.append(part)
+
+                    tasks = [(io, grid, d, part, 0)
+                        for d, part in zip(self.values(), parts)]
+                    pool_map(write_density, tasks, workers, executor)
+
+                    f.flush()
+                    for part in parts:
+                        with open(part, 'r') as g:
+                            shutil.copyfileobj(g, f)
+
+                finally:
+                    for part in parts:
+                        os.remove(part)
+
+
+
+def write_density(args):
+    '''
+    Private function. Evaluates the density of one dust species over the
+    grid, one chunk of :attr:`~fileio.Io.chunksize` cells at a time, and
+    writes it out. Defined at module level so that it can be handed to a
+    process pool.
+
+    :param tuple args: The I/O context, the grid, the species, and the
+        target: in binary mode, the name of the density file and the byte
+        offset of the species within it; in ASCII mode, an open file handle
+        or the name of a file to create, and an unused offset
+    '''
+
+    io, grid, species, target, offset = args
+    itemsize = np.dtype(io.dtype).itemsize
+
+    if io.binary:
+        for start, coords, shape in grid.chunks(io.chunksize):
+            density = io.memmap(target, offset=offset + start * itemsize,
+                shape=shape, dtype=io.dtype, mode='r+')
+            density[:] = species.density(coords)
+            density.flush()
+            del density
+
+        return
+
+    f = open(target, 'w') if isinstance(target, basestring) else target
+
+    try:
+        for start, coords, shape in grid.chunks(io.chunksize):
+            density = np.broadcast_to(species.density(coords),
+                shape).ravel(order='F')
+            io.write_ascii(f, density)
+
+    finally:
+        if f is not target: f.close()
 
 # vim: set ft=python:
@@ -2,7 +2,14 @@
 
 import re
 import os
+import errno
+import socket
+import copy
 import glob
+import shutil
+import tempfile
+import threading
+import time
 import numpy as np
 
 
@@ -19,13 +26,23 @@ class Io(object):
         self._binary = False
         self._precis = 8
         self._dtype = np.float64
+        self._chunksize = None
+        self._digits = 6
+        self._blocksize = 65536
+        self._index = None
+        self._scratch = None
 
 
     def smart_clean_outdir(self):
         '''
+        Removes the RADMC3D input and output files from the output
+        directory, along with run directories left behind by processes that
+        no longer exist; see :func:`clean_rundirs`.
         '''
 
-        p = re.compile(r'(.*?\.(binp|bdat))|(radmc3d\..*)|(^(?!(dustkappa|molecule)).*?\.inp)|(.*?\.vt[usk]{1})')
+        self.clean_rundirs()
+
+        p = re.compile(r'(.*?\.(binp|bdat))|(radmc3d\..*)|(^(?!(dustkappa|molecule)).*?\.inp)|(.*?\.p?vt[usrk]{1})')
 
         for dirpath, dirnames, filenames in os.walk(self._outdir):
             for f in filenames:
@@ -72,6 +89,66 @@ class Io(object):
             shape=shape, order='F')
 
 
+    def file_reserve(self, f, nbytes):
+        '''
+        Flushes an open file and extends it to the given size, so that regions
+        past the current end of the file can be mapped with :func:`memmap` in
+        :code:`r+` mode without truncating what has already been written.
+
+        :param file f: Open file handle
+        :param int nbytes: Total size of the file, in bytes
+        '''
+
+        f.flush()
+        f.truncate(nbytes)
+
+
+    def write_ascii(self, f, arr, fmt=None):
+        '''
+        Writes an array to an open file as ASCII text, one row per line. The
+        values are formatted a block of :attr:`blocksize` values at a time
+        with a single string operation, and each block is written with one
+        call, which is far faster than formatting element by element.
+
+        :param file f: Open file handle
+        :param np.ndarray arr: A 1D array, written one value per line, or a
+            2D array, written one row per line
+        :param str fmt: Format of a single value; defaults to scientific
+            notation with :attr:`digits` digits after the decimal point
+        '''
+
+        if fmt is None: fmt = '%%.%de' % self._digits
+
+        arr = np.asarray(arr)
+        if arr.ndim < 2: arr = arr.reshape((-1, 1))
+
+        ncols = arr.shape[1]
+        line = ' '.join([fmt] * ncols) + '\n'
+        step = max(1, self._blocksize // ncols)
+
+        for i in range(0, arr.shape[0], step):
+            block = arr[i:i+step]
+            f.write((line * block.shape[0]) % tuple(block.ravel().tolist()))
+
+
+    def write_array(self, f, arr, fmt=None):
+        '''
+        Writes an array to an open file in the format of the I/O context:
+        as raw bytes if :attr:`binary` is set, otherwise with
+        :func:`write_ascii`. The caller is responsible for the data type.
+
+        :param file f: Open file handle
+        :param np.ndarray arr: The array to write
+        :param str fmt: Format of a single value for ASCII output; see
+            :func:`write_ascii`
+        '''
+
+        if self._binary:
+            np.asarray(arr).tofile(f)
+        else:
+            self.write_ascii(f, arr, fmt)
+
+
     def safe_check_clobber(self, target):
         '''
         Checks whether it is safe to clobber a file. If the user has specified
@@ -111,19 +188,54 @@ class Io(object):
         return os.path.isfile(self.fullpath(target))
 
 
-    def file_open_write(self, target):
+    def file_open_write(self, target, check=True):
         '''
         Opens a file for writing, checking whether it is safe to clobber any
-        existing file by the same name before doing so.
+        existing file by the same name before doing so. An existing file is
+        removed rather than truncated, so that what is written never reaches
+        other links to it, such as those of run directories.
 
         :param str target: A filename relative to the global output directory
+        :param bool check: If :code:`False`, clobbering is not checked, which
+            the caller must then have done, for instance before handing the
+            file to a worker that cannot prompt
 
         :returns: A file pointer to the open file
         :rtype: file
         '''
 
-        self.safe_check_clobber(target)
-        return open(self.fullpath(target), 'w')
+        if check: self.safe_check_clobber(target)
+
+        fp = self.fullpath(target)
+        if os.path.lexists(fp): os.remove(fp)
+
+        f = open(fp, 'w')
+        self.update_index(target)
+        return f
+
+
+    def file_detach(self, target):
+        '''
+        Makes sure that a file can be modified in place without modifying
+        other links to it: if it has other hard links, or is a symbolic link,
+        it is replaced by a copy of its content.
+
+        :param str target: A filename relative to the global output directory
+        '''
+
+        fp = self.fullpath(target)
+        if not os.path.islink(fp) and os.stat(fp).st_nlink < 2: return
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fp) or '.',
+            prefix='.tmp')
+        os.close(fd)
+
+        try:
+            shutil.copy2(fp, tmp)
+            os.rename(tmp, fp)
+        except Exception:
+            os.remove(tmp)
+            raise
 
 
     def file_open_read(self, target):
@@ -140,9 +252,58 @@ class Io(object):
         return open(self.fullpath(target), 'r')
 
 
+    def rundir(self, keep=False, outputs=()):
+        '''
+        Creates an ephemeral run directory sharing the inputs of the output
+        directory, in the :attr:`scratch` directory if one is set; see
+        :class:`RunDirectory`.
+
+        :param bool keep: If :code:`True`, the directory is not removed when
+            it is cleaned up, which helps to debug failed runs
+        :param list outputs: File name patterns of the outputs that are moved
+            into the output directory on leaving a :code:`with` block
+            without an error
+
+        :returns: The run directory
+        :rtype: RunDirectory
+        '''
+
+        return RunDirectory(self, self._scratch, keep, outputs)
+
+
+    def clean_rundirs(self):
+        '''
+        Removes the run directories left in the output directory and in the
+        :attr:`scratch` directory by processes of this host that no longer
+        exist, such as runs that were killed; see :func:`RunDirectory.purge`.
+
+        :returns: The paths of the removed directories
+        :rtype: list
+        '''
+
+        ret = RunDirectory.purge(self._outdir)
+
+        if self._scratch is not None:
+            ret += RunDirectory.purge(self._scratch)
+
+        return ret
+
+
     def file_remove(self, target):
         self.safe_check_clobber(target)
         os.remove(self.fullpath(target))
+        self.update_index(target)
+
+
+    def update_index(self, target):
+        '''
+        Private function. Records in the index of the output directory, if
+        it has been created, whether a file written or removed through this
+        context exists.
+        '''
+
+        if self._index is not None:
+            self._index.update(target)
 
 
     @property
@@ -153,6 +314,32 @@ class Io(object):
     @outdir.setter
     def outdir(self, val):
         self._outdir = val
+        self._index = None
+
+    @property
+    def index(self):
+        '''
+        Read-only; gives the :class:`DirectoryIndex` of the output directory,
+        which is created on first use.
+        '''
+        if self._index is None:
+            self._index = DirectoryIndex(self)
+        return self._index
+
+    @property
+    def scratch(self):
+        '''
+        Directory in which run directories are created, or :code:`None` to
+        create them in the output directory. A directory on a local or
+        in-memory file system, such as :code:`/dev/shm`, keeps the outputs
+        of concurrent runs off a shared one; inputs are then symbolically
+        linked, since hard links cannot cross file systems.
+        '''
+        return self._scratch
+
+    @scratch.setter
+    def scratch(self, val):
+        self._scratch = val
 
     @property
     def clobber(self):
@@ -207,4 +394,554 @@ class Io(object):
         '''Read-only; gives the current float data type as a NumPy dtype.'''
         return self._dtype
 
+    @property
+    def digits(self):
+        '''
+        Number of digits after the decimal point used for floating-point
+        values in ASCII input files; defaults to 6. Fewer digits give
+        smaller files that are faster to write and read.
+        '''
+        return self._digits
+
+    @digits.setter
+    def digits(self, val):
+        self._digits = val
+
+    @property
+    def blocksize(self):
+        '''
+        Number of values formatted and written at once by
+        :func:`write_ascii`; defaults to 65536.
+        '''
+        return self._blocksize
+
+    @blocksize.setter
+    def blocksize(self, val):
+        self._blocksize = val
+
+    @property
+    def chunksize(self):
+        '''
+        Maximum number of grid cells for which model quantities are evaluated
+        and written at once, or :code:`None` to process the whole grid in one
+        pass. Setting this bounds the peak memory used while writing input
+        files, independent of the grid size: the coordinates of only one
+        chunk, and their transformations, are kept at a time.
+        '''
+        return self._chunksize
+
+    @chunksize.setter
+    def chunksize(self, val):
+        self._chunksize = val
+
+
+
+
+class RunDirectory(object):
+    '''
+    Ephemeral directory in which RADMC3D can be run next to other runs on
+    the same model. RADMC3D writes its outputs under fixed names in its
+    working directory, so concurrent runs must not share one; instead, each
+    gets a directory of its own, created inside the output directory or a
+    scratch directory, into which the input files of the model are hard
+    linked, so that nothing is copied. Where hard links cannot be made, for
+    instance across file systems, symbolic links are made instead. Either
+    way, the linked files share their content with the originals and must
+    not be modified in place: remove a linked file before writing a
+    replacement for it, as :func:`Io.file_open_write` does, or detach it
+    with :func:`Io.file_detach`. Inputs matching the outputs of the run are
+    not linked at all, since RADMC3D rewrites its outputs in place.
+
+    Outputs are moved into the output directory of the model with
+    :func:`collect`, or, for those matching the given patterns, on leaving a
+    :code:`with` block without an error. The directory is then removed,
+    unless it is kept:
+
+    .. code-block:: python
+
+       with sim.io.rundir(outputs=['spectrum.out']) as rd:
+           r3d.execute('radmc3d sed incl 45', rd.path)
+
+    The directory records the host and the process that own it, so that
+    directories left behind by killed processes can be removed with
+    :func:`purge`.
+
+    :param Io io: The I/O context of the model
+    :param str root: Directory in which to create this directory, or
+        :code:`None` for the output directory of the model
+    :param bool keep: If :code:`True`, :func:`cleanup` leaves this directory
+        in place
+    :param list outputs: File name patterns of the outputs to collect on
+        leaving a :code:`with` block
+    '''
+
+    shared = ['radmc3d.inp', 'amr_grid.*inp', 'wavelength_micron.inp',
+        'camera_wavelength_micron.inp', 'mcmono_wavelength_micron.inp',
+        'stars.inp', 'external_source.inp', 'stellarsrc_*.*inp',
+        'dustopac.inp', 'dustkap*.inp', 'dust_density.*inp',
+        'dust_temperature.*dat', 'line.inp', 'molecule_*.inp',
+        'numberdens_*.*inp', 'gas_*.*inp', 'microturbulence.*inp']
+    '''File name patterns of the inputs that are linked into the directory.'''
+
+    owner = '.owner'
+    '''
+    Name of the file recording the owner of the directory, as
+    :code:`hostname:pid`.
+    '''
+
+    def __init__(self, io, root=None, keep=False, outputs=()):
+
+        self._master = io
+        self._keep = keep
+        self._outputs = list(outputs)
+        self._path = tempfile.mkdtemp(prefix='.run',
+            dir=root if root is not None else io.outdir)
+
+        self._io = copy.copy(io)
+        self._io.outdir = self._path
+        self._io.clobber = True
+
+        try:
+            with open(os.path.join(self._path, self.owner), 'w') as f:
+                f.write('%s:%d\n' % (socket.gethostname(), os.getpid()))
+
+            outputs = set()
+            for p in self._outputs:
+                outputs.update(os.path.basename(f)
+                    for f in glob.glob(io.fullpath(p)))
+
+            for name in self.inputs():
+                if name not in outputs:
+                    self.link(io.fullpath(name), self._io.fullpath(name))
+
+        except Exception:
+            shutil.rmtree(self._path, ignore_errors=True)
+            raise
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, exc_type, *exc):
+
+        try:
+            if exc_type is None: self.collect_outputs()
+        finally:
+            self.cleanup()
+
+
+    @staticmethod
+    def link(src, dst):
+        '''
+        Private function. Hard links a file, or symbolically links it if that
+        fails.
+        '''
+
+        try:
+            os.link(src, dst)
+        except OSError:
+            os.symlink(os.path.abspath(src), dst)
+
+
+    @classmethod
+    def purge(cls, path):
+        '''
+        Removes the run directories in a directory whose owning process no
+        longer exists. Only directories owned by this host are considered,
+        since processes on other hosts sharing the directory cannot be
+        checked; directories that do not record their owner are left alone
+        too.
+
+        :param str path: The directory to search
+
+        :returns: The paths of the removed directories
+        :rtype: list
+        '''
+
+        ret = list()
+        host = socket.gethostname()
+
+        for d in glob.glob(os.path.join(path, '.run*')):
+            try:
+                with open(os.path.join(d, cls.owner)) as f:
+                    owner, pid = f.read().strip().rsplit(':', 1)
+                    pid = int(pid)
+            except (IOError, OSError, ValueError):
+                continue
+
+            if owner != host: continue
+
+            try:
+                os.kill(pid, 0)
+                continue
+            except OSError as e:
+                if e.errno != errno.ESRCH: continue
+
+            shutil.rmtree(d, ignore_errors=True)
+            ret.append(d)
+
+        return ret
+
+
+    def inputs(self):
+        '''
+        Lists the input files of the output directory of the model.
+
+        :returns: File names relative to the output directory
+        :rtype: list
+        '''
+
+        names = set()
+
+        for p in self.shared:
+            names.update(os.path.basename(f)
+                for f in glob.glob(self._master.fullpath(p)))
+
+        return sorted(names)
+
+
+    def collect(self, name, target=None, check=True):
+        '''
+        Moves an output file from this directory into the output directory
+        of the model.
+
+        :param str name: The file name in this directory
+        :param str target: The file name in the output directory of the
+            model; defaults to :code:`name`
+        :param bool check: If :code:`False`, the target is replaced without
+            checking whether it may be clobbered, which the caller must then
+            have done; the check may prompt the user, so worker threads
+            should leave it to the main thread
+        '''
+
+        target = target if target is not None else name
+        if check: self._master.safe_check_clobber(target)
+        shutil.move(self._io.fullpath(name), self._master.fullpath(target))
+        self._master.update_index(target)
+
+
+    def collect_outputs(self):
+        '''
+        Moves the files of this directory that match :attr:`outputs` into
+        the output directory of the model.
+
+        :returns: The names of the moved files
+        :rtype: list
+        '''
+
+        names = set()
+
+        for p in self._outputs:
+            names.update(os.path.basename(f)
+                for f in glob.glob(self._io.fullpath(p)))
+
+        names = sorted(names)
+
+        for name in names:
+            self.collect(name)
+
+        return names
+
+
+    def cleanup(self):
+        '''Removes this directory and everything in it, unless it is kept.'''
+
+        if not self._keep:
+            shutil.rmtree(self._path, ignore_errors=True)
+
+
+    @property
+    def path(self):
+        '''Read-only; gives the path of this directory.'''
+        return self._path
+
+    @property
+    def io(self):
+        '''Read-only; gives an I/O context for this directory.'''
+        return self._io
+
+    @property
+    def master(self):
+        '''Read-only; gives the I/O context of the model.'''
+        return self._master
+
+    @property
+    def keep(self):
+        ''':code:`True` if :func:`cleanup` leaves this directory in place.'''
+        return self._keep
+
+    @keep.setter
+    def keep(self, val):
+        self._keep = val
+
+    @property
+    def outputs(self):
+        '''
+        Read-only; gives the file name patterns of the outputs collected on
+        leaving a :code:`with` block.
+        '''
+        return self._outputs
+
+
+
+class FieldHeader(object):
+    '''
+    Describes the header of a RADMC3D field file, as recorded by
+    :class:`DirectoryIndex`.
+
+    :param str fname: The file name, relative to the output directory
+    :param bool binary: :code:`True` if the file is binary
+    :param int precis: Bytes per value (always 8 for ASCII files)
+    :param int nrcells: Number of cells
+    :param int nrspec: Number of species, or :code:`None` if the file has no
+        species count
+    :param int count: Number of integers in the header
+    '''
+
+    def __init__(self, fname, binary, precis, nrcells, nrspec, count):
+
+        self.fname = fname
+        self.binary = binary
+        self.precis = precis
+        self.dtype = np.float64 if precis == 8 else np.float32
+        self.nrcells = nrcells
+        self.nrspec = nrspec
+        self.count = count
+        self.offset = count * np.dtype(np.int64).itemsize if binary else None
+
+
+
+class DirectoryIndex(object):
+    '''
+    Index of the files in the output directory of an I/O context. The
+    directory is listed once and listed again only when its modification
+    time changes. Species lists and field headers are parsed once per file
+    and parsed again only when the modification time or size of that file
+    changes, so repeated reads of the same directory do not repeatedly open
+    and parse the same metadata.
+
+    Modification times may only have a granularity of a second or more, so
+    a change made within that time of a listing or a parse could go
+    unnoticed. A listing or a parse is therefore only reused if the
+    directory or the file was already older than :attr:`racy` when it was
+    made; the listing is then trusted, so looking up a missing file costs
+    nothing but a check of the directory. Files written or removed through
+    the I/O context are recorded as they are, without listing again.
+
+    :param Io io: The I/O context whose output directory is indexed
+    '''
+
+    racy = 2.
+    '''
+    Minimum age in seconds of the directory or of a file for its listing or
+    its parsed content to be reused while its modification time is
+    unchanged.
+    '''
+
+    def __init__(self, io):
+
+        self._io = io
+        self._dirmtime = None
+        self._files = frozenset()
+        self._parsed = dict()
+        self._lock = threading.Lock()
+
+
+    def __getstate__(self):
+        '''
+        Only the I/O context is kept when pickling or copying; the directory
+        is listed again on first use.
+        '''
+        return { 'io' : self._io }
+
+
+    def __setstate__(self, state):
+
+        self.__init__(state['io'])
+
+
+    def refresh(self, force=False):
+        '''
+        Lists the output directory again if it has changed since it was last
+        listed, or if it had changed too recently to tell.
+
+        :param bool force: List the directory even if it has not changed
+        '''
+
+        mtime = os.stat(self._io.outdir).st_mtime
+
+        if force or mtime != self._dirmtime:
+            listed = time.time()
+            files = frozenset(f for f in os.listdir(self._io.outdir)
+                if os.path.isfile(self._io.fullpath(f)))
+
+            with self._lock:
+                self._files = files
+                self._dirmtime = mtime if listed - mtime > self.racy else None
+
+
+    def update(self, fname):
+        '''
+        Private function. Records whether a file that was just written or
+        removed exists, so that the listing stays correct without listing
+        the directory again.
+        '''
+
+        exists = os.path.isfile(self._io.fullpath(fname))
+
+        with self._lock:
+            if exists:
+                self._files = self._files | frozenset([fname])
+            else:
+                self._files = self._files - frozenset([fname])
+
+
+    def exists(self, fname):
+        '''
+        Checks whether the given file exists.
+
+        :param str fname: A filename relative to the output directory
+
+        :returns: :code:`True` if the file exists, :code:`False` otherwise
+        :rtype: bool
+        '''
+
+        self.refresh()
+        return fname in self._files
+
+
+    def find(self, stem, inp=True):
+        '''
+        Finds the ASCII or binary variant of a field file; if both exist, the
+        ASCII variant is preferred.
+
+        :param str stem: The file name without extension
+        :param bool inp: :code:`True` for an input file (:code:`.inp` or
+            :code:`.binp`), :code:`False` for an output file (:code:`.dat` or
+            :code:`.bdat`)
+
+        :returns: The file name and :code:`True` if it is binary, or
+            :code:`None` if neither variant exists
+        :rtype: tuple
+        '''
+
+        ext = 'inp' if inp else 'dat'
+
+        for e, binary in [(ext, False), ('b' + ext, True)]:
+            fname = '.'.join([stem, e])
+            if self.exists(fname): return fname, binary
+
+        return None
+
+
+    def parsed(self, fname, parse):
+        '''
+        Private function. Returns the cached result of parsing a file, parsing
+        it again if the file has changed.
+
+        :param str fname: A filename relative to the output directory
+        :param parse: Function of an open file handle that parses it
+
+        :returns: The parsed result, or :code:`None` if the file does not
+            exist
+        '''
+
+        try:
+            st = os.stat(self._io.fullpath(fname))
+        except OSError:
+            self._parsed.pop(fname, None)
+            return None
+
+        stamp = (st.st_mtime, st.st_size)
+        entry = self._parsed.get(fname)
+
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+
+        parsed = time.time()
+
+        with self._io.file_open_read(fname) as f:
+            entry = (stamp, parse(f))
+
+        if parsed - st.st_mtime > self.racy:
+            self._parsed[fname] = entry
+        else:
+            self._parsed.pop(fname, None)
+
+        return entry[1]
+
+
+    def dust_species(self):
+        '''
+        Gives the names of the dust species listed in :code:`dustopac.inp`.
+
+        :returns: The species names, or :code:`None` if there is no file
+        :rtype: list
+        '''
+
+        def parse(f):
+            lines = [l.split() for l in f.read().splitlines()]
+            nrspec = int(lines[1][0])
+            return [lines[5 + 4 * i][0] for i in range(nrspec)]
+
+        return self.parsed('dustopac.inp', parse)
+
+
+    def line_species(self):
+        '''
+        Gives the names of the molecules listed in :code:`line.inp`.
+
+        :returns: The molecule names, or :code:`None` if there is no file
+        :rtype: list
+        '''
+
+        def parse(f):
+            lines = [l.split() for l in f.read().splitlines()]
+            nrspec = int(lines[1][0])
+            names, i = list(), 2
+
+            for _ in range(nrspec):
+                names.append(lines[i][0])
+                i += 1 + int(lines[i][4])
+
+            return names
+
+        return self.parsed('line.inp', parse)
+
+
+    def header(self, stem, inp=True, nrspec=False):
+        '''
+        Gives the header of the ASCII or binary variant of a field file.
+
+        :param str stem: The file name without extension
+        :param bool inp: :code:`True` for an input file, :code:`False` for an
+            output file; see :func:`find`
+        :param bool nrspec: :code:`True` if the header includes a number of
+            species, as for dust fields
+
+        :returns: The header, or :code:`None` if neither variant exists
+        :rtype: FieldHeader
+        '''
+
+        found = self.find(stem, inp)
+        if found is None: return None
+
+        fname, binary = found
+        count = (3 if nrspec else 2) + (1 if binary else 0)
+
+        def parse(f):
+            if binary:
+                hdr = np.fromfile(f, count=count, dtype=np.int64)
+                precis, rest = hdr[1], hdr[2:]
+            else:
+                hdr = np.fromfile(f, sep=' ', count=count, dtype=np.int64)
+                precis, rest = 8, hdr[1:]
+
+            return FieldHeader(fname, binary, int(precis), int(rest[0]),
+                int(rest[1]) if nrspec else None, count)
+
+        return self.parsed(fname, parse)
+
 # vim: set ft=python:
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import numpy as np
+
+
+def fingerprint(*objs):
+    '''
+    Computes a digest of the content of the given objects, so that a change
+    to any of them can be detected without keeping a copy. Arrays are hashed
+    by type, shape and data; containers by their items; classes by their
+    qualified names; and other objects by their class and their attributes
+    (as returned by :code:`__getstate__` if they define it, so that caches
+    can be left out).
+
+    :param objs: The objects to fingerprint
+
+    :returns: The hexadecimal digest
+    :rtype: str
+    '''
+
+    h = hashlib.sha1()
+    for obj in objs: update(h, obj, dict())
+    return h.hexdigest()
+
+
+def update(h, obj, seen):
+    '''
+    Private function. Feeds the content of one object into a hash.
+
+    :param h: The hash object
+    :param obj: The object to add
+    :param dict seen: The containers and objects currently being hashed,
+        keyed by identity, used to stop at reference cycles
+    '''
+
+    if isinstance(obj, np.ndarray):
+        h.update(('ndarray %s %r ' % (obj.dtype.str, obj.shape)).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+
+    elif obj is None or isinstance(obj, (bool, int, float, complex, str,
+    type(u''), np.generic)):
+        h.update(('%s %r ' % (type(obj).__name__, obj)).encode('utf-8'))
+
+    elif isinstance(obj, type):
+        h.update(('type %s.%s ' % (obj.__module__, obj.__name__)).encode())
+
+    elif id(obj) in seen:
+        h.update(b'cycle ')
+
+    else:
+        seen[id(obj)] = obj
+
+        try:
+            update_members(h, obj, seen)
+        finally:
+            del seen[id(obj)]
+
+
+def update_members(h, obj, seen):
+    '''
+    Private function. Feeds the members of a container or object into a
+    hash; see :func:`update`.
+    '''
+
+    if isinstance(obj, dict):
+        h.update(('%s %d ' % (type(obj).__name__, len(obj))).encode())
+
+        for k in sorted(obj.keys(), key=repr):
+            update(h, k, seen)
+            update(h, obj[k], seen)
+
+        if type(obj) is not dict:
+            update(h, obj.__dict__, seen)
+
+    elif isinstance(obj, (list, tuple)):
+        h.update(('%s %d ' % (type(obj).__name__, len(obj))).encode())
+        for item in obj: update(h, item, seen)
+
+    elif hasattr(obj, '__getstate__') or hasattr(obj, '__dict__'):
+        h.update(('object %s.%s ' % (type(obj).__module__,
+            type(obj).__name__)).encode())
+        state = obj.__getstate__() if hasattr(obj, '__getstate__') \
+            else obj.__dict__
+        update(h, state, seen)
+
+    else:
+        h.update(('%s %r ' % (type(obj).__name__, obj)).encode('utf-8'))
+
+# vim: set ft=python:
@@ -2,6 +2,7 @@
 
 import numpy as np
 from mapper import *
+from parallel import pool_map
 
 
 class GasModel(object):
@@ -92,14 +93,23 @@ class MoleculeContainer(dict):
     If a duplicate name is used, the previous species will be overwritten.
     '''
 
-    def write(self, io, grid):
+    def write(self, io, grid, workers=1, executor='thread'):
         '''
         Writes the current content of this container to input files for
         RADMC3D. This function uses the I/O context to determine the output
         format (binary or ASCII) and formats all files appropriately.
 
+        The gas density is evaluated once; with more than one worker, the
+        number density files of the molecules are then written concurrently.
+        Each worker scales the density for its molecule as it writes, so
+        there is one number density array in memory per worker at most. A
+        thread pool shares the density array with its workers, whereas a
+        process pool receives a copy of it.
+
         :param fileio.Io io: Current I/O context
         :param grid.Grid grid: Current grid definition
+        :param int workers: Number of files to write concurrently
+        :param str executor: Pool type; see :func:`parallel.make_pool`
         '''
 
         with io.file_open_write('line.inp') as f:
@@ -125,59 +135,50 @@ class MoleculeContainer(dict):
 
         ext = 'binp' if io.binary else 'inp'
         fname = '.'.join(['gas_temperature', ext])
-        sep = '' if io.binary else '\n'
 
         with io.file_open_write(fname) as f:
-            hdr.tofile(f, sep=sep, format='%d')
-            if not io.binary: f.write('\n')
+            io.write_array(f, hdr, '%d')
 
             if io.binary:
                 shape = grid.shape
                 offset = hdr.nbytes
+                io.file_reserve(f, offset + grid.nrcells * hdr[1])
 
                 gastemp = io.memmap(fname, offset=offset, shape=shape,
-                    dtype=io.dtype, mode='w+')
-                gastemp[:] = self.model.temperature(grid.cellcoords, simvars)[:]
+                    dtype=io.dtype, mode='r+')
+                gastemp[:] = self.model.temperature(grid.cellcoords, simvars)
+                gastemp.flush()
+                del gastemp
 
             else:
-                gastemp = self.model.temperature(grid.cellcoords, simvars).\
-                    ravel(order='F')
-                gastemp.tofile(f, sep=sep, format='%e')
+                gastemp = np.broadcast_to(self.model.temperature(
+                    grid.cellcoords, simvars), grid.shape).ravel(order='F')
+                io.write_ascii(f, gastemp)
 
         density = self.model.density(grid.cellcoords, simvars)
 
-        for k, g in zip(self.keys(), self.values()):
-            fname = '.'.join(['numberdens_%s' % k, ext])
-            number_density = density * g.X / g.mass
-
-            with io.file_open_write(fname) as f:
-                hdr.tofile(f, sep=sep, format='%d')
-                if not io.binary: f.write('\n')
+        names = ['.'.join(['numberdens_%s' % k, ext]) for k in self.keys()]
 
-                if io.binary:
-                    shape = grid.shape
-                    offset = hdr.nbytes
+        # Workers cannot prompt, so clobbering is checked here
+        for name in names:
+            io.safe_check_clobber(name)
 
-                    numdens = io.memmap(fname, offset=offset, shape=shape,
-                        dtype=io.dtype, mode='w+')
-                    numdens[:] = number_density
-
-                else:
-                    numdens = number_density.ravel(order='F')
-                    numdens.tofile(f, sep=sep, format='%e')
+        tasks = [(io, grid, hdr, name, density, g.X / g.mass)
+            for name, g in zip(names, self.values())]
+        pool_map(write_numberdens, tasks, workers, executor)
 
         fname = '.'.join(['gas_velocity', ext])
 
         with io.file_open_write(fname) as f:
-            hdr.tofile(f, sep=sep, format='%d')
-            if not io.binary: f.write('\n')
+            io.write_array(f, hdr, '%d')
 
             shape = (3,) + grid.shape
 
             if io.binary:
                 offset = hdr.nbytes
+                io.file_reserve(f, offset + 3 * grid.nrcells * hdr[1])
                 gasvel = io.memmap(fname, offset=offset, shape=shape,
-                    dtype=io.dtype, mode='w+')
+                    dtype=io.dtype, mode='r+')
             else:
                 gasvel = np.empty(shape, dtype=io.dtype)
 
@@ -188,7 +189,7 @@ class MoleculeContainer(dict):
                 gasvel = np.column_stack((gasvel[0,:,:,:].ravel(order='F'),
                     gasvel[1,:,:,:].ravel(order='F'),
                     gasvel[2,:,:,:].ravel(order='F')))
-                gasvel.tofile(f, sep='\n', format='%e')
+                io.write_ascii(f, gasvel)
 
 
     @property
@@ -201,4 +202,38 @@ class MoleculeContainer(dict):
         ''' '''
         self._model = m
 
+
+
+def write_numberdens(args):
+    '''
+    Private function. Writes the number density file of one molecule, which
+    is the gas density scaled by the abundance of the molecule over its
+    mass. Defined at module level so that it can be handed to a process
+    pool; the caller must check beforehand that the file may be clobbered.
+
+    :param tuple args: The I/O context, the grid, the file header, the file
+        name, the gas density array, and the scale factor of the molecule
+    '''
+
+    io, grid, hdr, fname, density, scale = args
+
+    with io.file_open_write(fname, check=False) as f:
+        io.write_array(f, hdr, '%d')
+
+        if io.binary:
+            shape = grid.shape
+            offset = hdr.nbytes
+            io.file_reserve(f, offset + grid.nrcells * hdr[1])
+
+            numdens = io.memmap(fname, offset=offset, shape=shape,
+                dtype=io.dtype, mode='r+')
+            np.multiply(density, scale, out=numdens)
+            numdens.flush()
+            del numdens
+
+        else:
+            numdens = np.empty(grid.shape, dtype=np.float64, order='F')
+            np.multiply(density, scale, out=numdens)
+            io.write_ascii(f, numdens.ravel(order='F'))
+
 # vim: set ft=python:
@@ -2,10 +2,14 @@
 
 import numpy as np
 from coordsys import CartesianCoordinates, SphericalCoordinates, \
-    CylindricalCoordinates
+    CylindricalCoordinates, TransformCache
 from vectorsys import CartesianVectorField, SphericalVectorField, \
     CylindricalVectorField
-import cyvtk as vtk
+
+try:
+    import cyvtk as vtk
+except ImportError:
+    vtk = None
 
 
 class Grid(object):
@@ -23,6 +27,7 @@ class Grid(object):
         self._nu = self._nv = self._nw = 0
         self._ptcoords = None
         self._cellcoords = None
+        self._transform_cache = TransformCache()
 
         self._coordsys = CartesianCoordinates
         self._u = np.empty((0,))
@@ -30,6 +35,17 @@ class Grid(object):
         self._w = np.empty((0,))
 
 
+    def __getstate__(self):
+        '''
+        Drops cached coordinates when pickling, for example when the grid is
+        handed to a process pool; they are rebuilt on demand.
+        '''
+        state = self.__dict__.copy()
+        state['_ptcoords'] = None
+        state['_cellcoords'] = None
+        return state
+
+
     def write(self, io):
         '''
         Writes a grid definition to a file.
@@ -47,6 +63,21 @@ class Grid(object):
         raise NotImplementedError
 
 
+    def chunks(self, size=None):
+        '''
+        Iterates over the cells of this grid in pieces that are contiguous
+        in the order RADMC3D expects for its input files.
+
+        :param int size: Maximum number of cells per piece, or :code:`None`
+            for the whole grid at once
+
+        :returns: Tuples of the offset (in cells) of the piece, the cell
+            coordinates of the piece, and its shape
+        :rtype: generator
+        '''
+        raise NotImplementedError
+
+
     @property
     def ptcoords(self):
         '''Read-only; gives the point coordinates of this grid.'''
@@ -61,6 +92,20 @@ class Grid(object):
         '''
         return self._cellcoords
 
+    @property
+    def transform_cache(self):
+        '''
+        Read-only; gives the :class:`~coordsys.TransformCache` shared by all
+        users of :attr:`cellcoords`, so that each coordinate transformation
+        of the cells is computed once no matter how many dust species or gas
+        quantities ask for it. The pieces given by :func:`chunks` share it
+        too, each under its own scope, but only while the piece is in use,
+        so chunked writes keep their memory bounded. It is cleared whenever
+        the grid changes; set its :attr:`~coordsys.TransformCache.maxbytes`
+        to cap its memory use.
+        '''
+        return self._transform_cache
+
     @property
     def coordsys(self):
         '''
@@ -152,8 +197,9 @@ class Grid(object):
 
 class RegularGrid(Grid):
     '''
-    Represents a RADMC3D grid. Currently, only regular grids are supported,
-    but AMR and oct-tree grids may be added later.
+    Represents a regular RADMC3D grid (grid style 0). See
+    :class:`OctreeGrid` and :class:`LayeredGrid` for grids refined where
+    the model needs it.
     '''
 
     def __init__(self):
@@ -167,7 +213,6 @@ class RegularGrid(Grid):
         :param Io io: Current I/O context
         '''
 
-        sep = '' if io.binary else '\n'
         ext = 'binp' if io.binary else 'inp'
 
         with io.file_open_write('.'.join(['amr_grid', ext])) as f:
@@ -182,30 +227,116 @@ class RegularGrid(Grid):
             hdr[8] = self._nv
             hdr[9] = self._nw
 
-            hdr.tofile(f, sep=sep, format='%d')
-            if not io.binary: f.write('\n')
-            self._u.astype(io.dtype).tofile(f, sep=sep, format='%e')
-            if not io.binary: f.write('\n')
-            self._v.astype(io.dtype).tofile(f, sep=sep, format='%e')
-            if not io.binary: f.write('\n')
-            self._w.astype(io.dtype).tofile(f, sep=sep, format='%e')
+            io.write_array(f, hdr, '%d')
+            io.write_array(f, self._u.astype(io.dtype))
+            io.write_array(f, self._v.astype(io.dtype))
+            io.write_array(f, self._w.astype(io.dtype))
 
 
     def update_coords(self):
         '''
-        Private function. Updates the definitions of the point and cell
-        coordinates after a change to one of the coordinate arrays.
+        Private function. Invalidates the point and cell coordinates after a
+        change to one of the coordinate arrays; they are rebuilt from the
+        axes the next time they are requested, so setting `u`, `v` and `w`
+        in sequence costs nothing.
         '''
-        uu, vv, ww = np.meshgrid(self._u, self._v, self._w, indexing='ij')
-        self._ptcoords = self.coordsys(uu, vv, ww)
+        self._ptcoords = None
+        self._cellcoords = None
+        self._transform_cache.clear()
 
-        umid = (self._u[1:] + self._u[:-1]) / 2.
-        vmid = (self._v[1:] + self._v[:-1]) / 2.
-        wmid = (self._w[1:] + self._w[:-1]) / 2.
 
-        uu, vv, ww = np.meshgrid(umid, vmid, wmid, indexing='ij')
-        self._cellcoords = self.coordsys(uu, vv, ww)
+    def broadcast_coords(self, u, v, w):
+        '''
+        Builds a coordinate container from three 1D axes without forming
+        the full grid. Each axis is reshaped to broadcast against the other
+        two, so the container holds only :math:`O(n_u + n_v + n_w)` values.
+        The coordinates still have the full grid shape when transformed,
+        as views; a model that is separable in the grid coordinates and
+        asks for them with :code:`compact=True` (see
+        :func:`~coordsys.Coordinates.transformTo`) never needs to allocate
+        per-cell arrays.
+
+        :param np.ndarray u: Values along the `u` dimension
+        :param np.ndarray v: Values along the `v` dimension
+        :param np.ndarray w: Values along the `w` dimension
+
+        :returns: Coordinates in the grid coordinate system
+        :rtype: Coordinates
+        '''
+        return self.coordsys(u[:,None,None], v[None,:,None], w[None,None,:])
+
+
+    def chunks(self, size=None):
+        '''
+        Iterates over the cells of this grid in slabs along the `w` dimension,
+        which is the slowest-varying axis in FORTRAN order, so each slab is
+        contiguous in the input files. Cell coordinates are only built for
+        one slab at a time; their transformations are kept in
+        :attr:`transform_cache`, scoped by slab, while the slab is being
+        processed, and dropped when the next one is requested, so the cache
+        holds no more than a slab of transformations per iteration in
+        progress.
+
+        :param int size: Maximum number of cells per slab, or :code:`None`
+            for the whole grid at once; at least one `w` layer is always
+            returned per slab
+
+        :returns: Tuples of the offset (in cells) of the slab, the cell
+            coordinates of the slab, and its shape
+        :rtype: generator
+        '''
+
+        if size is None or size >= self.nrcells:
+            yield 0, self.cellcoords, self.shape
+            return
+
+        layer = self._nu * self._nv
+        step = max(1, size // layer)
+        umid, vmid, wmid = self.midpoints
+
+        for k0 in range(0, self._nw, step):
+            k1 = min(k0 + step, self._nw)
+            coords = self.broadcast_coords(umid, vmid, wmid[k0:k1])
+            coords.cache = self._transform_cache.scope((k0, k1))
+
+            try:
+                yield k0 * layer, coords, (self._nu, self._nv, k1 - k0)
+            finally:
+                coords.cache.clear()
+
+
+    @property
+    def ptcoords(self):
+        '''
+        Read-only; gives the point coordinates of this grid. The arrays in
+        the container are broadcastable to the point shape rather than
+        materialized, until they are transformed; see
+        :func:`broadcast_coords`.
+        '''
+        if self._ptcoords is None:
+            self._ptcoords = self.broadcast_coords(self._u, self._v, self._w)
+        return self._ptcoords
+
+    @property
+    def cellcoords(self):
+        '''
+        Read-only; gives the cell coordinates of this grid, defined to be the
+        midpoints of each dimension of the point coordinates. The arrays in
+        the container are broadcastable to :attr:`shape` rather than
+        materialized, until they are transformed; see
+        :func:`broadcast_coords`.
+        '''
+        if self._cellcoords is None:
+            self._cellcoords = self.broadcast_coords(*self.midpoints)
+            self._cellcoords.cache = self._transform_cache
+        return self._cellcoords
 
+    @property
+    def midpoints(self):
+        '''Read-only; gives the 1D cell midpoints along `u`, `v` and `w`.'''
+        return ((self._u[1:] + self._u[:-1]) / 2.,
+                (self._v[1:] + self._v[:-1]) / 2.,
+                (self._w[1:] + self._w[:-1]) / 2.)
 
     @property
     def shape(self):
@@ -218,7 +349,700 @@ class RegularGrid(Grid):
 
     @property
     def vtk(self):
+        '''
+        Read-only; gives the grid as a :code:`cyvtk` object. The
+        :class:`~render.VtkRender` writer does not need it.
+
+        :raises ImportError: if :code:`cyvtk` is not installed
+        '''
+
+        if vtk is None:
+            raise ImportError('cyvtk is required for this feature')
 
         return vtk.PyStructuredGrid(self._u, self._v, self._w)
 
+
+
+class OctreeGrid(RegularGrid):
+    '''
+    Represents a RADMC3D oct-tree grid (grid style 1): a regular base grid,
+    defined by `u`, `v` and `w` as for :class:`RegularGrid`, whose cells are
+    recursively split into eight halves wherever a refinement criterion asks
+    for it. Refinement is carried out one level at a time, with the
+    criterion evaluated on all the candidate cells of a level at once, so
+    its cost is a handful of vectorized calls rather than one call per cell.
+    For example, to refine a disk until no cell is optically thick:
+
+    .. code-block:: python
+
+       grid = r3d.OctreeGrid(levelmax=6,
+           criterion=r3d.OpticalDepthCriterion(disk, kappa=1.e3))
+       grid.coordsys = r3d.SphericalCoordinates
+       grid.u = np.logspace(np.log10(r_in), np.log10(r_out), 33)
+       ...
+
+    Only the leaves of the tree are cells: :attr:`cellcoords` and the
+    coordinates passed to density functions are 1D arrays of leaf centers,
+    in the depth-first order in which RADMC3D expects the values of input
+    files, and :attr:`shape` is :code:`(nrcells,)`.
+
+    :param criterion: A function taking the center coordinates of candidate
+        cells and their widths (a tuple of three arrays, in the grid
+        coordinate system) and returning a boolean array that is
+        :code:`True` for the cells to split; see :class:`GradientCriterion`
+        and :class:`OpticalDepthCriterion`
+    :param int levelmax: Maximum number of times a base cell may be split
+    '''
+
+    def __init__(self, criterion=None, levelmax=0):
+
+        self._criterion = criterion
+        self._levelmax = levelmax
+        self._tree = None
+        self._nrcells = None
+
+        super(OctreeGrid, self).__init__()
+
+
+    def __getstate__(self):
+        '''
+        Builds the tree before pickling, so that process pools do not
+        evaluate the criterion again, and so that fingerprints reflect the
+        refinement actually written.
+        '''
+        state = super(OctreeGrid, self).__getstate__()
+        state['_tree'] = self.tree
+        return state
+
+
+    def write(self, io):
+        '''
+        Writes a grid definition to a file: the base grid, followed by one
+        flag per node of the tree in depth-first order, 1 for a node that is
+        split and 0 for a leaf.
+
+        :param Io io: Current I/O context
+        '''
+
+        ext = 'binp' if io.binary else 'inp'
+        tree = self.tree
+
+        with io.file_open_write('.'.join(['amr_grid', ext])) as f:
+
+            hdr = np.empty((13,), dtype=np.int64)
+            hdr[0] = 1
+            hdr[1] = 1
+            hdr[2] = self.coordmap[self.coordsys]
+            hdr[3] = 0
+            hdr[4] = hdr[5] = hdr[6] = 1
+            hdr[7] = self._nu
+            hdr[8] = self._nv
+            hdr[9] = self._nw
+            hdr[10] = tree['level'].max() if tree['level'].shape[0] else 0
+            hdr[11] = self.nrcells
+            hdr[12] = tree['level'].shape[0]
+
+            io.write_array(f, hdr, '%d')
+            io.write_array(f, self._u.astype(io.dtype))
+            io.write_array(f, self._v.astype(io.dtype))
+            io.write_array(f, self._w.astype(io.dtype))
+            io.write_array(f, (~tree['leaf']).astype(np.int64), '%d')
+
+
+    def update_coords(self):
+        '''
+        Private function. Invalidates the tree, its number of leaves and the
+        coordinates after a change to the base grid; the tree is rebuilt the
+        next time it is requested.
+        '''
+        super(OctreeGrid, self).update_coords()
+        self._tree = None
+        self._nrcells = None
+
+
+    def geometry(self, base, level, index):
+        '''
+        Computes the centers and widths of tree nodes.
+
+        :param np.ndarray base: Index of the base cell of each node, in
+            FORTRAN order
+        :param np.ndarray level: Refinement level of each node
+        :param np.ndarray index: Integer position of each node within its
+            base cell at its level, of shape :code:`(n, 3)`
+
+        :returns: The center coordinates and the widths of the nodes, each a
+            tuple of three 1D arrays
+        :rtype: tuple
+        '''
+
+        ijk = np.unravel_index(base, (self._nu, self._nv, self._nw), order='F')
+        scale = 0.5**level
+        centers, widths = list(), list()
+
+        for axis, i in zip((self._u, self._v, self._w), range(3)):
+            width = (axis[ijk[i] + 1] - axis[ijk[i]]) * scale
+            centers.append(axis[ijk[i]] + (index[:,i] + 0.5) * width)
+            widths.append(width)
+
+        return tuple(centers), tuple(widths)
+
+
+    def refine(self):
+        '''
+        Builds the tree by applying the refinement criterion to every cell
+        of the base grid, then to the children of the cells it split, and so
+        on up to :attr:`levelmax` levels.
+
+        :returns: The nodes of the tree in depth-first order, as a dictionary
+            of arrays: :code:`base`, :code:`level` and :code:`index` as for
+            :func:`geometry`, and :code:`leaf`, which is :code:`True` for
+            leaves
+        :rtype: dict
+        '''
+
+        nbase = self._nu * self._nv * self._nw
+        base = np.arange(nbase, dtype=np.int64)
+        index = np.zeros((nbase, 3), dtype=np.int64)
+        offsets = np.array([[i, j, k] for k in (0, 1) for j in (0, 1)
+            for i in (0, 1)], dtype=np.int64)
+        levels = list()
+
+        for level in range(self._levelmax + 1):
+            n = base.shape[0]
+            if n == 0: break
+
+            split = np.zeros((n,), dtype=bool)
+
+            if level < self._levelmax and self._criterion is not None:
+                centers, widths = self.geometry(base, level, index)
+                split = np.broadcast_to(np.asarray(self._criterion(
+                    self.coordsys(*centers), widths), dtype=bool), (n,))
+
+            levels.append((base, np.full((n,), level, dtype=np.int64), index,
+                ~split))
+
+            base = np.repeat(base[split], 8)
+            index = (2 * index[split][:,None,:] + offsets).reshape((-1, 3))
+
+        base, level, index, leaf = [np.concatenate(a) for a in zip(*levels)]
+
+        # Sort key: the base cell, then the child number at each level, with
+        # -1 past the level of the node so that parents precede children.
+        keys = [base]
+
+        for l in range(1, level.max() + 1 if level.shape[0] else 1):
+            shift = np.maximum(level - l, 0)
+            bits = (index >> shift[:,None]) & 1
+            keys.append(np.where(level >= l,
+                bits[:,0] + 2 * bits[:,1] + 4 * bits[:,2], -1))
+
+        order = np.lexsort(keys[::-1])
+
+        return { 'base' : base[order], 'level' : level[order],
+                 'index' : index[order], 'leaf' : leaf[order] }
+
+
+    def chunks(self, size=None):
+        '''
+        Iterates over the leaves of this grid in runs of consecutive leaves,
+        in the order of the input files. Cell coordinates are only built for
+        one run at a time; their transformations are kept in
+        :attr:`transform_cache`, scoped by run, until the next run is
+        requested.
+
+        :param int size: Maximum number of cells per run, or :code:`None`
+            for the whole grid at once
+
+        :returns: Tuples of the offset (in cells) of the run, the cell
+            coordinates of the run, and its shape
+        :rtype: generator
+        '''
+
+        n = self.nrcells
+
+        if size is None or size >= n:
+            yield 0, self.cellcoords, self.shape
+            return
+
+        base, level, index = self.leaves
+
+        for i0 in range(0, n, size):
+            i1 = min(i0 + size, n)
+            centers, _ = self.geometry(base[i0:i1], level[i0:i1],
+                index[i0:i1])
+            coords = self.coordsys(*centers)
+            coords.cache = self._transform_cache.scope((i0, i1))
+
+            try:
+                yield i0, coords, (i1 - i0,)
+            finally:
+                coords.cache.clear()
+
+
+    @property
+    def tree(self):
+        '''Read-only; gives the nodes of the tree; see :func:`refine`.'''
+        if self._tree is None:
+            self._tree = self.refine()
+        return self._tree
+
+    @property
+    def leaves(self):
+        '''
+        Read-only; gives the base cell, level and position of each leaf, in
+        the order of the input files; see :func:`geometry`.
+        '''
+        tree = self.tree
+        leaf = tree['leaf']
+        return tree['base'][leaf], tree['level'][leaf], tree['index'][leaf]
+
+    @property
+    def ptcoords(self):
+        '''Read-only; gives the point coordinates of the base grid.'''
+        return super(OctreeGrid, self).ptcoords
+
+    @property
+    def cellcoords(self):
+        '''
+        Read-only; gives the coordinates of the centers of the leaves, as 1D
+        arrays in the order of the input files.
+        '''
+        if self._cellcoords is None:
+            centers, _ = self.geometry(*self.leaves)
+            self._cellcoords = self.coordsys(*centers)
+            self._cellcoords.cache = self._transform_cache
+        return self._cellcoords
+
+    @property
+    def cellwidths(self):
+        '''
+        Read-only; gives the widths of the leaves along each dimension, as
+        1D arrays in the order of the input files.
+        '''
+        _, widths = self.geometry(*self.leaves)
+        return widths
+
+    @property
+    def criterion(self):
+        '''The refinement criterion; see the class description.'''
+        return self._criterion
+
+    @criterion.setter
+    def criterion(self, val):
+        self._criterion = val
+        self.update_coords()
+
+    @property
+    def levelmax(self):
+        '''Maximum number of times a base cell may be split.'''
+        return self._levelmax
+
+    @levelmax.setter
+    def levelmax(self, val):
+        self._levelmax = val
+        self.update_coords()
+
+    @property
+    def shape(self):
+        return (self.nrcells,)
+
+    @property
+    def nrcells(self):
+        '''
+        Read-only; gives the number of leaves of this grid, which is counted
+        once per tree.
+        '''
+        if self._nrcells is None:
+            self._nrcells = int(np.count_nonzero(self.tree['leaf']))
+        return self._nrcells
+
+    @property
+    def vtk(self):
+        '''
+        Read-only; an oct-tree grid has no structured VTK form.
+
+        :raises ValueError: always; render a :class:`RegularGrid` with the
+            same `u`, `v` and `w` (the base grid) instead
+        '''
+
+        raise ValueError('oct-tree grids have no structured VTK form; '
+            'render a RegularGrid with the same u, v and w (the base grid) '
+            'instead')
+
+
+
+class LayeredGrid(Grid):
+    '''
+    Represents a RADMC3D layered grid (grid style 10): a regular base grid
+    with rectangular patches nested in it, each of which splits a block of
+    cells of its parent layer into eight. Each layer is itself a
+    :class:`RegularGrid`, so densities are evaluated over each layer in a
+    single vectorized pass, with the same broadcast coordinates as for a
+    regular grid. For example, to resolve the inner 4x4x4 cells of a base
+    grid twice, then its innermost 2x2x2 cells four times:
+
+    .. code-block:: python
+
+       grid = r3d.LayeredGrid(base, [(0, 3, 3, 3, 8, 8, 8),
+                                     (1, 3, 3, 3, 4, 4, 4)])
+
+    RADMC3D reads one value per cell of every layer, including the cells of
+    a layer that are covered by a patch; :attr:`shape` is therefore
+    :code:`(nrcells,)`, with the layers one after the other in the input
+    files.
+
+    The coordinate arrays and system are those of the base grid; change
+    them through this grid rather than through :attr:`base`, so that the
+    layers are rebuilt.
+
+    :param RegularGrid base: The base grid
+    :param list patches: One tuple per patch of the index of its parent
+        layer (0 for the base grid, 1 for the first patch, and so on, so
+        that a patch comes after its parent), the position of its first cell
+        in its parent (counted from 1, as in the RADMC3D manual), and its
+        number of cells along each dimension, which must be even
+    '''
+
+    def __init__(self, base=None, patches=()):
+
+        super(LayeredGrid, self).__init__()
+
+        self._base = base if base is not None else RegularGrid()
+        self._patches = list(patches)
+        self._layers = None
+
+
+    def write(self, io):
+        '''
+        Writes a grid definition to a file.
+
+        :param Io io: Current I/O context
+        '''
+
+        ext = 'binp' if io.binary else 'inp'
+        base = self._base
+
+        with io.file_open_write('.'.join(['amr_grid', ext])) as f:
+
+            hdr = np.empty((12,), dtype=np.int64)
+            hdr[0] = 1
+            hdr[1] = 10
+            hdr[2] = self.coordmap[base.coordsys]
+            hdr[3] = 0
+            hdr[4] = hdr[5] = hdr[6] = 1
+            hdr[7] = base.nu
+            hdr[8] = base.nv
+            hdr[9] = base.nw
+            hdr[10] = max(self.levels)
+            hdr[11] = len(self._patches)
+
+            io.write_array(f, hdr, '%d')
+            io.write_array(f, base.u.astype(io.dtype))
+            io.write_array(f, base.v.astype(io.dtype))
+            io.write_array(f, base.w.astype(io.dtype))
+
+            if self._patches:
+                io.write_array(f, np.array(self._patches, dtype=np.int64),
+                    '%d')
+
+
+    def update_coords(self):
+        '''
+        Private function. Invalidates the layers and the cell coordinates
+        after a change to the base grid or to the patches.
+        '''
+        self._layers = None
+        self._cellcoords = None
+        self._transform_cache.clear()
+
+
+    def build_layers(self):
+        '''
+        Builds a :class:`RegularGrid` for each layer, whose axes are those
+        of the cells of its parent it covers, each split in two.
+
+        :returns: The layers, starting with the base grid
+        :rtype: list
+
+        :raises ValueError: if a patch has no valid parent, an odd number of
+            cells, or extends beyond its parent
+        '''
+
+        layers = [self._base]
+
+        for i, patch in enumerate(self._patches):
+            parent, start, n = patch[0], patch[1:4], patch[4:7]
+
+            if not 0 <= parent <= i:
+                raise ValueError('patch %d has no parent layer %d' %
+                    (i + 1, parent))
+
+            layer = RegularGrid()
+            layer.coordsys = self._base.coordsys
+
+            for dim, i0, ni in zip('uvw', start, n):
+                axis = getattr(layers[parent], dim)
+
+                if ni % 2 or i0 < 1 or i0 - 1 + ni // 2 >= axis.shape[0]:
+                    raise ValueError('patch %d does not fit in layer %d '
+                        'along %s' % (i + 1, parent, dim))
+
+                pts = axis[i0-1:i0+ni//2]
+                fine = np.empty((ni + 1,))
+                fine[::2] = pts
+                fine[1::2] = (pts[1:] + pts[:-1]) / 2.
+                setattr(layer, dim, fine)
+
+            layer.transform_cache.maxbytes = self._transform_cache.maxbytes
+            layers.append(layer)
+
+        return layers
+
+
+    def chunks(self, size=None):
+        '''
+        Iterates over the cells of this grid layer by layer, in slabs of
+        each layer as for :func:`RegularGrid.chunks`.
+
+        :param int size: Maximum number of cells per slab, or :code:`None`
+            for whole layers
+
+        :returns: Tuples of the offset (in cells) of the slab, the cell
+            coordinates of the slab, and its shape
+        :rtype: generator
+        '''
+
+        offset = 0
+
+        for layer in self.layers:
+            for start, coords, shape in layer.chunks(size):
+                yield offset + start, coords, shape
+            offset += layer.nrcells
+
+
+    @property
+    def base(self):
+        '''Read-only; gives the base grid.'''
+        return self._base
+
+    @property
+    def patches(self):
+        '''The list of patches; see the class description.'''
+        return self._patches
+
+    @patches.setter
+    def patches(self, val):
+        self._patches = list(val)
+        self.update_coords()
+
+    @property
+    def layers(self):
+        '''
+        Read-only; gives the layers of this grid as :class:`RegularGrid`
+        objects, starting with the base grid.
+        '''
+        if self._layers is None:
+            self._layers = self.build_layers()
+        return self._layers
+
+    @property
+    def levels(self):
+        '''Read-only; gives the refinement level of each layer.'''
+        levels = [0]
+        for patch in self._patches:
+            levels.append(levels[patch[0]] + 1)
+        return levels
+
+    @property
+    def ptcoords(self):
+        '''Read-only; gives the point coordinates of the base grid.'''
+        return self._base.ptcoords
+
+    @property
+    def cellcoords(self):
+        '''
+        Read-only; gives the coordinates of the cells of all layers, as 1D
+        arrays in the order of the input files. Writers that work
+        through :func:`chunks` never build these.
+        '''
+        if self._cellcoords is None:
+            native = [np.concatenate(a) for a in zip(*[[np.broadcast_to(c,
+                layer.shape).ravel(order='F') for c in layer.cellcoords.native]
+                for layer in self.layers])]
+            self._cellcoords = self.coordsys(*native)
+            self._cellcoords.cache = self._transform_cache
+        return self._cellcoords
+
+    @property
+    def coordsys(self):
+        '''
+        The coordinate system of the base grid; see :attr:`Grid.coordsys`.
+        '''
+        return self._base.coordsys
+
+    @coordsys.setter
+    def coordsys(self, val):
+        self._base.coordsys = val
+        self.update_coords()
+
+    @property
+    def u(self):
+        '''The first coordinate of the base grid; see :attr:`Grid.u`.'''
+        return self._base.u
+
+    @u.setter
+    def u(self, arr):
+        self._base.u = arr
+        self.update_coords()
+
+    @property
+    def v(self):
+        '''The second coordinate of the base grid; see :attr:`Grid.v`.'''
+        return self._base.v
+
+    @v.setter
+    def v(self, arr):
+        self._base.v = arr
+        self.update_coords()
+
+    @property
+    def w(self):
+        '''The third coordinate of the base grid; see :attr:`Grid.w`.'''
+        return self._base.w
+
+    @w.setter
+    def w(self, arr):
+        self._base.w = arr
+        self.update_coords()
+
+    @property
+    def nu(self):
+        '''Read-only; gives the number of base cells in the `u` dimension.'''
+        return self._base.nu
+
+    @property
+    def nv(self):
+        '''Read-only; gives the number of base cells in the `v` dimension.'''
+        return self._base.nv
+
+    @property
+    def nw(self):
+        '''Read-only; gives the number of base cells in the `w` dimension.'''
+        return self._base.nw
+
+    @property
+    def shape(self):
+        return (self.nrcells,)
+
+    @property
+    def nrcells(self):
+        '''Read-only; gives the total number of cells of all layers.'''
+        return sum(layer.nrcells for layer in self.layers)
+
+    @property
+    def vtk(self):
+        '''
+        Read-only; a layered grid has no structured VTK form.
+
+        :raises ValueError: always; render :attr:`base` instead
+        '''
+
+        raise ValueError('layered grids have no structured VTK form; '
+            'render their base grid (the base attribute) instead')
+
+
+
+def cell_lengths(coords, widths):
+    '''
+    Converts the widths of cells in their coordinate system into physical
+    lengths, for example :math:`r \\, \\Delta\\theta` for the latitudinal
+    width of a spherical cell.
+
+    :param Coordinates coords: The centers of the cells
+    :param tuple widths: The widths of the cells along each dimension
+
+    :returns: The lengths of the cells along each dimension
+    :rtype: tuple
+    '''
+
+    u, v, w = coords.native
+    du, dv, dw = widths
+
+    if isinstance(coords, SphericalCoordinates):
+        return du, u * dv, u * np.sin(v) * dw
+
+    if isinstance(coords, CylindricalCoordinates):
+        return du, u * dv, dw
+
+    return du, dv, dw
+
+
+
+class GradientCriterion(object):
+    '''
+    Refinement criterion for :class:`OctreeGrid` that splits cells across
+    which a density varies by more than a given fraction of its value at
+    the center, as estimated from its values at the centers of the faces.
+
+    :param species: An object with a :code:`density(coords)` method, such as
+        a :class:`~dust.DustSpecies`
+    :param float threshold: Largest relative variation allowed in a cell
+    :param float floor: Density below which cells are never split, so that
+        the far tails of a model are not resolved needlessly
+    '''
+
+    def __init__(self, species, threshold=0.5, floor=0.):
+
+        self.species = species
+        self.threshold = threshold
+        self.floor = floor
+
+
+    def __call__(self, coords, widths):
+
+        native = [np.asarray(a) for a in coords.native]
+        n = native[0].shape[0]
+
+        rho = np.broadcast_to(self.species.density(coords), (n,))
+        variation = np.zeros((n,))
+
+        for i in range(3):
+            lo, hi = list(native), list(native)
+            lo[i] = native[i] - widths[i] / 2.
+            hi[i] = native[i] + widths[i] / 2.
+            diff = np.abs(self.species.density(type(coords)(*hi)) -
+                self.species.density(type(coords)(*lo)))
+            variation = np.maximum(variation, np.broadcast_to(diff, (n,)))
+
+        return (variation > self.threshold * np.abs(rho)) & \
+            (np.abs(rho) > self.floor)
+
+
+
+class OpticalDepthCriterion(object):
+    '''
+    Refinement criterion for :class:`OctreeGrid` that splits cells whose
+    optical depth, :math:`\\kappa \\rho` times their largest physical
+    length, exceeds a threshold.
+
+    :param species: An object with a :code:`density(coords)` method, such as
+        a :class:`~dust.DustSpecies`
+    :param float kappa: Opacity (in :math:`\\textrm{cm}^2 / \\textrm{g}`)
+    :param float threshold: Largest optical depth allowed in a cell
+    '''
+
+    def __init__(self, species, kappa, threshold=1.):
+
+        self.species = species
+        self.kappa = kappa
+        self.threshold = threshold
+
+
+    def __call__(self, coords, widths):
+
+        length = np.maximum.reduce(np.broadcast_arrays(
+            *cell_lengths(coords, widths)))
+        return self.kappa * self.species.density(coords) * length > \
+            self.threshold
+
 # vim: set ft=python:
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import numpy as np
+
+
+class Image(object):
+    '''
+    An image cube written by RADMC3D, such as :code:`image.out`,
+    :code:`image.bout` or :code:`tausurface_3d.out`. Only the header is read
+    when the cube is opened: the values are read on demand, either all at
+    once with :attr:`data`, a wavelength at a time with :func:`channels`,
+    or for a single wavelength with :func:`channel`. Binary cubes are read
+    through memory maps, so any of these is cheap; ASCII cubes must be
+    parsed, but :func:`channel` skips the other wavelengths without parsing
+    them and :func:`channels` parses each one only when it is reached.
+
+    Cubes are indexed in FORTRAN order, as :code:`[ix, iy, ilam]`, with a
+    leading axis of components for Stokes images (:code:`I, Q, U, V`) and
+    for :code:`tausurface_3d.out` (:code:`x, y, z`).
+
+    Use :func:`~mapper.Mapper.read_image` rather than the constructor.
+
+    :param Io io: Current I/O context
+    :param str fname: The file name, relative to the output directory
+    :param bool binary: :code:`True` if the file is binary
+    :param int ncomp: Number of components per pixel, or :code:`None` to
+        deduce it from the format number in the header
+    '''
+
+    formats = (1, 2, 3)
+    '''
+    Format numbers of image cubes: plain, seen by a local observer, and with
+    the four Stokes components.
+    '''
+
+    def __init__(self, io, fname, binary, ncomp=None):
+
+        self._io = io
+        self._fname = fname
+        self._binary = binary
+        self._data = None
+
+        parse = self.parse_binary if binary else self.parse_ascii
+        self.set_header(io.index.parsed(fname, parse), ncomp)
+
+
+    @classmethod
+    def from_stream(cls, f, ncomp=None):
+        '''
+        Reads a whole ASCII cube from a stream, such as the output of a
+        RADMC3D child process, into memory. Lines before the header that are
+        not one of the :attr:`formats` are skipped.
+
+        :param file f: The stream
+        :param int ncomp: Number of components per pixel, or :code:`None` to
+            deduce it from the format number in the header
+
+        :returns: The cube
+        :rtype: Image
+
+        :raises EOFError: if the stream ends before the cube does
+        '''
+
+        self = cls.__new__(cls)
+        self._io = self._fname = None
+        self._binary = False
+
+        first = skip_to_header(f, cls.formats)
+        self.set_header(self.parse_ascii(f, first), ncomp)
+
+        lines = (l for l in iter(f.readline, '') if l.strip())
+        self._data = np.stack([self.parse_channel(lines)
+            for _ in range(self.nlam)], axis=-1)
+
+        return self
+
+
+    def set_header(self, hdr, ncomp):
+        '''Private function. Stores a parsed header.'''
+
+        self._iformat, self._nx, self._ny, self._pixsize, self._lmbda, \
+            self._offset = hdr
+        self._ncomp = ncomp if ncomp is not None else \
+            4 if self._iformat == 3 else 1
+
+
+    @staticmethod
+    def parse_binary(f):
+        '''
+        Private function. Parses the header of a binary cube: the format
+        number, the numbers of pixels and of wavelengths as 64-bit integers,
+        then the pixel sizes and the wavelengths as doubles.
+
+        :returns: The format number, the numbers of pixels, the pixel sizes,
+            the wavelengths, and the offset of the data in bytes
+        :rtype: tuple
+        '''
+
+        iformat, nx, ny, nlam = np.fromfile(f, dtype=np.int64, count=4)
+        pixsize = np.fromfile(f, dtype=np.float64, count=2)
+        lmbda = np.fromfile(f, dtype=np.float64, count=nlam)
+
+        return int(iformat), int(nx), int(ny), tuple(pixsize), lmbda, \
+            4 * 8 + (2 + int(nlam)) * 8
+
+
+    @staticmethod
+    def parse_ascii(f, first=None):
+        '''
+        Private function. Parses the header of an ASCII cube: the format
+        number, the numbers of pixels, the number of wavelengths, the pixel
+        sizes, then one wavelength per line.
+
+        :param file f: Open file handle
+        :param str first: The first line, if it has already been read
+
+        :returns: The format number, the numbers of pixels, the pixel sizes,
+            the wavelengths, and the number of lines before the data
+        :rtype: tuple
+        '''
+
+        iformat = int(first if first is not None else f.readline())
+        nx, ny = [int(s) for s in f.readline().split()]
+        nlam = int(f.readline())
+        pixsize = tuple(float(s) for s in f.readline().split())
+        lmbda = np.array([float(f.readline()) for _ in range(nlam)])
+
+        return iformat, nx, ny, pixsize, lmbda, 4 + nlam
+
+
+    def lines(self, f):
+        '''
+        Private function. Skips the header of an open ASCII cube and returns
+        an iterator over the remaining non-blank lines, one pixel per line.
+        '''
+
+        rest = itertools.islice(f, self._offset, None)
+        return (l for l in rest if l.strip())
+
+
+    def parse_channel(self, lines):
+        '''
+        Private function. Parses the pixel lines of one wavelength of an
+        ASCII cube.
+        '''
+
+        count = self._nx * self._ny
+        text = ''.join(itertools.islice(lines, count))
+        values = np.fromstring(text, sep=' ')
+
+        if values.shape[0] != count * self._ncomp:
+            raise EOFError('image ended before all its pixels were read')
+
+        return values.reshape(self.channel_shape, order='F')
+
+
+    def channel(self, i):
+        '''
+        Reads the image at one wavelength.
+
+        :param int i: Index of the wavelength
+
+        :returns: The image, of shape :attr:`channel_shape`; for binary
+            cubes, a read-only memory map
+        :rtype: np.ndarray
+        '''
+
+        if i < 0: i += self.nlam
+
+        if self._binary or self._data is not None:
+            return self.data[...,i]
+
+        with self._io.file_open_read(self._fname) as f:
+            lines = self.lines(f)
+            skip = i * self._nx * self._ny
+            next(itertools.islice(lines, skip, skip), None)
+            return self.parse_channel(lines)
+
+
+    def channels(self):
+        '''
+        Iterates over the images at each wavelength in turn; an ASCII cube
+        is read once, a wavelength at a time.
+
+        :returns: The image at each wavelength, as for :func:`channel`
+        :rtype: generator
+        '''
+
+        if self._binary or self._data is not None:
+            for i in range(self.nlam):
+                yield self.data[...,i]
+            return
+
+        with self._io.file_open_read(self._fname) as f:
+            lines = self.lines(f)
+            for _ in range(self.nlam):
+                yield self.parse_channel(lines)
+
+
+    @property
+    def data(self):
+        '''
+        Read-only; gives the whole cube: a read-only memory map for binary
+        cubes, or an array in memory for ASCII cubes.
+        '''
+
+        if self._data is not None:
+            return self._data
+
+        shape = self.channel_shape + (self.nlam,)
+
+        if self._binary:
+            return self._io.memmap(self._fname, offset=self._offset,
+                dtype=np.float64, shape=shape, mode='r')
+
+        return np.stack(list(self.channels()), axis=-1)
+
+    @property
+    def fname(self):
+        '''
+        Read-only; gives the file name, relative to the output directory, or
+        :code:`None` for a cube read from a stream.
+        '''
+        return self._fname
+
+    @property
+    def binary(self):
+        '''Read-only; :code:`True` if the file is binary.'''
+        return self._binary
+
+    @property
+    def iformat(self):
+        '''Read-only; gives the format number in the header.'''
+        return self._iformat
+
+    @property
+    def nx(self):
+        '''Read-only; gives the number of pixels along `x`.'''
+        return self._nx
+
+    @property
+    def ny(self):
+        '''Read-only; gives the number of pixels along `y`.'''
+        return self._ny
+
+    @property
+    def nlam(self):
+        '''Read-only; gives the number of wavelengths.'''
+        return self._lmbda.shape[0]
+
+    @property
+    def ncomp(self):
+        '''Read-only; gives the number of components per pixel.'''
+        return self._ncomp
+
+    @property
+    def pixsize(self):
+        '''
+        Read-only; gives the size of a pixel along `x` and `y` (in
+        :math:`\\textrm{cm}`, or in radians for local observer images).
+        '''
+        return self._pixsize
+
+    @property
+    def lmbda(self):
+        '''Read-only; gives the wavelengths (in microns).'''
+        return self._lmbda
+
+    @property
+    def channel_shape(self):
+        '''Read-only; gives the shape of the image at one wavelength.'''
+        shape = (self._nx, self._ny)
+        return shape if self._ncomp == 1 else (self._ncomp,) + shape
+
+
+
+class Spectrum(object):
+    '''
+    A spectrum written by RADMC3D to :code:`spectrum.out`: the flux (in
+    :math:`\\textrm{erg} / \\textrm{s} / \\textrm{cm}^2 / \\textrm{Hz}` at a
+    distance of 1 parsec) at each wavelength.
+
+    Use :func:`~mapper.Mapper.read_spectrum` rather than the constructor.
+
+    :param np.ndarray lmbda: The wavelengths (in microns)
+    :param np.ndarray flux: The fluxes
+    '''
+
+    formats = (1,)
+    '''Format numbers of spectra.'''
+
+    def __init__(self, lmbda, flux):
+
+        self._lmbda = lmbda
+        self._flux = flux
+
+
+    @staticmethod
+    def parse(f):
+        '''
+        Private function. Parses a spectrum file: the format number, the
+        number of wavelengths, then one wavelength and flux per line.
+
+        :returns: The spectrum
+        :rtype: Spectrum
+        '''
+
+        f.readline()
+        nlam = int(f.readline())
+        values = np.fromstring(f.read(), sep=' ', count=2 * nlam)
+        values = values.reshape((nlam, 2))
+        return Spectrum(values[:,0], values[:,1])
+
+
+    @staticmethod
+    def from_stream(f):
+        '''
+        Reads a spectrum from a stream, such as the output of a RADMC3D child
+        process, reading no further than its last line. Lines before the
+        header that are not one of the :attr:`formats` are skipped.
+
+        :param file f: The stream
+
+        :returns: The spectrum
+        :rtype: Spectrum
+
+        :raises EOFError: if the stream ends before the spectrum does
+        '''
+
+        skip_to_header(f, Spectrum.formats)
+        nlam = int(f.readline())
+
+        lines = (l for l in iter(f.readline, '') if l.strip())
+        text = ''.join(itertools.islice(lines, nlam))
+        values = np.fromstring(text, sep=' ')
+
+        if values.shape[0] != 2 * nlam:
+            raise EOFError('spectrum ended before all its values were read')
+
+        values = values.reshape((nlam, 2))
+        return Spectrum(values[:,0], values[:,1])
+
+
+    @property
+    def lmbda(self):
+        '''Read-only; gives the wavelengths (in microns).'''
+        return self._lmbda
+
+    @property
+    def flux(self):
+        '''Read-only; gives the flux at each wavelength.'''
+        return self._flux
+
+
+
+def skip_to_header(f, formats):
+    '''
+    Private function. Reads a stream up to and including the first line that
+    holds nothing but one of the given format numbers, which start RADMC3D
+    output; any other line, including one holding another number, is taken
+    for a message and skipped.
+
+    :param file f: The stream
+    :param tuple formats: The format numbers that may start the output
+
+    :returns: That line
+    :rtype: str
+
+    :raises EOFError: if the stream ends first
+    '''
+
+    accepted = set('%d' % i for i in formats)
+
+    for line in iter(f.readline, ''):
+        if line.strip() in accepted: return line
+
+    raise EOFError('stream ended before a header was found')
+
+# vim: set ft=python:
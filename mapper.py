@@ -1,155 +1,300 @@
 # -*- coding: utf-8 -*-
 
+import functools
 import numpy as np
+from image import Image, Spectrum
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+class LazyMapping(Mapping):
+    '''
+    Read-only mapping whose values are produced on demand. Each value is
+    computed by its loader the first time its key is accessed and is cached
+    from then on, so values that are never accessed cost nothing.
+
+    :param dict loaders: Maps each key to a function of no arguments that
+        returns its value
+    '''
+
+    def __init__(self, loaders):
+
+        self._loaders = dict(loaders)
+        self._values = dict()
+
+
+    def __getitem__(self, key):
+
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+
+        value = self._loaders[key]()
+        self._values[key] = value
+        return value
+
+
+    def __contains__(self, key):
+
+        return key in self._loaders
+
+
+    def __iter__(self):
+
+        return iter(self._loaders)
+
+
+    def __len__(self):
+
+        return len(self._loaders)
+
+
+    def loaded(self, key):
+        '''
+        Checks whether the value of a key has already been loaded.
+
+        :param key: The key to check
+
+        :returns: :code:`True` if the value is cached, :code:`False` otherwise
+        :rtype: bool
+        '''
+
+        return key in self._values
+
+
 
 
 class Mapper(object):
     '''
+    Reads RADMC3D input and output files back into arrays with the grid
+    shape, in FORTRAN order. By default, binary files are returned as
+    read-only memory maps, so nothing is loaded until it is used and fields
+    larger than memory can be processed piecewise; ASCII files must be
+    parsed and so are always read into memory.
+
+    :param bool materialize: If :code:`True`, every array is instead copied
+        into a C-contiguous array in memory, as needed by consumers that
+        require contiguous buffers
     '''
 
+    def __init__(self, materialize=False):
+
+        self._materialize = materialize
+
+
+    def wrap(self, arr):
+        '''
+        Private function. Returns the array as read, or a C-contiguous copy
+        of it if :attr:`materialize` is set.
+        '''
+
+        return np.ascontiguousarray(arr) if self._materialize else arr
+
+
     def map_variables(self, io, grid):
-        ''' '''
+        '''
+        Maps all variables that can be found in the output directory. Files
+        are only opened and parsed when their key is first accessed.
+
+        :param Io io: Current I/O context
+        :param Grid grid: Current grid definition
+
+        :returns: Mapping with the keys :code:`dust_density`,
+            :code:`dust_temperature`, :code:`gas_number_density`,
+            :code:`gas_temperature` and :code:`gas_velocity`
+        :rtype: LazyMapping
+        '''
+        p = functools.partial
         d = dict()
-        d['dust_density'] = self.read_dust_scalar('density', io, grid, True)
+        d['dust_density'] = p(self.read_dust_scalar, 'density', io, grid, True)
         d['dust_temperature'] = \
-            self.read_dust_scalar('temperature', io, grid, False)
-        d['gas_number_density'] = self.read_gas_numberdens(io, grid)
+            p(self.read_dust_scalar, 'temperature', io, grid, False)
+        d['gas_number_density'] = p(self.read_gas_numberdens, io, grid)
         d['gas_temperature'] = \
-            self.read_gas_global('temperature', io, grid, False)
-        d['gas_velocity'] = self.read_gas_global('velocity', io, grid, True)
-        return d
+            p(self.read_gas_global, 'temperature', io, grid, False)
+        d['gas_velocity'] = p(self.read_gas_global, 'velocity', io, grid, True)
+        return LazyMapping(d)
 
 
-    def read_dust_scalar(self, slug, io, grid, inp=True):
+    @property
+    def materialize(self):
+        '''
+        :code:`True` if arrays are copied into memory as C-contiguous arrays,
+        :code:`False` if binary files are returned as read-only memory maps.
+        '''
+        return self._materialize
 
-        names = list()
-        ret = dict()
+    @materialize.setter
+    def materialize(self, val):
+        self._materialize = val
 
-        try:
-            with io.file_open_read('dustopac.inp') as f:
-                hdr = np.fromfile(f, sep=' ', count=2, dtype=np.int64)
-                nrspec = hdr[1]
 
-                for i in xrange(nrspec):
-                    f.readline(); f.readline(); f.readline()
-                    names.append(f.readline().strip())
-        except IOError:
-            return ret
+    def read_dust_scalar(self, slug, io, grid, inp=True):
+        '''
+        Reads a dust field for every species listed in :code:`dustopac.inp`.
+        File formats, headers and species names come from the directory
+        index of the I/O context.
 
-        ext = 'inp' if inp else 'dat'
-        bext = 'b' + ext
+        :param str slug: The field name, such as :code:`density`
+        :param Io io: Current I/O context
+        :param Grid grid: Current grid definition
+        :param bool inp: :code:`True` for an input file, :code:`False` for an
+            output file
 
-        if io.file_check_exists('dust_%s.%s' % (slug, ext)):
-            ext, sep, count, binary = ext, ' ', 3, False
+        :returns: Arrays keyed by species name
+        :rtype: dict
+        '''
 
-        elif io.file_check_exists('dust_%s.%s' % (slug, bext)):
-            ext, sep, count, binary = bext, '', 4, True
+        ret = dict()
+
+        names = io.index.dust_species()
+        if names is None: return ret
 
-        else:
-            return ret
+        hdr = io.index.header('dust_%s' % slug, inp, nrspec=True)
+        if hdr is None: return ret
 
-        with io.file_open_read('.'.join(['dust_%s' % slug, ext])) as f:
+        shape = grid.shape
 
-            hdr = np.fromfile(f, sep=sep, count=count, dtype=np.int64)
-            dtype = (np.float64 if hdr[1] == 8 else np.float32) if binary \
-                else np.float64
-            nrcells = hdr[2] if binary else hdr[1]
-            nrspec = hdr[3] if binary else hdr[2]
-            shape = grid.shape
+        with io.file_open_read(hdr.fname) as f:
 
-            if binary:
-                for i in xrange(nrspec):
-                    offset = count * np.dtype(np.int64).itemsize + \
-                        np.dtype(dtype).itemsize * nrcells * i
-                    ret[names[i]] = np.ascontiguousarray(io.memmap(f,
-                        offset=offset, dtype=dtype, shape=shape, mode='r'))
+            if hdr.binary:
+                for i in xrange(hdr.nrspec):
+                    offset = hdr.offset + hdr.precis * hdr.nrcells * i
+                    ret[names[i]] = self.wrap(io.memmap(f, offset=offset,
+                        dtype=hdr.dtype, shape=shape, mode='r'))
 
             else:
-                for i in xrange(nrspec):
-                    ret[names[i]] = np.ascontiguousarray(np.fromfile(f, dtype=dtype,
-                        count=nrcells, sep=sep).reshape(shape, order='F'))
+                np.fromfile(f, sep=' ', count=hdr.count, dtype=np.int64)
+
+                for i in xrange(hdr.nrspec):
+                    ret[names[i]] = self.wrap(np.fromfile(f, dtype=hdr.dtype,
+                        count=hdr.nrcells, sep=' ').reshape(shape, order='F'))
 
         return ret
 
 
     def read_gas_numberdens(self, io, grid):
+        '''
+        Reads the number density of every molecule listed in
+        :code:`line.inp`.
 
-        names = list()
-        ret = dict()
+        :param Io io: Current I/O context
+        :param Grid grid: Current grid definition
 
-        try:
-            with io.file_open_read('line.inp') as f:
-                hdr = np.fromfile(f, sep=' ', count=2, dtype=np.int64)
-                nrspec = hdr[1]
+        :returns: Arrays keyed by molecule name
+        :rtype: dict
+        '''
+
+        ret = dict()
 
-                for i in xrange(nrspec):
-                    line = f.readline().split()
-                    names.append(line[0].strip())
-                    for i in xrange(int(line[3])): f.readline()
-        except IOError:
-            return ret
+        names = io.index.line_species()
+        if names is None: return ret
 
         for name in names:
-            if io.file_check_exists('numberdens_%s.inp' % name):
-                ext, sep, count, binary = 'inp', ' ', 2, False
+            hdr = io.index.header('numberdens_%s' % name)
+            if hdr is None: return ret
 
-            elif io.file_check_exists('numberdens_%s.binp' % name):
-                ext, sep, count, binary = 'binp', '', 3, True
+            ret[name] = self.read_field(io, hdr, grid.shape)
 
-            else:
-                return ret
+        return ret
 
-            with io.file_open_read('.'.join(['numberdens_%s' % name, ext])) as f:
 
-                hdr = np.fromfile(f, sep=sep, count=count, dtype=np.int64)
-                dtype = (np.float64 if hdr[1] == 8 else np.float32) if binary \
-                    else np.float64
-                nrcells = hdr[2] if binary else hdr[1]
-                shape = grid.shape
+    def read_gas_global(self, slug, io, grid, vector=False):
+        '''
+        Reads a gas field that is shared by all molecules.
 
-                if binary:
-                    offset = hdr.nbytes
-                    ret[name] = np.ascontiguousarray(io.memmap(f, offset=offset,
-                        dtype=dtype, shape=shape, mode='r'))
+        :param str slug: The field name, such as :code:`temperature`
+        :param Io io: Current I/O context
+        :param Grid grid: Current grid definition
+        :param bool vector: :code:`True` if the field has three components
 
-                else:
-                    ret[name] = np.ascontiguousarray(np.fromfile(f, dtype=dtype,
-                        count=nrcells, sep=sep).reshape(shape, order='F'))
+        :returns: The field, or :code:`None` if there is no file
+        :rtype: np.ndarray
+        '''
 
-        return ret
+        hdr = io.index.header('gas_%s' % slug)
+        if hdr is None: return None
 
+        shape = (3,) + grid.shape if vector else grid.shape
+        return self.read_field(io, hdr, shape)
 
-    def read_gas_global(self, slug, io, grid, vector=False):
 
-        ret = None
+    def read_image(self, io, stem='image', ncomp=None):
+        '''
+        Opens an image cube, in ASCII (:code:`.out`) or binary
+        (:code:`.bout`) format; if both exist, the ASCII variant is
+        preferred. Only the header is read; see :class:`~image.Image`.
 
-        if io.file_check_exists('gas_%s.inp' % slug):
-            ext, sep, count, binary = 'inp', ' ', 2, False
+        :param Io io: Current I/O context
+        :param str stem: The file name without extension
+        :param int ncomp: Number of components per pixel, or :code:`None` to
+            deduce it from the header
 
-        elif io.file_check_exists('gas_%s.binp' % slug):
-            ext, sep, count, binary = 'binp', '', 3, True
+        :returns: The cube, or :code:`None` if there is no file
+        :rtype: image.Image
+        '''
 
-        else:
-            return ret
+        for ext, binary in [('out', False), ('bout', True)]:
+            fname = '.'.join([stem, ext])
+            if io.index.exists(fname): return Image(io, fname, binary, ncomp)
 
-        with io.file_open_read('.'.join(['gas_%s' % slug, ext])) as f:
+        return None
 
-            hdr = np.fromfile(f, sep=sep, count=count, dtype=np.int64)
-            dtype = (np.float64 if hdr[1] == 8 else np.float32) if binary \
-                else np.float64
-            nrcells = hdr[2] if binary else hdr[1]
-            shape = (3,) + grid.shape if vector else grid.shape
 
-            if binary:
-                offset = hdr.nbytes
-                ret = np.ascontiguousarray(io.memmap(f, offset=offset,
-                    dtype=dtype, shape=shape, mode='r'))
+    def read_tausurface(self, io):
+        '''
+        Opens :code:`tausurface_3d.out`, the positions at which the optical
+        depth from the observer reaches the requested value, as a cube with
+        three components per pixel.
 
-            else:
-                ret = np.ascontiguousarray(np.fromfile(f, dtype=dtype,
-                    count=3*nrcells if vector else nrcells, sep=sep).\
-                        reshape(shape, order='F'))
+        :param Io io: Current I/O context
 
-        return ret
+        :returns: The cube, or :code:`None` if there is no file
+        :rtype: image.Image
+        '''
+
+        return self.read_image(io, 'tausurface_3d', ncomp=3)
+
+
+    def read_spectrum(self, io, fname='spectrum.out'):
+        '''
+        Reads a spectrum. The file is parsed again only if it has changed.
+
+        :param Io io: Current I/O context
+        :param str fname: The file name, relative to the output directory
+
+        :returns: The spectrum, or :code:`None` if there is no file
+        :rtype: image.Spectrum
+        '''
+
+        return io.index.parsed(fname, Spectrum.parse)
+
+
+    def read_field(self, io, hdr, shape):
+        '''
+        Private function. Reads the single field described by a header.
+
+        :param Io io: Current I/O context
+        :param FieldHeader hdr: Header of the file
+        :param tuple shape: Shape of the field
+
+        :returns: The field
+        :rtype: np.ndarray
+        '''
+
+        with io.file_open_read(hdr.fname) as f:
+
+            if hdr.binary:
+                return self.wrap(io.memmap(f, offset=hdr.offset,
+                    dtype=hdr.dtype, shape=shape, mode='r'))
+
+            np.fromfile(f, sep=' ', count=hdr.count, dtype=np.int64)
+
+            return self.wrap(np.fromfile(f, dtype=hdr.dtype,
+                count=int(np.prod(shape)), sep=' ').reshape(shape, order='F'))
 
 # vim: set ft=python:
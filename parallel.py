@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import multiprocessing.pool
+
+
+def make_pool(workers, executor='thread'):
+    '''
+    Creates a pool of workers.
+
+    :param int workers: Number of workers in the pool
+    :param str executor: :code:`thread` for a thread pool, which suits models
+        that spend their time in NumPy and so release the GIL, or
+        :code:`process` for a process pool, which suits pure-Python models;
+        everything handed to a process pool must be picklable
+
+    :returns: The pool, which the caller must close and join
+    :rtype: multiprocessing.pool.Pool
+
+    :raises ValueError: if the executor type is not recognized
+    '''
+
+    if executor == 'thread':
+        return multiprocessing.pool.ThreadPool(workers)
+
+    elif executor == 'process':
+        return multiprocessing.Pool(workers)
+
+    raise ValueError('unknown executor %s' % executor)
+
+
+def pool_map(func, iterable, workers=1, executor='thread'):
+    '''
+    Applies a function to every item of an iterable, using a pool of workers
+    if more than one is requested.
+
+    :param func: Function of one argument; must be defined at module level
+        if a process pool is used
+    :param iterable: The arguments
+    :param int workers: Number of workers; with one (or :code:`None`), the
+        items are processed in the calling thread
+    :param str executor: Pool type; see :func:`make_pool`
+
+    :returns: The results, in the order of the arguments
+    :rtype: list
+    '''
+
+    if workers is None or workers <= 1:
+        return [func(x) for x in iterable]
+
+    pool = make_pool(workers, executor)
+
+    try:
+        return pool.map(func, iterable)
+    finally:
+        pool.close()
+        pool.join()
+
+# vim: set ft=python:
@@ -1,45 +1,468 @@
 # -*- coding: utf-8 -*-
 
+import re
+import fnmatch
 import numpy as np
 from mapper import *
 from coordsys import CartesianCoordinates
+from parallel import pool_map
 
 
 class VtkRender(object):
     '''
     Renders the current input and output files as VTK output that can be
-    visualized with VisIt and other VTK visualization software.
+    visualized with VisIt and other VTK visualization software. Files are
+    written in the legacy binary VTK format by this module itself: fields
+    are streamed from the memory maps of the RADMC3D binary files to disk a
+    slab of cells at a time, so models larger than memory can be rendered.
+    Cartesian grids are written as rectilinear grids, and other grids as
+    structured grids whose points are converted to Cartesian coordinates.
+
+    :param list fields: Names of the fields to write, which may contain
+        shell-style wildcards (such as :code:`dust_density_*`), or
+        :code:`None` for all fields found in the output directory
+    :param dtype: Data type of the output (:code:`np.float32` halves the
+        size of the files), or :code:`None` to keep that of the inputs
     '''
 
-    def render(self, io, grid):
+    groups = ['dust_density', 'dust_temperature', 'gas_number_density',
+        'gas_temperature', 'gas_velocity']
+    '''The variables of :func:`~mapper.Mapper.map_variables`, in order.'''
+
+    def __init__(self, fields=None, dtype=None):
+
+        self._fields = fields
+        self._dtype = dtype
+
+
+    def render(self, io, grid, fname='model'):
         '''
-        Writes the VTK file for all variables that can be found in the output
-        directory.
+        Writes the VTK file for the selected variables that can be found in
+        the output directory.
 
         :param Io io: Current I/O context
         :param Grid grid: Current grid definition
+        :param str fname: Name of the file, without the :code:`.vtk`
+            extension, relative to the output directory
+
+        :raises ValueError: if the grid is not a regular grid
+        '''
+
+        if len(grid.shape) != 3:
+            raise ValueError('VTK output is only supported for regular '
+                'grids; render the base grid of an oct-tree or layered grid '
+                'instead')
+
+        fields = self.select(io, grid)
+        dtype = self.output_dtype(fields)
+
+        with io.file_open_write(fname + '.vtk') as f:
+            f.write('# vtk DataFile Version 3.0\n%s\nBINARY\n' % fname)
+
+            if grid.coordsys is CartesianCoordinates:
+                write_rectilinear(f, grid, dtype)
+            else:
+                write_points(f, grid, dtype, io.chunksize)
+
+            f.write('CELL_DATA %d\n' % grid.nrcells)
+
+            for name, arr, ncomp in fields:
+                if ncomp == 1:
+                    f.write('SCALARS %s %s 1\nLOOKUP_TABLE default\n' %
+                        (name, vtk_type(dtype)))
+                else:
+                    f.write('VECTORS %s %s\n' % (name, vtk_type(dtype)))
+
+                write_cells(f, grid, arr, dtype, io.chunksize)
+                f.write('\n')
+
+
+    def render_pieces(self, io, grid, pieces, workers=None,
+    executor='process', fname='model'):
         '''
+        Writes the selected variables as a partitioned XML VTK dataset: the
+        grid is split along the `w` dimension into blocks, each written to
+        its own piece file (:code:`.vtr` for Cartesian grids, :code:`.vts`
+        otherwise) by a pool of workers, and a parallel index file
+        (:code:`.pvtr` or :code:`.pvts`) lists the pieces, so that parallel
+        visualization software can load them concurrently as well. Each
+        worker maps the fields itself, so with ASCII input files every
+        worker parses them in full.
 
-        mapper = Mapper()
-        mapped = mapper.map_variables(io, grid)
+        :param Io io: Current I/O context
+        :param Grid grid: Current grid definition
+        :param int pieces: Number of pieces; at most one per `w` layer
+        :param int workers: Number of pieces written concurrently; defaults
+            to the number of pieces
+        :param str executor: Pool type; see :func:`parallel.make_pool`
+        :param str fname: Name of the index file, without its extension,
+            relative to the output directory; piece :code:`i` is named
+            :code:`fname_i`
+
+        :raises ValueError: if the grid is not a regular grid
+        '''
+
+        if len(grid.shape) != 3:
+            raise ValueError('VTK output is only supported for regular '
+                'grids; render the base grid of an oct-tree or layered grid '
+                'instead')
+
+        fields = self.select(io, grid)
+        dtype = self.output_dtype(fields)
+
+        kind = 'RectilinearGrid' if grid.coordsys is CartesianCoordinates \
+            else 'StructuredGrid'
+        ext = 'vtr' if kind == 'RectilinearGrid' else 'vts'
+
+        n = max(1, min(pieces, grid.nw))
+        bounds = [grid.nw * i // n for i in range(n + 1)]
+        names = ['%s_%d.%s' % (fname, i, ext) for i in range(n)]
+        index = '%s.p%s' % (fname, ext)
+
+        # Workers cannot prompt, so clobbering is checked for every file
+        # here, and the files are then opened without checking again
+        for name in names + [index]:
+            io.safe_check_clobber(name)
+
+        tasks = [(self, io, grid, names[i], bounds[i], bounds[i+1])
+            for i in range(n)]
+        pool_map(write_piece, tasks, n if workers is None else workers,
+            executor)
+
+        with open(io.fullpath(index), 'w') as f:
+            f.write('<?xml version="1.0"?>\n')
+            f.write('<VTKFile type="P%s" version="0.1" byte_order="BigEndian" '
+                'header_type="UInt64">\n' % kind)
+            f.write('<P%s WholeExtent="%s" GhostLevel="0">\n' %
+                (kind, extent(grid, 0, grid.nw)))
+
+            f.write('<PCellData>\n')
+            for name, _, ncomp in fields:
+                f.write('<PDataArray type="%s" Name="%s" '
+                    'NumberOfComponents="%d"/>\n' % (xml_type(dtype), name,
+                    ncomp))
+            f.write('</PCellData>\n')
+
+            if kind == 'RectilinearGrid':
+                f.write('<PCoordinates>\n')
+                for name in 'xyz':
+                    f.write('<PDataArray type="%s" Name="%s"/>\n' %
+                        (xml_type(dtype), name))
+                f.write('</PCoordinates>\n')
+            else:
+                f.write('<PPoints>\n<PDataArray type="%s" '
+                    'NumberOfComponents="3"/>\n</PPoints>\n' % xml_type(dtype))
+
+            for i in range(n):
+                f.write('<Piece Extent="%s" Source="%s"/>\n' %
+                    (extent(grid, bounds[i], bounds[i+1]), names[i]))
+
+            f.write('</P%s>\n</VTKFile>\n' % kind)
+
+
+    def wanted(self, name, group=False):
+        '''
+        Private function. Checks whether a field is selected; for a group of
+        fields, checks whether any of its fields may be, without loading it.
+        '''
 
-        vtk_grid = grid.vtk
+        if self._fields is None: return True
 
-        for scalar in ['dust_density', 'dust_temperature', 'gas_number_density']:
-            for k, v in mapped[scalar].items():
-                if v is None: continue
-                vtk_grid.add_scalar_cell_data('%s_%s' % (scalar, k), v)
+        for pattern in self._fields:
+            if fnmatch.fnmatchcase(name, pattern): return True
+
+            if group:
+                prefix = re.split(r'[*?[]', pattern)[0]
+                if name.startswith(prefix) or prefix.startswith(name + '_'):
+                    return True
+
+        return False
+
+
+    def select(self, io, grid):
+        '''
+        Maps the selected fields. Only the variables that may hold selected
+        fields are read.
+
+        :param Io io: Current I/O context
+        :param Grid grid: Current grid definition
+
+        :returns: A tuple of the name, the array (in the grid shape, or with
+            a leading axis of three components for vectors) and the number
+            of components of each field
+        :rtype: list
+        '''
+
+        mapped = Mapper().map_variables(io, grid)
+        ret = list()
+
+        for group in self.groups:
+            if not self.wanted(group, group=True): continue
+            value = mapped[group]
+
+            if isinstance(value, dict):
+                for k in sorted(value.keys()):
+                    name = '%s_%s' % (group, k)
+                    if value[k] is None or not self.wanted(name): continue
+                    ret.append((name, value[k], 1))
+
+            elif value is not None and self.wanted(group):
+                ret.append((group, value, 3 if value.ndim == 4 else 1))
+
+        return ret
+
+
+    def output_dtype(self, fields):
+        '''
+        Private function. Gives the data type of the output: the one set, or
+        the widest of the fields.
+        '''
+
+        if self._dtype is not None: return np.dtype(self._dtype)
+        if not fields: return np.dtype(np.float64)
+        return np.result_type(*[arr.dtype for _, arr, _ in fields])
+
+
+    @property
+    def fields(self):
+        '''
+        Names of the fields to write, possibly with wildcards, or
+        :code:`None` for all of them.
+        '''
+        return self._fields
+
+    @fields.setter
+    def fields(self, val):
+        self._fields = val
+
+    @property
+    def dtype(self):
+        '''
+        Data type of the output, or :code:`None` to keep that of the inputs.
+        '''
+        return self._dtype
+
+    @dtype.setter
+    def dtype(self, val):
+        self._dtype = val
+
+
+
+def vtk_type(dtype):
+    '''
+    Private function. Gives the VTK name of a floating-point data type.
+    '''
+
+    return 'float' if np.dtype(dtype).itemsize == 4 else 'double'
+
+
+def xml_type(dtype):
+    '''
+    Private function. Gives the XML VTK name of a floating-point data type.
+    '''
+
+    return 'Float32' if np.dtype(dtype).itemsize == 4 else 'Float64'
+
+
+def extent(grid, k0, k1):
+    '''
+    Private function. Gives the XML VTK extent of cell layers :code:`k0` to
+    :code:`k1` (excluded) of a grid, in points.
+    '''
+
+    return '0 %d 0 %d %d %d' % (grid.nu, grid.nv, k0, k1)
+
+
+def write_piece(args):
+    '''
+    Private function. Writes one piece of a partitioned XML VTK dataset,
+    with its arrays as raw appended data streamed a slab at a time. Defined
+    at module level so that it can be handed to a process pool; the caller
+    must check beforehand that the piece file may be clobbered.
+
+    :param tuple args: The renderer, the I/O context, the grid, the name of
+        the piece file, and the first and last (excluded) cell layers of the
+        piece
+    '''
+
+    render, io, grid, fname, k0, k1 = args
+
+    fields = render.select(io, grid)
+    dtype = render.output_dtype(fields)
+    itemsize = np.dtype(dtype).itemsize
+    ncells = grid.nu * grid.nv * (k1 - k0)
+    big = np.dtype(dtype).newbyteorder('>')
+
+    kind = 'RectilinearGrid' if grid.coordsys is CartesianCoordinates \
+        else 'StructuredGrid'
+
+    # Geometry arrays, as tuples of name, number of values, and a function
+    # returning the byte strings of the values
+    if kind == 'RectilinearGrid':
+        geometry = [(name, axis.shape[0], lambda axis=axis:
+            [axis.astype(big).tobytes()]) for name, axis in
+            zip('xyz', (grid.u, grid.v, grid.w[k0:k1+1]))]
+    else:
+        geometry = [(None, 3 * (grid.nu + 1) * (grid.nv + 1) * (k1 - k0 + 1),
+            lambda: point_blocks(grid, dtype, io.chunksize, k0, k1))]
+
+    arrays = [(name, ncomp * ncells, lambda arr=arr:
+        cell_blocks(grid, arr, dtype, io.chunksize, k0, k1))
+        for name, arr, ncomp in fields]
+
+    offsets = list()
+    offset = 0
+
+    for _, count, _ in geometry + arrays:
+        offsets.append(offset)
+        offset += 8 + count * itemsize
+
+    with open(io.fullpath(fname), 'w') as f:
+        f.write('<?xml version="1.0"?>\n')
+        f.write('<VTKFile type="%s" version="0.1" byte_order="BigEndian" '
+            'header_type="UInt64">\n' % kind)
+        f.write('<%s WholeExtent="%s">\n' % (kind, extent(grid, k0, k1)))
+        f.write('<Piece Extent="%s">\n' % extent(grid, k0, k1))
+
+        if kind == 'RectilinearGrid':
+            f.write('<Coordinates>\n')
+            for (name, _, _), off in zip(geometry, offsets):
+                f.write('<DataArray type="%s" Name="%s" format="appended" '
+                    'offset="%d"/>\n' % (xml_type(dtype), name, off))
+            f.write('</Coordinates>\n')
+        else:
+            f.write('<Points>\n<DataArray type="%s" NumberOfComponents="3" '
+                'format="appended" offset="%d"/>\n</Points>\n' %
+                (xml_type(dtype), offsets[0]))
+
+        f.write('<CellData>\n')
+        for (name, _, ncomp), off in zip(fields, offsets[len(geometry):]):
+            f.write('<DataArray type="%s" Name="%s" NumberOfComponents="%d" '
+                'format="appended" offset="%d"/>\n' % (xml_type(dtype), name,
+                ncomp, off))
+        f.write('</CellData>\n')
+
+        f.write('</Piece>\n</%s>\n' % kind)
+        f.write('<AppendedData encoding="raw">\n_')
+
+        for _, count, blocks in geometry + arrays:
+            f.write(np.array([count * itemsize], dtype='>u8').tobytes())
+            for block in blocks():
+                f.write(block)
+
+        f.write('\n</AppendedData>\n</VTKFile>\n')
+
+
+def slabs(n, layer, size):
+    '''
+    Private function. Splits a range of `w` layers into slabs of at most
+    :code:`size` values, with at least one layer per slab.
+
+    :param int n: Number of layers
+    :param int layer: Number of values per layer
+    :param int size: Maximum number of values per slab, or :code:`None`
+    '''
+
+    step = n if size is None else max(1, size // max(1, layer))
+
+    for k0 in range(0, n, step):
+        yield k0, min(k0 + step, n)
+
+
+def write_rectilinear(f, grid, dtype):
+    '''
+    Private function. Writes the geometry of a Cartesian grid.
+    '''
+
+    big = np.dtype(dtype).newbyteorder('>')
+
+    f.write('DATASET RECTILINEAR_GRID\n')
+    f.write('DIMENSIONS %d %d %d\n' % (grid.nu + 1, grid.nv + 1, grid.nw + 1))
+
+    for name, axis in zip('XYZ', (grid.u, grid.v, grid.w)):
+        f.write('%s_COORDINATES %d %s\n' % (name, axis.shape[0],
+            vtk_type(dtype)))
+        f.write(axis.astype(big).tobytes())
+        f.write('\n')
+
+
+def write_points(f, grid, dtype, size):
+    '''
+    Private function. Writes the geometry of a grid as the Cartesian
+    coordinates of its points.
+    '''
+
+    f.write('DATASET STRUCTURED_GRID\n')
+    f.write('DIMENSIONS %d %d %d\n' % (grid.nu + 1, grid.nv + 1, grid.nw + 1))
+    f.write('POINTS %d %s\n' % ((grid.nu + 1) * (grid.nv + 1) * (grid.nw + 1),
+        vtk_type(dtype)))
+
+    for block in point_blocks(grid, dtype, size):
+        f.write(block)
+    f.write('\n')
+
+
+def write_cells(f, grid, arr, dtype, size):
+    '''
+    Private function. Writes a cell field in VTK order.
+    '''
+
+    for block in cell_blocks(grid, arr, dtype, size):
+        f.write(block)
+
+
+def point_blocks(grid, dtype, size, k0=0, k1=None):
+    '''
+    Private function. Converts the points of a grid to Cartesian
+    coordinates, interleaved and in VTK order, a slab of `w` layers at a
+    time.
+
+    :param Grid grid: Current grid definition
+    :param dtype: Data type of the output, in big-endian order
+    :param int size: Maximum number of values per slab, or :code:`None`
+    :param int k0: First point layer
+    :param int k1: Last point layer, included, or :code:`None` for the last
+        of the grid
+
+    :returns: The slabs as byte strings, in big-endian order
+    :rtype: generator
+    '''
+
+    big = np.dtype(dtype).newbyteorder('>')
+    if k1 is None: k1 = grid.nw
+
+    for j0, j1 in slabs(k1 - k0 + 1, 3 * (grid.nu + 1) * (grid.nv + 1), size):
+        coords = grid.broadcast_coords(grid.u, grid.v, grid.w[k0+j0:k0+j1])
+        xyz = np.broadcast_arrays(*coords.transformTo(CartesianCoordinates))
+        yield np.column_stack([a.ravel(order='F') for a in xyz]) \
+            .astype(big).tobytes()
+
+
+def cell_blocks(grid, arr, dtype, size, k0=0, k1=None):
+    '''
+    Private function. Converts a cell field to VTK order a slab of `w`
+    layers at a time, so that only one slab of a memory-mapped field is in
+    memory at once.
+
+    :param Grid grid: Current grid definition
+    :param np.ndarray arr: The field, in the grid shape, or with a leading
+        axis of components for vectors
+    :param dtype: Data type of the output
+    :param int size: Maximum number of values per slab, or :code:`None`
+    :param int k0: First cell layer
+    :param int k1: Last cell layer, excluded, or :code:`None` for the last
+        of the grid
+
+    :returns: The slabs as byte strings, in big-endian order
+    :rtype: generator
+    '''
 
-        for scalar in ['gas_temperature']:
-            s = mapped[scalar]
-            if s is None: continue
-            vtk_grid.add_scalar_cell_data(scalar, s)
+    big = np.dtype(dtype).newbyteorder('>')
+    if k1 is None: k1 = grid.nw
 
-        for vector in ['gas_velocity']:
-            v = mapped[vector]
-            if v is None: continue
-            vtk_grid.add_vector_cell_data(vector, v[:,0], v[:,1], v[:,2])
+    ncomp = arr.shape[0] if arr.ndim == 4 else 1
 
-        vtk_grid.write_to_file('model')
+    for j0, j1 in slabs(k1 - k0, grid.nu * grid.nv * ncomp, size):
+        yield arr[...,k0+j0:k0+j1].ravel(order='F').astype(big).tobytes()
 
 # vim: set ft=python:
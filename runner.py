@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import shlex
+import threading
+import subprocess
+
+
+class Run(object):
+    '''
+    Handle to an external command running in the background. The command is
+    started in the given working directory (without changing the working
+    directory of this process), and its standard output and error are
+    drained concurrently by two threads, so a full pipe can never stall it;
+    a third waits for it to exit and records when it did. Several runs may
+    be in progress at once.
+
+    :param cmd: The command, either as a string to be split like a shell
+        command line or as a list of arguments
+    :param str working_dir: The directory in which to run the command
+    :param bool echo: If :code:`True`, output is copied to the standard
+        output and error of this process as it arrives
+    :param dict env: Environment of the command; defaults to that of this
+        process
+    '''
+
+    def __init__(self, cmd, working_dir, echo=True, env=None):
+
+        self._args = shlex.split(cmd) \
+            if isinstance(cmd, (str, type(u''))) else list(cmd)
+        self._working_dir = working_dir
+        self._stdout = list()
+        self._stderr = list()
+        self._end = None
+
+        self._start = time.time()
+        self._proc = subprocess.Popen(self._args, cwd=working_dir, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        self._pumps = [
+            threading.Thread(target=self.pump, args=(self._proc.stdout,
+                self._stdout, sys.stdout if echo else None)),
+            threading.Thread(target=self.pump, args=(self._proc.stderr,
+                self._stderr, sys.stderr if echo else None)) ]
+
+        self._reaper = threading.Thread(target=self.reap)
+
+        for t in self._pumps + [self._reaper]:
+            t.daemon = True
+            t.start()
+
+
+    def reap(self):
+        '''
+        Private function. Waits for the command to exit and records the time
+        at which it did. This is the only thread that waits for the process,
+        so that the exit status is never collected twice.
+        '''
+
+        self._proc.wait()
+        self._end = time.time()
+
+
+    def pump(self, pipe, lines, echo):
+        '''
+        Private function. Collects the lines of a pipe until it is closed.
+        '''
+
+        for line in iter(pipe.readline, b''):
+            lines.append(line)
+
+            if echo is not None:
+                echo.write(line)
+                echo.flush()
+
+        pipe.close()
+
+
+    def poll(self):
+        '''
+        Checks whether the command has finished and all of its output has
+        been collected, without blocking.
+
+        :returns: The exit status, or :code:`None` if still running
+        :rtype: int
+        '''
+
+        if self._end is None or any(t.is_alive() for t in self._pumps):
+            return None
+
+        return self._proc.returncode
+
+
+    def wait(self, timeout=None):
+        '''
+        Waits for the command to finish and for all of its output to be
+        collected.
+
+        :param float timeout: Maximum time to wait, in seconds, or
+            :code:`None` to wait indefinitely
+
+        :returns: The exit status, or :code:`None` if the timeout expired
+        :rtype: int
+        '''
+
+        deadline = None if timeout is None else time.time() + timeout
+
+        for t in self._pumps + [self._reaper]:
+            t.join(None if deadline is None else
+                max(0., deadline - time.time()))
+            if t.is_alive(): return None
+
+        return self._proc.returncode
+
+
+    def kill(self):
+        '''Kills the command if it is still running.'''
+
+        if self._end is None:
+            try:
+                self._proc.kill()
+            except OSError:
+                pass
+
+
+    @property
+    def args(self):
+        '''Read-only; gives the command as a list of arguments.'''
+        return self._args
+
+    @property
+    def working_dir(self):
+        '''Read-only; gives the directory in which the command runs.'''
+        return self._working_dir
+
+    @property
+    def returncode(self):
+        '''
+        Read-only; gives the exit status, or :code:`None` if the command has
+        not finished.
+        '''
+        return self._proc.returncode if self._end is not None else None
+
+    @property
+    def running(self):
+        '''Read-only; :code:`True` while the command has not finished.'''
+        return self.poll() is None
+
+    @property
+    def elapsed(self):
+        '''
+        Read-only; gives the wall-clock time in seconds since the command was
+        started, or its total run time once it has finished.
+        '''
+        return (self._end if self._end is not None else time.time()) - \
+            self._start
+
+    @property
+    def stdout(self):
+        '''Read-only; gives the standard output collected so far.'''
+        return b''.join(self._stdout)
+
+    @property
+    def stderr(self):
+        '''Read-only; gives the standard error collected so far.'''
+        return b''.join(self._stderr)
+
+
+
+class CompletedRun(object):
+    '''
+    Handle to a command that did not need to be run, because its results
+    were restored from a :class:`~cache.ResultCache`. It behaves like a
+    :class:`Run` that has already finished successfully, without output, so
+    callers need not tell the two apart.
+
+    :param cmd: The command, either as a string to be split like a shell
+        command line or as a list of arguments
+    :param str working_dir: The directory in which the command would have
+        run
+    '''
+
+    def __init__(self, cmd, working_dir):
+
+        self._args = shlex.split(cmd) \
+            if isinstance(cmd, (str, type(u''))) else list(cmd)
+        self._working_dir = working_dir
+
+
+    def poll(self):
+        '''
+        Checks whether the command has finished, which it has.
+
+        :returns: The exit status, 0
+        :rtype: int
+        '''
+
+        return 0
+
+
+    def wait(self, timeout=None):
+        '''
+        Waits for the command to finish, which it has.
+
+        :param float timeout: Ignored
+
+        :returns: The exit status, 0
+        :rtype: int
+        '''
+
+        return 0
+
+
+    def kill(self):
+        '''Does nothing, since there is no process.'''
+
+        pass
+
+
+    @property
+    def args(self):
+        '''Read-only; gives the command as a list of arguments.'''
+        return self._args
+
+    @property
+    def working_dir(self):
+        '''Read-only; gives the directory in which the command would run.'''
+        return self._working_dir
+
+    @property
+    def returncode(self):
+        '''Read-only; gives the exit status, 0.'''
+        return 0
+
+    @property
+    def running(self):
+        '''Read-only; always :code:`False`.'''
+        return False
+
+    @property
+    def elapsed(self):
+        '''Read-only; gives the run time, 0.'''
+        return 0.
+
+    @property
+    def stdout(self):
+        '''Read-only; gives the standard output, which is empty.'''
+        return b''
+
+    @property
+    def stderr(self):
+        '''Read-only; gives the standard error, which is empty.'''
+        return b''
+
+# vim: set ft=python:
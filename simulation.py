@@ -1,13 +1,20 @@
 # -*- coding: utf-8 -*-
 
+import os
+import threading
 from configuration import *
 from fileio import *
 from grid import *
 from star import *
 from dust import *
 from gas import *
+from stellarsrc import *
 from render import *
-from __init__ import execute
+from runner import Run, CompletedRun
+from camera import ImageBatch, SedBatch
+from child import SessionPool
+from fingerprint import fingerprint
+from cache import ResultCache
 
 
 class Simulation(object):
@@ -26,35 +33,45 @@ class Simulation(object):
         self._star = StarContainer()
         self._dust = DustContainer()
         self._gas = MoleculeContainer()
+        self._stellarsrc = StellarSourceContainer()
         self._render = VtkRender()
 
-        self._config_written = False
-        self._grid_written = False
+        self._workers = 1
+        self._executor = 'thread'
+
+        self._fingerprints = dict()
+        self._cache = None
         self._cleaned = False
 
 
     def commit_mctherm(self):
         '''
         Writes the encapsulated data to files in the output directory, to be
-        read by RADMC3D for Monte Carlo thermal simulation.
+        read by RADMC3D for Monte Carlo thermal simulation. Only files whose
+        inputs have changed since the last commit are written again; in
+        binary mode, only the changed species of the dust density file are.
         '''
 
         if not self._cleaned:
             self._io.smart_clean_outdir()
             self._cleaned = True
 
-        self.write_wavelengths()
+        fp = fingerprint(self._lmbda, self._io.digits)
+        if self.stale('wavelength_micron.inp', fp):
+            self.write_wavelengths()
+            self._fingerprints['wavelength_micron.inp'] = fp
 
-        if not self._config_written:
-            self._config.write(self._io)
-            self._config_written = True
+        self.commit_config()
+        self.commit_grid()
 
-        if not self._grid_written:
-            self._grid.write(self._io)
-            self._grid_written = True
+        fp = fingerprint(self._star, self._lmbda, self._grid.coordsys,
+            self._io.digits)
+        if self.stale('stars.inp', fp):
+            self._star.write(self._io, self._lmbda, self._grid)
+            self._fingerprints['stars.inp'] = fp
 
-        self._star.write(self._io, self._lmbda, self._grid)
-        self._dust.write(self._io, self._grid)
+        self.commit_stellarsrc()
+        self.commit_dust()
 
 
     def commit_lines(self):
@@ -64,15 +81,92 @@ class Simulation(object):
             self._io.smart_clean_outdir()
             self._cleaned = True
 
-        if not self._config_written:
+        self.commit_config()
+        self.commit_grid()
+
+        self._gas.write(self._io, self._grid, self._workers, self._executor)
+
+
+    def stale(self, fname, fp):
+        '''
+        Private function. Checks whether a file must be written: that is the
+        case if it does not exist or if the fingerprint of its inputs differs
+        from the one recorded when it was last written.
+
+        :param str fname: A filename relative to the output directory
+        :param fp: The fingerprint of the current inputs of the file
+
+        :returns: :code:`True` if the file must be written
+        :rtype: bool
+        '''
+
+        return self._fingerprints.get(fname) != fp or \
+            not self._io.file_check_exists(fname)
+
+
+    def commit_config(self):
+        '''Private function; writes the configuration if it changed.'''
+
+        fp = fingerprint(self._config)
+        if self.stale('radmc3d.inp', fp):
             self._config.write(self._io)
-            self._config_written = True
+            self._fingerprints['radmc3d.inp'] = fp
+
+
+    def commit_grid(self):
+        '''Private function; writes the grid if it changed.'''
+
+        io = self._io
+        fname = 'amr_grid.%s' % ('binp' if io.binary else 'inp')
+
+        fp = fingerprint(self._grid, io.binary, io.precis, io.digits)
+        if self.stale(fname, fp):
+            self._grid.write(io)
+            self._fingerprints[fname] = fp
+
+
+    def commit_dust(self):
+        '''
+        Private function; writes the dust species if they changed. If only
+        the parameters of some species changed, and the density file is
+        binary, only the sections of those species are rewritten.
+        '''
+
+        io = self._io
+        fname = 'dust_density.%s' % ('binp' if io.binary else 'inp')
+
+        layout = fingerprint(list(self._dust.keys()), self._grid, io.binary,
+            io.precis, io.digits)
+        species = dict((k, fingerprint(d)) for k, d in self._dust.items())
+
+        old = self._fingerprints.get(fname)
+        only = None
+
+        if old is not None and old[0] == layout and \
+        io.file_check_exists(fname) and io.file_check_exists('dustopac.inp'):
+            only = [k for k in species if species[k] != old[1].get(k)]
+            if not only: return
+            if not io.binary: only = None
 
-        if not self._grid_written:
-            self._grid.write(self._io)
-            self._grid_written = True
+        self._dust.write(io, self._grid, self._workers, self._executor, only)
+        self._fingerprints[fname] = (layout, species)
 
-        self._gas.write(self._io, self._grid)
+
+    def commit_stellarsrc(self):
+        '''Private function; writes the smooth stellar sources if they changed.'''
+
+        io = self._io
+        if not self._stellarsrc: return
+
+        fname = 'stellarsrc_density.%s' % ('binp' if io.binary else 'inp')
+
+        fp = fingerprint(self._stellarsrc, self._lmbda, self._grid, io.binary,
+            io.precis, io.digits)
+        if self.stale(fname, fp) or \
+        not io.file_check_exists('stellarsrc_templates.inp'):
+            self._stellarsrc.write(io, self._lmbda, self._grid, self._workers,
+                self._executor)
+            self._fingerprints[fname] = fp
 
 
     def write_wavelengths(self):
@@ -80,17 +174,187 @@ class Simulation(object):
 
         with self._io.file_open_write('wavelength_micron.inp') as f:
             f.write('%d\n' % self.nlmbda)
-            self._lmbda.tofile(f, sep='\n', format='%e')
+            self._io.write_ascii(f, self._lmbda)
+
+
+    def run_mctherm(self, wait=True, threads=None, echo=True):
+        '''
+        Runs the :code:`mctherm` command of RADMC3D; see
+        :func:`run_command`.
+
+        :param bool wait: If :code:`False`, return as soon as RADMC3D has
+            been started, so that it runs in the background
+        :param int threads: Number of threads of RADMC3D, or :code:`None` to
+            leave it to RADMC3D
+        :param bool echo: If :code:`True`, the output of RADMC3D is copied to
+            the standard output and error of this process
+
+        :returns: Handle to the run
+        :rtype: runner.Run
+        '''
+
+        return self.run_command('mctherm', wait, threads, echo)
+
+
+    def run_command(self, command, wait=True, threads=None, echo=True):
+        '''
+        Runs a RADMC3D command in the output directory. If a result cache is
+        set, knows the outputs of the command, and holds results for the
+        current input files, they are restored instead; otherwise,
+        successful results are added to it, under the key of the inputs as
+        they were when the run started.
+
+        :param str command: The RADMC3D command, such as :code:`mctherm`
+        :param bool wait: If :code:`False`, return as soon as RADMC3D has
+            been started, so that it runs in the background
+        :param int threads: Number of threads of RADMC3D, or :code:`None` to
+            leave it to RADMC3D
+        :param bool echo: If :code:`True`, the output of RADMC3D is copied to
+            the standard output and error of this process
+
+        :returns: Handle to the run, with its exit status, timing and output;
+            if the results were restored from the cache, a handle to a run
+            that has already finished successfully
+        :rtype: runner.Run
+        '''
+
+        cmd = ['radmc3d', command]
+        env = None
+
+        if threads is not None:
+            cmd += ['setthreads', str(threads)]
+            env = dict(os.environ, OMP_NUM_THREADS=str(threads))
+
+        cache = self._cache if self._cache is not None and \
+            command in self._cache.outputs else None
+
+        if cache is not None:
+            key = cache.key(self._io, command)
+
+            if cache.fetch(self._io, command, key):
+                return CompletedRun(cmd, self._io.outdir)
 
+            cache.clear_outputs(self._io, command)
 
-    def run_mctherm(self):
-        '''Runs the :code:`mctherm` command of RADMC3D.'''
-        execute('radmc3d mctherm', self.io.outdir)
+        run = Run(cmd, self._io.outdir, echo=echo, env=env)
 
+        if cache is not None:
+            t = threading.Thread(target=self.store_result,
+                args=(run, command, key))
+            t.daemon = True
+            t.start()
+            if wait: t.join()
 
-    def render(self):
-        '''Outputs a VTK file with all defined variables.'''
-        self._render.render(self._io, self._grid)
+        elif wait:
+            run.wait()
+
+        return run
+
+
+    def forget_commits(self):
+        '''
+        Private function. Forgets which files were written and that the
+        output directory was cleaned, so that the next commit cleans it and
+        writes everything; used for copies that get a new output directory.
+        '''
+
+        self._fingerprints = dict()
+        self._cleaned = False
+
+
+    def images(self, cameras, maxprocs=1, threads=None, stem='image'):
+        '''
+        Makes an image for each of a list of cameras, running up to
+        :code:`maxprocs` RADMC3D processes at once; see
+        :class:`~camera.ImageBatch`. The model must already be committed.
+
+        :param list cameras: The :class:`~camera.Camera` specifications
+        :param int maxprocs: Maximum number of RADMC3D processes running at
+            once
+        :param int threads: Number of threads per RADMC3D process, or
+            :code:`None` to leave it to RADMC3D
+        :param str stem: Name of the collected cubes, without the index
+
+        :returns: A :class:`~camera.CameraResult` per camera, as soon as each
+            is made, so in the order in which the runs finish; the
+            :code:`index` of a result gives the position of its camera. The
+            runs start when iteration does.
+        :rtype: generator
+        '''
+
+        batch = ImageBatch(self._io, cameras, maxprocs, threads, stem)
+        return batch.run()
+
+
+    def sed(self, incl, phi=0., maxprocs=1, threads=None, options=()):
+        '''
+        Makes the spectral energy distribution of the model seen from each
+        of a list of viewing angles, running up to :code:`maxprocs` RADMC3D
+        processes at once. The model must already be committed, with dust
+        temperatures. To take the spectra as they finish, use
+        :func:`~camera.SedBatch.run` instead.
+
+        :param incl: Inclinations (in degrees)
+        :param phi: Azimuthal viewing angles (in degrees), broadcast against
+            the inclinations
+        :param int maxprocs: Maximum number of RADMC3D processes running at
+            once
+        :param int threads: Number of threads per RADMC3D process, or
+            :code:`None` to leave it to RADMC3D
+        :param list options: Further arguments for RADMC3D, such as
+            :code:`nostar`
+
+        :returns: The fluxes at 1 parsec, with one row per view and one
+            column per wavelength of :attr:`lmbda`
+        :rtype: np.ndarray
+        '''
+
+        batch = SedBatch(self._io, incl, phi, maxprocs, threads, options)
+        return batch.stack()
+
+
+    def sessions(self, size=1, threads=None):
+        '''
+        Starts a pool of persistent RADMC3D processes for this model, which
+        load it once and then serve any number of images and spectra; see
+        :class:`~child.SessionPool`. The model must already be committed, and
+        the pool must be closed, or used in a :code:`with` block.
+
+        :param int size: Maximum number of RADMC3D processes
+        :param int threads: Number of threads per RADMC3D process, or
+            :code:`None` to leave it to RADMC3D
+
+        :returns: The pool
+        :rtype: child.SessionPool
+        '''
+
+        return SessionPool(self._io, size, threads)
+
+
+    def store_result(self, run, command, key):
+        '''
+        Private function. Waits for a run to finish and, if it succeeded,
+        stores its results in the cache under the key of its inputs.
+        '''
+
+        if run.wait() == 0:
+            self._cache.store(self._io, command, key)
+
+
+    def render(self, pieces=None):
+        '''
+        Outputs a VTK file with all defined variables, or those selected in
+        the :attr:`renderer`.
+
+        :param int pieces: If set, write a partitioned dataset of this many
+            pieces, concurrently, instead; see
+            :func:`~render.VtkRender.render_pieces`
+        '''
+
+        if pieces is None:
+            self._render.render(self._io, self._grid)
+        else:
+            self._render.render_pieces(self._io, self._grid, pieces)
 
 
     @property
@@ -103,6 +367,44 @@ class Simulation(object):
         self._lmbda = arr.copy()
         self.nlmbda = arr.shape[0]
 
+    @property
+    def workers(self):
+        '''
+        Number of workers used to evaluate and write the dust species and
+        molecules concurrently; defaults to 1 (no concurrency).
+        '''
+        return self._workers
+
+    @workers.setter
+    def workers(self, val):
+        self._workers = val
+
+    @property
+    def executor(self):
+        '''
+        Type of worker pool used when :attr:`workers` is greater than 1:
+        :code:`thread` (the default) suits NumPy-heavy models, while
+        :code:`process` suits pure-Python models, which must then be
+        picklable.
+        '''
+        return self._executor
+
+    @executor.setter
+    def executor(self, val):
+        self._executor = val
+
+    @property
+    def cache(self):
+        '''
+        The :class:`~cache.ResultCache` consulted by the run methods, or
+        :code:`None` (the default) to always run RADMC3D.
+        '''
+        return self._cache
+
+    @cache.setter
+    def cache(self, val):
+        self._cache = val
+
     @property
     def config(self):
         '''Accessor to the underlying configuration object.'''
@@ -132,9 +434,19 @@ class Simulation(object):
         '''Accessor to the underlying molecule container object.'''
         return self._gas
 
+    @property
+    def renderer(self):
+        '''Accessor to the underlying VTK renderer object.'''
+        return self._render
+
     @property
     def star(self):
         '''Accessor to the underlying star container object.'''
         return self._star
 
+    @property
+    def stellarsrc(self):
+        '''Accessor to the underlying stellar source container object.'''
+        return self._stellarsrc
+
 # vim: set ft=python:
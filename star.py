@@ -1,8 +1,32 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import numpy as np
+from cgs import cgs
 from coordsys import CartesianCoordinates
 
 
+def planck(lmbda, T):
+    '''
+    Evaluates the Planck function :math:`B_\\nu(T)` (in
+    :math:`\\textrm{erg} / \\textrm{s} / \\textrm{cm}^2 / \\textrm{Hz} /
+    \\textrm{sr}`). The arguments are broadcast against each other, so a
+    column of temperatures and a row of wavelengths give a 2D table.
+
+    :param lmbda: Wavelengths in microns
+    :param T: Temperatures in Kelvin
+
+    :returns: The specific intensity
+    :rtype: np.ndarray
+    '''
+
+    nu = cgs.c / (np.asarray(lmbda) * 1.e-4)
+    x = cgs.h * nu / (cgs.k * np.asarray(T))
+
+    return 2. * cgs.h * nu**3 / cgs.c**2 / np.expm1(x)
+
+
+
 class Star(object):
     '''
     Base class for a star definition.
@@ -23,9 +47,9 @@ class Star(object):
 
     def write(self, f, lmbda):
         '''
-        Subclasses must define this method, which writes either the effective
-        temperature or the flux to the given file handle in the format expected
-        by RADMC3D.
+        Subclasses must define either this method, which writes either the
+        effective temperature or the flux to the given file handle in the
+        format expected by RADMC3D, or :func:`spectrum`.
 
         :param file f: Open file handle
         :param np.ndarray lmbda: Array of wavelengths
@@ -33,6 +57,22 @@ class Star(object):
         raise NotImplementedError
 
 
+    def spectrum(self, lmbda):
+        '''
+        Subclasses with a full spectrum define this method, which gives the
+        flux (in :math:`\\textrm{erg} / \\textrm{s} / \\textrm{cm}^2 /
+        \\textrm{Hz}`, as seen from a distance of 1 pc) at each wavelength.
+        Stars that are described otherwise return :code:`None` and are
+        written with :func:`write` instead.
+
+        :param np.ndarray lmbda: Array of wavelengths in microns
+
+        :returns: Array of fluxes, or :code:`None`
+        :rtype: np.ndarray
+        '''
+        return None
+
+
     @property
     def radius(self):
         '''The radius of this star'''
@@ -95,6 +135,147 @@ class BlackbodyStar(Star):
 
 
 
+class MultiBlackbodyStar(Star):
+    '''
+    Defines a star whose surface is a mixture of blackbody components, such
+    as a photosphere with hot or cool spots. Its spectrum is computed for
+    all components at once.
+
+    :param Teff: Effective temperature of each component in Kelvin
+    :param fractions: Fraction of the surface covered by each component;
+        defaults to equal fractions
+    '''
+
+    def __init__(self, Teff=(0.,), fractions=None, **kwargs):
+
+        super(MultiBlackbodyStar, self).__init__(**kwargs)
+        self._Teff = np.atleast_1d(np.asarray(Teff, dtype=np.float64))
+        self._fractions = np.ones_like(self._Teff) / self._Teff.shape[0] \
+            if fractions is None else \
+            np.atleast_1d(np.asarray(fractions, dtype=np.float64))
+
+
+    def spectrum(self, lmbda):
+        '''Gives the summed flux of the components at 1 pc.'''
+
+        return MultiBlackbodyStar.spectra([self], lmbda)[0]
+
+
+    @staticmethod
+    def spectra(stars, lmbda):
+        '''
+        Gives the spectra of several stars at once: the Planck function is
+        evaluated in a single call for the components of all of them, and
+        the weighted components are then summed per star.
+
+        :param list stars: The :class:`MultiBlackbodyStar` instances
+        :param np.ndarray lmbda: Array of wavelengths in microns
+
+        :returns: The flux at 1 pc, with one row per star and one column
+            per wavelength
+        :rtype: np.ndarray
+        '''
+
+        Teff = np.concatenate([s.Teff for s in stars])
+        weights = np.concatenate([np.pi * (s.radius / cgs.pc)**2 *
+            np.broadcast_to(s.fractions, s.Teff.shape) for s in stars])
+        starts = np.cumsum([0] + [s.Teff.shape[0] for s in stars[:-1]])
+
+        intensity = planck(np.asarray(lmbda)[None,:], Teff[:,None])
+        return np.add.reduceat(weights[:,None] * intensity, starts, axis=0)
+
+
+    @property
+    def Teff(self):
+        '''Effective temperatures of the components of this star'''
+        return self._Teff
+
+    @Teff.setter
+    def Teff(self, val):
+        self._Teff = np.atleast_1d(np.asarray(val, dtype=np.float64))
+
+    @property
+    def fractions(self):
+        '''Surface fractions of the components of this star'''
+        return self._fractions
+
+    @fractions.setter
+    def fractions(self, val):
+        self._fractions = np.atleast_1d(np.asarray(val, dtype=np.float64))
+
+
+
+class SpectrumStar(Star):
+    '''
+    Defines a star by a tabulated spectrum, such as a model atmosphere. The
+    table is interpolated (linearly in log-log space) onto the simulation
+    wavelengths; the result is kept for each wavelength grid it is asked
+    for, so repeated commits do not interpolate again.
+
+    :param np.ndarray lmbda: Wavelengths of the table in microns, increasing
+    :param np.ndarray flux: Flux at each wavelength of the table (in
+        :math:`\\textrm{erg} / \\textrm{s} / \\textrm{cm}^2 /
+        \\textrm{Hz}`, as seen from a distance of 1 pc)
+    '''
+
+    def __init__(self, lmbda=np.empty((0,)), flux=np.empty((0,)), **kwargs):
+
+        super(SpectrumStar, self).__init__(**kwargs)
+        self._lmbda = np.asarray(lmbda, dtype=np.float64)
+        self._flux = np.asarray(flux, dtype=np.float64)
+        self._interpolated = dict()
+
+
+    def __getstate__(self):
+        '''Interpolated spectra are not kept when pickling.'''
+        state = self.__dict__.copy()
+        state['_interpolated'] = dict()
+        return state
+
+
+    def spectrum(self, lmbda):
+        '''
+        Gives the tabulated flux interpolated at the given wavelengths; the
+        flux is zero outside the table.
+        '''
+
+        key = hashlib.sha1(np.ascontiguousarray(lmbda,
+            dtype=np.float64).tobytes()).hexdigest()
+
+        ret = self._interpolated.get(key)
+
+        if ret is None:
+            positive = self._flux > 0.
+            ret = np.exp(np.interp(np.log(lmbda),
+                np.log(self._lmbda[positive]), np.log(self._flux[positive]),
+                left=-np.inf, right=-np.inf))
+            self._interpolated[key] = ret
+
+        return ret
+
+
+    @property
+    def lmbda(self):
+        '''Wavelengths of the tabulated spectrum in microns'''
+        return self._lmbda
+
+    @lmbda.setter
+    def lmbda(self, val):
+        self._lmbda = np.asarray(val, dtype=np.float64)
+        self._interpolated = dict()
+
+    @property
+    def flux(self):
+        '''Tabulated flux at 1 pc'''
+        return self._flux
+
+    @flux.setter
+    def flux(self, val):
+        self._flux = np.asarray(val, dtype=np.float64)
+        self._interpolated = dict()
+
+
+
 class StarContainer(dict):
     '''
     Container for a variable number of stars. To support friendly naming
@@ -113,25 +294,51 @@ class StarContainer(dict):
         '''
         Writes the current content of this container to input files for
         RADMC3D. This function uses the I/O context to determine the output
-        format (binary or ASCII) and formats all files appropriately.
+        format (binary or ASCII) and formats all files appropriately. The
+        spectra of all :class:`MultiBlackbodyStar` stars are evaluated
+        together, and if all stars have a :func:`~Star.spectrum`, the fluxes
+        are written as one table in a single block.
 
         :param fileio.Io io: Current I/O context
         :param np.ndarray lmbda: Wavelength array
         :param grid.Grid grid: Current grid definition
         '''
 
+        stars = list(self.values())
+
         with io.file_open_write('stars.inp') as f:
             f.write('2\n')
-            f.write('%d\t%d\n' % (len(self), lmbda.shape[0]))
-
-            for s in self.values():
-                u, v, w = s.center.transformTo(grid.coordsys)
-                f.write('%e\t%e\t%e\t%e\t%e\n' % (s.radius, s.mass, u, v, w))
-
-            lmbda.tofile(f, sep='\n', format='%e')
-            f.write('\n')
-
-            for s in self.values():
-                s.write(f, lmbda)
+            f.write('%d\t%d\n' % (len(stars), lmbda.shape[0]))
+
+            props = np.empty((len(stars), 5))
+            for i, s in enumerate(stars):
+                props[i,:2] = s.radius, s.mass
+                props[i,2:] = s.center.transformTo(grid.coordsys)
+
+            io.write_ascii(f, props)
+            io.write_ascii(f, lmbda)
+
+            spectra = np.empty((len(stars), lmbda.shape[0]))
+            native = np.zeros((len(stars),), dtype=bool)
+
+            multi = [i for i, s in enumerate(stars)
+                if isinstance(s, MultiBlackbodyStar)]
+            if multi:
+                spectra[multi] = MultiBlackbodyStar.spectra(
+                    [stars[i] for i in multi], lmbda)
+
+            for i, s in enumerate(stars):
+                if i in multi: continue
+                spec = s.spectrum(lmbda)
+                if spec is None: native[i] = True
+                else: spectra[i] = spec
+
+            if not native.any():
+                io.write_ascii(f, spectra.ravel())
+
+            else:
+                for i, s in enumerate(stars):
+                    if native[i]: s.write(f, lmbda)
+                    else: io.write_ascii(f, spectra[i])
 
 # vim: set ft=python:
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from cgs import cgs
+from dust import write_density
+from parallel import pool_map
+
+
+class StellarSourceComponent(object):
+    '''
+    Base class from which all smooth stellar source definitions should
+    inherit. A component describes a population of stars too numerous to
+    list individually, such as a galactic bulge, by its stellar mass density
+    and a template star whose spectrum is representative of the population.
+    Components that share the same template object are summed into a single
+    density field. For example:
+
+    .. code-block:: python
+
+       import radmc3d as r3d
+
+       class Bulge(r3d.StellarSourceComponent):
+           def density(self, coords):
+               rr, _, _ = coords.transformTo(r3d.SphericalCoordinates)
+               return 1.e-20 * np.exp(-rr / (100. * r3d.cgs.au))
+
+       sun = r3d.BlackbodyStar(Teff=5772., radius=r3d.cgs.RSun,
+           mass=r3d.cgs.MSun)
+       sim.stellarsrc['bulge'] = Bulge(template=sun)
+
+    :param star.Star template: The template star; if it has a
+        :func:`~star.Star.spectrum`, that spectrum divided by the mass of the
+        star is written out, otherwise its effective temperature, radius and
+        mass are
+    '''
+
+    def __init__(self, template=None):
+
+        self._template = template
+
+
+    def density(self, coords):
+        '''
+        Evaluates the stellar mass density (in
+        :math:`\\textrm{g} / \\textrm{cm}^3`) at each of the input coordinates;
+        see :func:`~dust.DustSpecies.density`.
+
+        :param Coordinates coords: The points at which to return the
+            density
+
+        :returns: An array of densities, broadcastable to the shape of the
+            coordinates
+        :rtype: np.ndarray
+
+        :raises NotImplementedError: if the user does not define a density
+            function
+        '''
+        raise NotImplementedError
+
+
+    @property
+    def template(self):
+        '''The template star of this component'''
+        return self._template
+
+    @template.setter
+    def template(self, star):
+        self._template = star
+
+
+
+class TemplateGroup(object):
+    '''
+    Private class. Sums the densities of all components sharing a template,
+    so that the group can be written like a single dust species.
+
+    :param list components: The components of the group
+    '''
+
+    def __init__(self, components):
+
+        self.components = components
+
+
+    def density(self, coords):
+
+        ret = self.components[0].density(coords)
+        for c in self.components[1:]: ret = ret + c.density(coords)
+        return ret
+
+
+
+class StellarSourceContainer(dict):
+    '''
+    Container for a variable number of smooth stellar source components,
+    written to :code:`stellarsrc_templates.inp` and
+    :code:`stellarsrc_density.inp` (or :code:`.binp`). To support friendly
+    naming of components, this class inherits from :code:`dict` so that new
+    components can be added like so:
+
+    >>> c = StellarSourceContainer()
+    >>> c['some_name'] = SomeComponent(template=some_star)
+
+    If a duplicate name is used, the previous component will be overwritten.
+    '''
+
+    def templates(self):
+        '''
+        Groups the components of this container by template.
+
+        :returns: The distinct templates, in order of first use, and for each
+            the list of components using it
+        :rtype: tuple
+        '''
+
+        templates, groups = list(), list()
+
+        for c in self.values():
+            for i, t in enumerate(templates):
+                if t is c.template:
+                    groups[i].append(c)
+                    break
+            else:
+                templates.append(c.template)
+                groups.append([c])
+
+        return templates, groups
+
+
+    def write(self, io, lmbda, grid, workers=1, executor='thread'):
+        '''
+        Writes the current content of this container to input files for
+        RADMC3D. This function uses the I/O context to determine the output
+        format (binary or ASCII) and formats all files appropriately. The
+        densities are evaluated in chunks of :attr:`~fileio.Io.chunksize`
+        cells, as for dust species.
+
+        :param fileio.Io io: Current I/O context
+        :param np.ndarray lmbda: Wavelength array
+        :param grid.Grid grid: Current grid definition
+        :param int workers: Number of templates to evaluate concurrently
+        :param str executor: Pool type; see :func:`parallel.make_pool`
+        '''
+
+        templates, groups = self.templates()
+
+        with io.file_open_write('stellarsrc_templates.inp') as f:
+            f.write('2\n')
+            f.write('%d\n' % len(templates))
+            f.write('%d\n' % lmbda.shape[0])
+            io.write_ascii(f, lmbda)
+
+            for t in templates:
+                spec = t.spectrum(lmbda)
+
+                if spec is None:
+                    io.write_ascii(f, np.array([-t.Teff, t.radius, t.mass]))
+                else:
+                    io.write_ascii(f, spec * 4. * np.pi * cgs.pc**2 / t.mass)
+
+        ext = 'binp' if io.binary else 'inp'
+        fname = '.'.join(['stellarsrc_density', ext])
+        itemsize = np.dtype(io.dtype).itemsize
+
+        hdr = np.empty((3,), dtype=np.int64)
+        hdr[0] = 1
+        hdr[1] = grid.nrcells
+        hdr[2] = len(templates)
+
+        if io.binary:
+            hdr = np.insert(hdr, 1, [itemsize])
+
+        with io.file_open_write(fname) as f:
+            io.write_array(f, hdr, '%d')
+
+            if io.binary:
+                io.file_reserve(f, hdr.nbytes + len(templates) *
+                    grid.nrcells * itemsize)
+
+                tasks = [(io, grid, TemplateGroup(g), fname, hdr.nbytes +
+                    i * grid.nrcells * itemsize)
+                    for i, g in enumerate(groups)]
+                pool_map(write_density, tasks, workers, executor)
+
+            else:
+                for g in groups:
+                    write_density((io, grid, TemplateGroup(g), f, 0))
+
+# vim: set ft=python:
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+import os
+import copy
+import itertools
+import threading
+import multiprocessing.pool
+
+
+class SweepResult(object):
+    '''
+    Outcome of one point of a :class:`Sweep`.
+
+    :param int index: Position of the point in :func:`Sweep.points`
+    :param dict params: The parameter values of the point
+    :param Simulation sim: The simulation of the point, whose output
+        directory holds the results
+    '''
+
+    def __init__(self, index, params, sim):
+
+        self.index = index
+        self.params = params
+        self.sim = sim
+        self.run = None
+        self.error = None
+        self.attempts = 0
+
+
+    @property
+    def ok(self):
+        '''Read-only; :code:`True` if RADMC3D finished successfully.'''
+        return self.error is None and self.run is not None and \
+            self.run.returncode == 0
+
+
+
+class Sweep(object):
+    '''
+    Runs a base simulation over every combination of a grid of parameter
+    values. Each point is a deep copy of the base simulation with its own
+    output directory; points are committed and run concurrently by a pool
+    of local workers, while the number of RADMC3D processes running at once
+    is capped separately, so that the Python-side commits of some points can
+    overlap with the runs of others.
+
+    Parameters are given either as dotted paths, which are resolved
+    attribute by attribute from the simulation (with items looked up by key
+    in containers, such as :code:`star.0.Teff` or
+    :code:`dust.silicate.rho0`), or as functions taking the simulation and
+    the value. For example:
+
+    .. code-block:: python
+
+       sweep = r3d.Sweep(sim, { 'config.nphot' : [1e5, 1e6],
+                                'star.0.Teff' : [4000., 5000., 6000.] },
+                         root='sweep', workers=8, maxprocs=4, threads=8)
+
+       for result in sweep.run():
+           print result.params, result.ok
+
+    :param Simulation base: The simulation to copy for each point
+    :param dict params: Maps each parameter to the list of its values
+    :param str root: Directory under which each point gets its own output
+        directory; defaults to the output directory of the base simulation
+    :param int workers: Number of points processed concurrently
+    :param int maxprocs: Maximum number of RADMC3D processes running at
+        once; defaults to :code:`workers`
+    :param int threads: Number of threads per RADMC3D process, or
+        :code:`None` to leave it to RADMC3D
+    :param int retries: Number of times a failed point is tried again
+    :param str command: The RADMC3D command run for each point
+    '''
+
+    def __init__(self, base, params, root=None, workers=1, maxprocs=None,
+    threads=None, retries=0, command='mctherm'):
+
+        self._base = base
+        self._params = list(params.items())
+        self._root = root if root is not None else base.io.outdir
+        self._workers = workers
+        self._maxprocs = maxprocs if maxprocs is not None else workers
+        self._threads = threads
+        self._retries = retries
+        self._command = command
+
+
+    def points(self):
+        '''
+        Lists the parameter combinations of this sweep.
+
+        :returns: One dictionary of parameter values per point
+        :rtype: list
+        '''
+
+        keys = [k for k, _ in self._params]
+        return [dict(zip(keys, vals)) for vals in
+            itertools.product(*[v for _, v in self._params])]
+
+
+    def run(self):
+        '''
+        Processes every point of this sweep.
+
+        :returns: A :class:`SweepResult` per point, in the order in which the
+            points finish
+        :rtype: generator
+        '''
+
+        slots = threading.BoundedSemaphore(self._maxprocs)
+        pool = multiprocessing.pool.ThreadPool(self._workers)
+
+        try:
+            tasks = [(i, p, slots) for i, p in enumerate(self.points())]
+            for result in pool.imap_unordered(self.run_point, tasks):
+                yield result
+
+        finally:
+            pool.close()
+            pool.join()
+
+
+    def run_point(self, args):
+        '''
+        Private function. Copies the base simulation for one point, commits
+        it and runs RADMC3D through :func:`~simulation.Simulation.run_command`,
+        so that its result cache is used, trying again on failure. The copy
+        forgets what the base simulation committed, since it writes to a new
+        output directory, and shares its result cache.
+        '''
+
+        index, params, slots = args
+
+        cache = self._base.cache
+        sim = copy.deepcopy(self._base, { id(cache) : cache })
+        sim.forget_commits()
+        result = SweepResult(index, params, sim)
+
+        try:
+            for path, value in params.items():
+                assign(sim, path, value)
+
+            sim.io.outdir = os.path.join(self._root, 'run%04d' % index)
+            sim.io.clobber = True
+            if not os.path.isdir(sim.io.outdir): os.makedirs(sim.io.outdir)
+
+        except Exception as e:
+            result.error = e
+            return result
+
+        while result.attempts <= self._retries:
+            result.attempts += 1
+            result.error = None
+
+            try:
+                sim.commit_mctherm()
+
+                with slots:
+                    result.run = sim.run_command(self._command,
+                        threads=self._threads, echo=False)
+
+            except Exception as e:
+                result.error = e
+
+            if result.ok: break
+
+        return result
+
+
+
+def assign(sim, path, value):
+    '''
+    Sets a parameter of a simulation.
+
+    :param Simulation sim: The simulation
+    :param path: A dotted path from the simulation to the parameter, or a
+        function taking the simulation and the value
+    :param value: The value to set
+    '''
+
+    if callable(path):
+        path(sim, value)
+        return
+
+    parts = path.split('.')
+    obj = sim
+
+    for part in parts[:-1]:
+        obj = lookup(obj, part)
+
+    if isinstance(obj, dict):
+        obj[key(obj, parts[-1])] = value
+    else:
+        setattr(obj, parts[-1], value)
+
+
+def lookup(obj, part):
+    '''
+    Private function. Resolves one component of a dotted path: an item of a
+    container, or an attribute of anything else.
+    '''
+
+    if isinstance(obj, dict):
+        return obj[key(obj, part)]
+
+    return getattr(obj, part)
+
+
+def key(obj, part):
+    '''
+    Private function. Converts a path component to a container key, so that
+    numeric keys such as star indices can be used in paths.
+    '''
+
+    if part not in obj:
+        try:
+            if int(part) in obj: return int(part)
+        except ValueError:
+            pass
+
+    return part
+
+# vim: set ft=python:
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import os
+import stat
+import shutil
+import tempfile
+
+
+class FakeExecutable(object):
+    '''
+    Installs a shell script under a given name at the front of the search
+    path, standing in for RADMC3D, for the duration of a :code:`with` block.
+
+    :param str script: The body of the script, run by :code:`/bin/sh`
+    :param str name: The name of the executable
+    '''
+
+    def __init__(self, script, name='radmc3d'):
+
+        self._script = script
+        self._name = name
+        self._dir = None
+        self._path = None
+
+
+    def __enter__(self):
+
+        self._dir = tempfile.mkdtemp()
+        fname = os.path.join(self._dir, self._name)
+
+        with open(fname, 'w') as f:
+            f.write('#!/bin/sh\n%s\n' % self._script.strip())
+        os.chmod(fname, stat.S_IRWXU)
+
+        self._path = os.environ.get('PATH')
+        os.environ['PATH'] = os.pathsep.join([self._dir, self._path or ''])
+        return self
+
+
+    def __exit__(self, *exc):
+
+        if self._path is None:
+            del os.environ['PATH']
+        else:
+            os.environ['PATH'] = self._path
+
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+
+    @property
+    def dir(self):
+        '''Read-only; gives the directory holding the script.'''
+        return self._dir
+
+# vim: set ft=python:
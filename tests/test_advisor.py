@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy as np
+from fileio import Io
+from grid import RegularGrid
+from dust import DustSpecies
+from coordsys import CartesianCoordinates
+from advisor import GridAdvisor
+
+
+class Exponential(DustSpecies):
+    '''A species whose density falls off exponentially along `x`.'''
+
+    def __init__(self, rho0, h):
+        self.rho0 = rho0
+        self.h = h
+
+    def density(self, coords):
+        x, _, _ = coords.transformTo(CartesianCoordinates)
+        return self.rho0 * np.exp(-x / self.h)
+
+
+
+def slab(u):
+    '''Builds a Cartesian grid with the given `x` axis and one cell across.'''
+
+    grid = RegularGrid()
+    grid.u = np.asarray(u, dtype=np.float64)
+    grid.v = np.array([0., 1.])
+    grid.w = np.array([0., 1.])
+    return grid
+
+
+
+class TestGridAdvisor(unittest.TestCase):
+
+    def setUp(self):
+        self.sample = slab(np.linspace(0., 10., 2001))
+
+
+    def worst(self, grid, dust, kappa=None):
+        '''Gives the largest variation and optical depth across a grid.'''
+
+        stats = GridAdvisor(grid, dust, kappa).statistics()['u']
+        return stats['variation'][1], stats['tau'][1]
+
+
+    def test_variation(self):
+        dust = { 'a' : Exponential(1.e-10, 1.) }
+
+        # One cell per scale height varies by 1 - 1/e across each cell
+        coarse = slab(np.linspace(0., 10., 11))
+        self.assertGreater(self.worst(coarse, dust)[0], .6)
+
+        # A variation of 0.1 per cell needs about one cell per 0.1 scale
+        # heights, evenly spaced
+        grid = GridAdvisor(self.sample, dust).propose(tolerance=.1)
+        self.assertTrue(95 <= grid.nu <= 101, grid.nu)
+        np.testing.assert_allclose(grid.u, np.linspace(0., 10., grid.nu + 1),
+            atol=.05)
+        self.assertEqual((grid.nv, grid.nw), (1, 1))
+
+        self.assertLessEqual(self.worst(grid, dust)[0], .1)
+        self.assertLess(grid.nrcells, self.sample.nrcells)
+
+
+    def test_optical_depth(self):
+        dust = { 'a' : Exponential(1.e-3, np.inf), 'b' : Exponential(1.e-3,
+            np.inf) }
+        kappa = { 'a' : 1.e3, 'b' : 0. }
+
+        coarse = slab(np.linspace(0., 10., 6))
+        self.assertEqual(self.worst(coarse, dust, kappa), (0., 2.))
+
+        advisor = GridAdvisor(self.sample, dust, kappa)
+        grid = advisor.propose(taumax=.5)
+        np.testing.assert_allclose(grid.u, np.linspace(0., 10., 21))
+        self.assertAlmostEqual(self.worst(grid, dust, kappa)[1], .5)
+
+        # Without an optical depth target, a uniform density needs nothing
+        grid = advisor.propose(taumax=None, mincells=3)
+        np.testing.assert_allclose(grid.u, np.linspace(0., 10., 4))
+
+
+    def test_floor(self):
+        dust = { 'a' : Exponential(1., 1.) }
+
+        full = GridAdvisor(self.sample, dust).propose(tolerance=.1)
+        floored = GridAdvisor(self.sample, dust, floor=np.exp(-5.)).propose(
+            tolerance=.1)
+
+        # The tail below the floor is left to a few cells
+        self.assertTrue(45 <= floored.nu <= 53, floored.nu)
+        self.assertLess(floored.u[-2], 6.)
+        self.assertLess(floored.nu, full.nu)
+
+
+    def test_estimate(self):
+        dust = { 'a' : Exponential(1., 1.), 'b' : Exponential(1., 2.) }
+        advisor = GridAdvisor(self.sample, dust)
+        io = Io()
+
+        io.binary = True
+        self.assertEqual(advisor.estimate(self.sample, io), { 'nrcells' :
+            2000, 'filesize' : 32 + 2 * 2000 * 8, 'memory' : 2 * 2 * 2000 *
+            8 })
+
+        io.binary = False
+        self.assertEqual(advisor.estimate(self.sample, io)['filesize'],
+            len('1\n2000\n2\n') + 2 * 2000 * 13)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
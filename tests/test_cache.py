@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from fileio import Io
+from cache import ResultCache
+from runner import CompletedRun
+from simulation import Simulation
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+        self.io.clobber = True
+
+        self.put('radmc3d.inp', 'nphot = 1000\n')
+        self.put('dust_density.inp', '1\n8\n1\n')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        shutil.rmtree(self.io.outdir)
+
+
+    def put(self, name, text):
+        with open(self.io.fullpath(name), 'w') as f:
+            f.write(text)
+
+
+    def get(self, name):
+        with open(self.io.fullpath(name)) as f:
+            return f.read()
+
+
+    def test_round_trip(self):
+        for link in (True, False):
+            cache = ResultCache(os.path.join(self.root, str(link)), link=link)
+            self.assertFalse(cache.fetch(self.io, 'mctherm'))
+
+            self.put('dust_temperature.dat', 'result\n')
+            cache.store(self.io, 'mctherm')
+            cache.clear_outputs(self.io, 'mctherm')
+            self.assertFalse(self.io.file_check_exists('dust_temperature.dat'))
+
+            self.assertTrue(cache.fetch(self.io, 'mctherm'))
+            self.assertEqual(self.get('dust_temperature.dat'), 'result\n')
+
+
+    def test_modified(self):
+        for link in (True, False):
+            cache = ResultCache(os.path.join(self.root, str(link)), link=link)
+            self.put('dust_temperature.dat', 'result\n')
+            cache.store(self.io, 'mctherm')
+            entry = os.path.join(cache.root, cache.key(self.io, 'mctherm'),
+                'dust_temperature.dat')
+
+            self.assertTrue(cache.fetch(self.io, 'mctherm'))
+            with open(self.io.fullpath('dust_temperature.dat'), 'r+') as f:
+                f.write('edited')
+
+            with open(entry) as f:
+                self.assertEqual(f.read(), 'result\n')
+            self.assertTrue(cache.fetch(self.io, 'mctherm'))
+            self.assertEqual(self.get('dust_temperature.dat'), 'result\n')
+
+
+    def test_changed_input(self):
+        cache = ResultCache(self.root)
+        self.put('dust_temperature.dat', 'result\n')
+        cache.store(self.io, 'mctherm')
+
+        # Same size, and most likely the same modification time
+        self.put('radmc3d.inp', 'nphot = 2000\n')
+        self.assertFalse(cache.fetch(self.io, 'mctherm'))
+
+        self.put('radmc3d.inp', 'nphot = 1000\n')
+        self.assertTrue(cache.fetch(self.io, 'mctherm'))
+
+
+    def test_command(self):
+        cache = ResultCache(self.root)
+        self.put('dust_temperature.dat', 'result\n')
+        cache.store(self.io, 'mctherm')
+        self.assertFalse(cache.fetch(self.io, 'image'))
+
+
+    def test_key(self):
+        cache = ResultCache(self.root)
+        key = cache.key(self.io, 'mctherm')
+
+        # Inputs changed while the run was in progress
+        self.put('radmc3d.inp', 'nphot = 2000\n')
+        self.put('dust_temperature.dat', 'result\n')
+        cache.store(self.io, 'mctherm', key)
+
+        self.assertFalse(cache.fetch(self.io, 'mctherm'))
+        self.put('radmc3d.inp', 'nphot = 1000\n')
+        self.assertTrue(cache.fetch(self.io, 'mctherm'))
+
+
+    def test_evict(self):
+        cache = ResultCache(self.root, maxsize=10)
+        self.put('dust_temperature.dat', 'result\n')
+        cache.store(self.io, 'mctherm')
+        old = cache.key(self.io, 'mctherm')
+        os.utime(os.path.join(self.root, old), (0, 0))
+
+        self.put('radmc3d.inp', 'nphot = 2000\n')
+        cache.store(self.io, 'mctherm')
+        new = cache.key(self.io, 'mctherm')
+
+        self.assertEqual(sorted(os.listdir(self.root)), [new])
+
+
+    def test_run_hit(self):
+        sim = Simulation()
+        sim.io.outdir = self.io.outdir
+        sim.io.clobber = True
+        sim.cache = ResultCache(self.root)
+
+        self.put('dust_temperature.dat', 'result\n')
+        sim.cache.store(sim.io, 'mctherm')
+        os.remove(self.io.fullpath('dust_temperature.dat'))
+
+        run = sim.run_mctherm()
+        self.assertIsInstance(run, CompletedRun)
+        self.assertEqual(run.wait(), 0)
+        self.assertEqual(self.get('dust_temperature.dat'), 'result\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import __builtin__
+import numpy as np
+from fileio import Io
+from camera import Camera, ImageBatch, SedBatch
+from tests.fakes import FakeExecutable
+
+
+# Writes a one-pixel image whose value is the inclination
+IMAGE = '''
+while [ $# -gt 0 ]; do
+    if [ "$1" = incl ]; then incl=$2; fi
+    shift
+done
+printf '1\\n1 1\\n1\\n1e13 1e13\\n10.0\\n\\n%s\\n' "$incl" > image.out
+'''
+
+
+# Writes a spectrum at the wavelengths of the model whose flux is the
+# inclination times the wavelength; an inclination of 99 fails, and one
+# of 77 gives other wavelengths
+SED = '''
+while [ $# -gt 0 ]; do
+    if [ "$1" = incl ]; then incl=$2; fi
+    shift
+done
+if [ "$incl" = 99.0 ]; then exit 1; fi
+awk -v incl="$incl" 'NR == 1 { printf "1\\n%d\\n\\n", $1 }
+    NR > 1 { l = (incl == 77.) ? 2. * $1 : $1; printf "%e %e\\n", l,
+    incl * $1 }' wavelength_micron.inp > spectrum.out
+'''
+
+
+class TestCamera(unittest.TestCase):
+
+    def test_args(self):
+        cam = Camera(incl=30, phi=10., npix=(64, 32), sizeau=200, iline=2,
+            widthkms=5., lmbda=870., options=['nostar'])
+        self.assertEqual(cam.args(), ['image', 'npixx', '64', 'npixy', '32',
+            'incl', '30.0', 'phi', '10.0', 'sizeau', '200.0', 'widthkms',
+            '5.0', 'iline', '2', 'lambda', '870.0', 'nostar'])
+        self.assertIsNone(cam.lambdas())
+        self.assertFalse(cam.binary)
+
+        cam = Camera(npix=16, lmbda=[1., 10.], options=['imageunform'])
+        self.assertEqual(cam.args('spectrum'), ['spectrum', 'npix', '16',
+            'incl', '0.0', 'phi', '0.0', 'loadlambda', 'imageunform'])
+        np.testing.assert_array_equal(cam.lambdas(), [1., 10.])
+        self.assertTrue(cam.binary)
+
+
+
+class TestImageBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+        self.io.clobber = True
+        self.fname = self.io.fullpath('camera_wavelength_micron.inp')
+
+        self.prompts = []
+        self.raw_input = __builtin__.raw_input
+        self.answer = 'y'
+
+        def prompt(text):
+            self.prompts.append(threading.current_thread().name)
+            return self.answer
+
+        __builtin__.raw_input = prompt
+
+        self.fake = FakeExecutable(IMAGE)
+        self.fake.__enter__()
+
+
+    def tearDown(self):
+        self.fake.__exit__(None, None, None)
+        __builtin__.raw_input = self.raw_input
+        shutil.rmtree(self.io.outdir)
+
+
+    def test_prepare(self):
+        cams = [Camera(lmbda=[1., 10.]), Camera(lmbda=5.),
+            Camera(lmbda=np.array([1., 10.]))]
+        self.assertTrue(ImageBatch(self.io, cams).prepare())
+
+        np.testing.assert_allclose(np.loadtxt(self.fname), [2., 1., 10.])
+
+        os.remove(self.fname)
+        cams.append(Camera(lmbda=[1., 20.]))
+        self.assertFalse(ImageBatch(self.io, cams).prepare())
+        self.assertFalse(ImageBatch(self.io, cams[1:2]).prepare())
+        self.assertFalse(os.path.exists(self.fname))
+
+
+    def test_naming(self):
+        cams = [Camera(incl=i) for i in [10., 20., 30., 40.]]
+
+        results = list(ImageBatch(self.io, cams, maxprocs=3,
+            stem='view').run())
+        self.assertEqual(sorted(r.index for r in results), [0, 1, 2, 3])
+
+        for r in results:
+            self.assertTrue(r.ok, r.error)
+            self.assertEqual(r.image.data.ravel()[0], r.camera.incl)
+
+            with open(self.io.fullpath('view_%04d.out' % r.index)) as f:
+                self.assertEqual(float(f.read().split()[-1]), r.camera.incl)
+
+        self.assertEqual(sorted(n for n in os.listdir(self.io.outdir)
+            if not n.startswith('.')), ['view_%04d.out' % i for i in range(4)])
+        self.assertEqual(self.prompts, [])
+
+
+    def test_clobber(self):
+        cams = [Camera(incl=i) for i in [10., 20., 30.]]
+        list(ImageBatch(self.io, cams, maxprocs=3).run())
+
+        # Every existing cube is checked before the pool starts, so any
+        # prompt comes from this thread
+        self.io.clobber = False
+        results = list(ImageBatch(self.io, cams[::-1], maxprocs=3).run())
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(self.prompts, [threading.current_thread().name] * 3)
+
+        with open(self.io.fullpath('image_0000.out')) as f:
+            self.assertEqual(float(f.read().split()[-1]), 30.)
+
+        self.answer = 'n'
+        with self.assertRaises(RuntimeError):
+            list(ImageBatch(self.io, cams, maxprocs=3).run())
+
+        with open(self.io.fullpath('image_0000.out')) as f:
+            self.assertEqual(float(f.read().split()[-1]), 30.)
+
+
+class TestSedBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+        self.io.clobber = True
+
+        self.lmbda = np.logspace(-1., 3., 25)
+        with self.io.file_open_write('wavelength_micron.inp') as f:
+            f.write('%d\n' % self.lmbda.shape[0])
+            self.io.write_ascii(f, self.lmbda)
+
+        self.fake = FakeExecutable(SED)
+        self.fake.__enter__()
+
+
+    def tearDown(self):
+        self.fake.__exit__(None, None, None)
+        shutil.rmtree(self.io.outdir)
+
+
+    def test_stack(self):
+        incl = np.linspace(0., 90., 7)
+        batch = SedBatch(self.io, incl, phi=[10.], maxprocs=3)
+        self.assertEqual([c.phi for c in batch.cameras], [10.] * 7)
+
+        flux = batch.stack()
+        self.assertEqual(flux.shape, (7, 25))
+        np.testing.assert_allclose(flux, incl[:,None] * self.lmbda[None,:],
+            rtol=1.e-6)
+
+        # Nothing is collected into the output directory
+        self.assertEqual(sorted(os.listdir(self.io.outdir)),
+            ['wavelength_micron.inp'])
+
+
+    def test_results(self):
+        results = list(SedBatch(self.io, [10., 20.], maxprocs=2).run())
+        self.assertEqual(sorted(r.index for r in results), [0, 1])
+
+        for r in results:
+            self.assertTrue(r.ok, r.error)
+            np.testing.assert_allclose(r.spectrum.lmbda, self.lmbda,
+                rtol=1.e-6)
+
+
+    def test_failure(self):
+        with self.assertRaises(RuntimeError) as cm:
+            SedBatch(self.io, [10., 99., 30.], maxprocs=2).stack()
+        self.assertIn('incl 99', str(cm.exception))
+
+        with self.assertRaises(RuntimeError) as cm:
+            SedBatch(self.io, [10., 77.]).stack()
+        self.assertIn('wavelengths', str(cm.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import multiprocessing.pool
+import numpy as np
+from fileio import Io
+from camera import Camera
+from child import ChildSession, SessionPool
+from tests.fakes import FakeExecutable
+
+
+# Stands in for RADMC3D in child mode. Each command is logged with the
+# process ID; images have one pixel, holding the inclination, and spectra
+# give the inclination as flux. An inclination of 99 makes the process
+# die halfway through its reply.
+CHILD = r"""
+import os, sys
+
+def log(line):
+    with open(os.environ['CHILD_LOG'], 'a') as f:
+        f.write('%d %s\n' % (os.getpid(), line))
+
+def lambdas(args):
+    if 'loadlambda' not in args:
+        return [float(args[args.index('lambda') + 1])]
+    with open('camera_wavelength_micron.inp') as f:
+        return [float(v) for v in f.read().split()[1:]]
+
+sys.stderr.write('child started\n')
+sys.stderr.flush()
+log('start ' + ' '.join(sys.argv[1:]))
+args = list()
+
+for line in iter(sys.stdin.readline, ''):
+    word = line.strip()
+    if word == 'quit':
+        log('quit')
+        break
+    if word != 'enter':
+        args.append(word)
+        continue
+
+    log(' '.join(args))
+    incl = float(args[args.index('incl') + 1]) if 'incl' in args else 0.
+    out = sys.stdout
+    out.write('  Reading model...\n')
+
+    if args == ['writeimage']:
+        lmbda = lambdas(last)
+        out.write('1\n1 1\n%d\n1e13 1e13\n' % len(lmbda))
+        out.write(''.join('%r\n' % l for l in lmbda))
+        if inclination == 99.:
+            out.flush()
+            os._exit(1)
+        for _ in lmbda:
+            out.write('\n%r\n' % inclination)
+
+    elif args == ['writespec']:
+        lmbda = [1., 10., 100.] if last[0] == 'sed' else lambdas(last)
+        out.write('1\n%d\n\n' % len(lmbda))
+        out.write(''.join('%r %r\n' % (l, inclination) for l in lmbda))
+
+    else:
+        last, inclination = args, incl
+
+    out.flush()
+    args = list()
+"""
+
+
+class TestChildSession(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+        self.io.clobber = True
+        self.log = os.path.join(self.io.outdir, 'child.log')
+        os.environ['CHILD_LOG'] = self.log
+
+        script = os.path.join(self.io.outdir, 'child.py')
+        with open(script, 'w') as f:
+            f.write(CHILD)
+
+        self.fake = FakeExecutable('exec "%s" "%s" "$@"' % (sys.executable,
+            script))
+        self.fake.__enter__()
+
+
+    def tearDown(self):
+        self.fake.__exit__(None, None, None)
+        del os.environ['CHILD_LOG']
+        shutil.rmtree(self.io.outdir)
+
+
+    def events(self):
+        '''Reads the log of the fake child processes, as (pid, line) pairs.'''
+
+        if not os.path.isfile(self.log): return []
+
+        with open(self.log) as f:
+            return [tuple(l.rstrip('\n').split(' ', 1)) for l in f]
+
+
+    def rundirs(self):
+        return [n for n in os.listdir(self.io.outdir) if n.startswith('.run')]
+
+
+    def test_protocol(self):
+        with ChildSession(self.io, threads=2) as session:
+            self.assertEqual(len(self.rundirs()), 1)
+
+            img = session.image(Camera(incl=30., lmbda=[1., 10.],
+                options=['imageunform']))
+            np.testing.assert_array_equal(img.lmbda, [1., 10.])
+            np.testing.assert_array_equal(img.data, 30.)
+            self.assertFalse(img.binary)
+
+            spec = session.spectrum(Camera(incl=45., phi=10.), 'sed')
+            np.testing.assert_array_equal(spec.lmbda, [1., 10., 100.])
+            np.testing.assert_array_equal(spec.flux, 45.)
+
+            spec = session.spectrum(Camera(incl=60., lmbda=870.))
+            np.testing.assert_array_equal(spec.lmbda, [870.])
+            self.assertTrue(session.running)
+
+        self.assertFalse(session.running)
+        self.assertEqual(self.rundirs(), [])
+        self.assertEqual(session.stderr, 'child started\n')
+
+        events = self.events()
+        self.assertEqual(len(set(pid for pid, _ in events)), 1)
+        self.assertEqual([line for _, line in events], [
+            'start child setthreads 2',
+            'image npix 100 incl 30.0 phi 0.0 loadlambda', 'writeimage',
+            'sed incl 45.0 phi 10.0', 'writespec',
+            'spectrum npix 100 incl 60.0 phi 0.0 lambda 870.0', 'writespec',
+            'quit'])
+
+
+    def test_error(self):
+        with ChildSession(self.io) as session:
+            with self.assertRaises(EOFError):
+                session.image(Camera(incl=99., lmbda=1.))
+            self.assertFalse(session.running)
+
+            with self.assertRaises(RuntimeError):
+                session.image(Camera(incl=10., lmbda=1.))
+
+        self.assertEqual(self.rundirs(), [])
+
+
+    def test_pool(self):
+        cams = [Camera(incl=float(i), lmbda=1.) for i in range(12)]
+        workers = multiprocessing.pool.ThreadPool(4)
+
+        try:
+            with SessionPool(self.io, size=2) as pool:
+                images = workers.map(pool.image, cams)
+                for cam, img in zip(cams, images):
+                    np.testing.assert_array_equal(img.data, cam.incl)
+
+                # The failed session is replaced by a new one on demand
+                with self.assertRaises(EOFError):
+                    pool.image(Camera(incl=99., lmbda=1.))
+
+                spectra = workers.map(lambda c: pool.spectrum(c, 'sed'), cams)
+                for cam, spec in zip(cams, spectra):
+                    np.testing.assert_array_equal(spec.flux, cam.incl)
+
+        finally:
+            workers.close()
+            workers.join()
+
+        self.assertEqual(self.rundirs(), [])
+
+        events = self.events()
+        starts = [pid for pid, line in events if line.startswith('start')]
+        failed = [pid for pid, line in events if 'incl 99.0' in line]
+        quits = [pid for pid, line in events if line == 'quit']
+
+        self.assertTrue(len(starts) <= 3, starts)
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(sorted(quits), sorted(p for p in starts
+            if p not in failed))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+import pickle
+import unittest
+import numpy as np
+from grid import RegularGrid
+from coordsys import CartesianCoordinates, SphericalCoordinates, \
+    CylindricalCoordinates, TransformCache
+
+
+def make_spherical():
+    '''Builds a small spherical grid with distinct dimensions.'''
+
+    grid = RegularGrid()
+    grid.coordsys = SphericalCoordinates
+    grid.u = np.linspace(1., 2., 5)
+    grid.v = np.linspace(0.1, 3., 4)
+    grid.w = np.linspace(0., 6., 8)
+    return grid
+
+
+
+class TestGridCoordinates(unittest.TestCase):
+
+    def setUp(self):
+        self.grid = make_spherical()
+        mid = self.grid.midpoints
+        self.full = np.meshgrid(mid[0], mid[1], mid[2], indexing='ij')
+
+
+    def test_full(self):
+        coords = self.grid.cellcoords
+
+        for sys in (SphericalCoordinates, CartesianCoordinates,
+        CylindricalCoordinates):
+            ret = coords.transformTo(sys)
+            ref = SphericalCoordinates(*self.full).transformTo(sys)
+
+            for a, b in zip(ret, ref):
+                self.assertEqual(a.shape, self.grid.shape)
+                self.assertEqual(a.ravel().shape, (self.grid.nrcells,))
+                np.testing.assert_allclose(a, b)
+
+        r, theta, phi = coords.transformTo(SphericalCoordinates)
+        self.assertEqual(r[1,2,3], self.full[0][1,2,3])
+        self.assertEqual(theta.reshape((-1,)).shape, (self.grid.nrcells,))
+        self.assertEqual(self.grid.cellcoords.x.shape, self.grid.shape)
+
+
+    def test_compact(self):
+        coords = self.grid.cellcoords
+
+        r, theta, phi = coords.transformTo(SphericalCoordinates, compact=True)
+        self.assertEqual((r.shape, theta.shape, phi.shape),
+            ((4, 1, 1), (1, 3, 1), (1, 1, 7)))
+
+        x, y, z = coords.transformTo(CartesianCoordinates, compact=True)
+        self.assertEqual(z.shape, (4, 3, 1))
+        np.testing.assert_allclose(np.broadcast_to(z, self.grid.shape),
+            SphericalCoordinates(*self.full).z)
+
+
+    def test_chunks(self):
+        for _, coords, shape in self.grid.chunks(24):
+            r, _, _ = coords.transformTo(SphericalCoordinates)
+            self.assertEqual(r.shape, shape)
+
+            r, _, _ = coords.transformTo(SphericalCoordinates, compact=True)
+            self.assertEqual(r.shape, (4, 1, 1))
+
+
+    def test_scalars(self):
+        center = CartesianCoordinates(1., 0., 0.)
+        self.assertEqual(center.transformTo(CartesianCoordinates),
+            (1., 0., 0.))
+
+        r, theta, phi = center.transformTo(SphericalCoordinates)
+        self.assertAlmostEqual(float(r), 1.)
+        self.assertAlmostEqual(float(theta), np.pi / 2.)
+
+
+class TestTransformCache(unittest.TestCase):
+
+    def setUp(self):
+        self.a = (np.zeros(10), np.zeros(10))
+        self.b = (np.zeros(20),)
+        self.c = (np.zeros(5), np.zeros(5), np.zeros(5))
+
+
+    def test_hit(self):
+        cache = TransformCache()
+        self.assertIsNone(cache.get(CartesianCoordinates))
+
+        cache.put(CartesianCoordinates, self.a)
+        self.assertIs(cache.get(CartesianCoordinates), self.a)
+        self.assertIsNone(cache.get(CylindricalCoordinates))
+        self.assertEqual(cache.nbytes, 160)
+
+        cache.put(CartesianCoordinates, self.b)
+        self.assertIs(cache.get(CartesianCoordinates), self.b)
+        self.assertEqual(cache.nbytes, 160)
+
+        cache.pop(CartesianCoordinates)
+        cache.pop(CartesianCoordinates)
+        self.assertIsNone(cache.get(CartesianCoordinates))
+        self.assertEqual(cache.nbytes, 0)
+
+
+    def test_coordinates(self):
+        coords = SphericalCoordinates(np.linspace(1., 2., 4),
+            np.linspace(.1, 3., 4), np.linspace(0., 6., 4))
+        ret = coords.transformTo(CartesianCoordinates)
+
+        self.assertIs(coords.cache.get(CartesianCoordinates), ret)
+        self.assertIs(coords.transformTo(CartesianCoordinates), ret)
+        self.assertEqual(coords.cache.nbytes, 3 * 4 * 8)
+
+        # Its own system is never cached
+        coords.transformTo(SphericalCoordinates)
+        self.assertIsNone(coords.cache.get(SphericalCoordinates))
+
+
+    def test_scopes(self):
+        cache = TransformCache()
+        one, two = cache.scope((0, 1)), cache.scope((1, 2))
+
+        one.put(CartesianCoordinates, self.a)
+        two.put(CartesianCoordinates, self.b)
+        self.assertIs(one.get(CartesianCoordinates), self.a)
+        self.assertIs(two.get(CartesianCoordinates), self.b)
+        self.assertIsNone(cache.get(CartesianCoordinates))
+        self.assertIs(cache.get(((1, 2), CartesianCoordinates)), self.b)
+        self.assertEqual(cache.nbytes, 320)
+
+        one.clear()
+        self.assertIsNone(one.get(CartesianCoordinates))
+        self.assertIs(two.get(CartesianCoordinates), self.b)
+        self.assertEqual(cache.nbytes, 160)
+
+        cache.clear()
+        self.assertIsNone(two.get(CartesianCoordinates))
+        self.assertEqual(cache.nbytes, 0)
+
+
+    def test_capped(self):
+        cache = TransformCache(maxbytes=330)
+        cache.put(1, self.a)
+        cache.put(2, self.c)
+        self.assertEqual(cache.nbytes, 280)
+
+        # The least recently used entry goes first
+        self.assertIs(cache.get(1), self.a)
+        cache.put(3, self.b)
+        self.assertIsNone(cache.get(2))
+        self.assertIs(cache.get(1), self.a)
+        self.assertIs(cache.get(3), self.b)
+        self.assertEqual(cache.nbytes, 320)
+
+        # Results larger than the cap are never stored
+        cache.put(4, (np.zeros(50),))
+        self.assertIsNone(cache.get(4))
+        self.assertEqual(cache.nbytes, 320)
+
+        cache.maxbytes = 200
+        self.assertIsNone(cache.get(1))
+        self.assertIs(cache.get(3), self.b)
+        self.assertEqual(cache.nbytes, 160)
+
+        scope = cache.scope('slab')
+        scope.put(1, self.c)
+        self.assertIsNone(cache.get(3))
+        self.assertIs(scope.get(1), self.c)
+        self.assertEqual(cache.nbytes, 120)
+
+
+    def test_pickle(self):
+        cache = TransformCache(maxbytes=1000)
+        cache.put(1, self.a)
+
+        copy = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(copy.maxbytes, 1000)
+        self.assertEqual(copy.nbytes, 0)
+        self.assertIsNone(copy.get(1))
+        copy.put(1, self.a)
+        self.assertIs(copy.get(1), self.a)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
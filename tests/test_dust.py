@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from fileio import Io
+from grid import RegularGrid
+from coordsys import CartesianCoordinates, SphericalCoordinates
+from dust import DustSpecies, DustContainer
+
+
+class Slope(DustSpecies):
+    '''A species whose density depends on all three coordinates.'''
+
+    def __init__(self, scale=1.):
+        self.scale = scale
+
+    def density(self, coords):
+        x, y, z = coords.transformTo(CartesianCoordinates)
+        return self.scale * (1. + x**2 + 2. * y + 3. * z)
+
+
+
+class Extent(Slope):
+    '''
+    A species that records, each time it is evaluated, the number of cells
+    it is given and the size of the transform cache of a grid.
+    '''
+
+    def __init__(self, grid):
+        super(Extent, self).__init__()
+        self.grid = grid
+        self.cells = list()
+        self.cached = list()
+
+    def density(self, coords):
+        ret = super(Extent, self).density(coords)
+        self.cells.append(np.broadcast(*coords.transformTo(
+            CartesianCoordinates)).size)
+        self.cached.append(self.grid.transform_cache.nbytes)
+        return ret
+
+
+
+def make_grid():
+    '''Builds a small Cartesian grid with distinct dimensions.'''
+
+    grid = RegularGrid()
+    grid.u = np.linspace(-1., 1., 5)
+    grid.v = np.linspace(0., 1., 4)
+    grid.w = np.linspace(0., 2., 8)
+    return grid
+
+
+def read_density(io, grid, stem='dust_density'):
+    '''
+    Reads back a dust density file, or another file in the same format,
+    checking its header.
+
+    :returns: The densities, one row per species
+    :rtype: np.ndarray
+    '''
+
+    if io.binary:
+        fname = io.fullpath(stem + '.binp')
+        hdr = np.fromfile(fname, dtype=np.int64, count=4)
+        data = np.fromfile(fname, dtype=io.dtype)[4 * 8 // io.precis:]
+        nrcells, nrspec = hdr[2], hdr[3]
+        assert (hdr[0], hdr[1]) == (1, io.precis)
+
+    else:
+        values = np.loadtxt(io.fullpath(stem + '.inp'))
+        nrcells, nrspec = int(values[1]), int(values[2])
+        data = values[3:]
+        assert values[0] == 1
+
+    assert nrcells == grid.nrcells
+    return data.reshape((nrspec, nrcells))
+
+
+def expected(dust, grid):
+    '''Evaluates each species over the whole grid at once.'''
+
+    return np.array([np.broadcast_to(d.density(grid.cellcoords),
+        grid.shape).ravel(order='F') for d in dust.values()])
+
+
+
+class TestDustWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+        self.io.clobber = True
+
+        self.grid = make_grid()
+        self.dust = DustContainer()
+        self.dust['a'] = Slope(1.)
+        self.dust['b'] = Slope(2.5)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.io.outdir)
+
+
+    def check(self, **kwargs):
+        self.dust.write(self.io, self.grid, **kwargs)
+        ret = read_density(self.io, self.grid)
+        rtol = 1.e-6 if self.io.binary else 1.e-5
+        np.testing.assert_allclose(ret, expected(self.dust, self.grid),
+            rtol=rtol)
+
+
+    def test_ascii(self):
+        self.check()
+
+    def test_ascii_chunked(self):
+        for size in (1, 20, 45, 1000):
+            self.io.chunksize = size
+            self.check()
+
+    def test_binary(self):
+        self.io.binary = True
+        self.check()
+
+    def test_binary_chunked(self):
+        self.io.binary = True
+        for size in (1, 20, 45, 1000):
+            self.io.chunksize = size
+            self.check()
+
+    def test_binary_single(self):
+        self.io.binary = True
+        self.io.precision = 'single'
+        self.io.chunksize = 20
+        self.check()
+
+    def test_bounded(self):
+        self.grid.coordsys = SphericalCoordinates
+        self.grid.u = np.linspace(1., 2., 21)
+        self.grid.v = np.linspace(0.1, 3., 21)
+        self.grid.w = np.linspace(0., 6., 51)
+        self.dust['a'] = Extent(self.grid)
+        self.dust['b'] = Extent(self.grid)
+
+        for binary in (False, True):
+            self.io.binary = binary
+            self.io.chunksize = 800
+            self.dust.write(self.io, self.grid)
+
+            for d in self.dust.values():
+                self.assertEqual(sum(d.cells), self.grid.nrcells)
+                self.assertLessEqual(max(d.cells), 800)
+                self.assertLessEqual(max(d.cached), 3 * 8 * 800)
+
+            np.testing.assert_allclose(read_density(self.io, self.grid),
+                expected(self.dust, self.grid), rtol=1.e-5)
+
+            # The reference evaluation cached the whole grid
+            self.grid.transform_cache.clear()
+            for d in self.dust.values():
+                d.cells, d.cached = list(), list()
+
+    def test_ascii_workers(self):
+        self.io.chunksize = 20
+        for executor in ('thread', 'process'):
+            self.check(workers=2, executor=executor)
+
+    def test_binary_workers(self):
+        self.io.binary = True
+        self.io.chunksize = 20
+        for executor in ('thread', 'process'):
+            self.check(workers=2, executor=executor)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
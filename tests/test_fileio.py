@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+
+import os
+import copy
+import socket
+import shutil
+import tempfile
+import unittest
+import subprocess
+import numpy as np
+from fileio import Io, RunDirectory, DirectoryIndex
+
+
+def dead_pid():
+    '''Gives the process ID of a process that has exited.'''
+
+    proc = subprocess.Popen(['true'])
+    proc.wait()
+    return proc.pid
+
+
+
+class TestRunDirectory(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+        self.io.clobber = True
+
+        for name in ('radmc3d.inp', 'amr_grid.inp', 'notes.txt'):
+            with open(self.io.fullpath(name), 'w') as f:
+                f.write('%s\n' % name)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.io.outdir)
+
+
+    def fake(self, owner, root=None):
+        '''Makes a run directory with the given owner file contents.'''
+
+        path = tempfile.mkdtemp(prefix='.run',
+            dir=root if root is not None else self.io.outdir)
+
+        if owner is not None:
+            with open(os.path.join(path, RunDirectory.owner), 'w') as f:
+                f.write(owner)
+
+        return path
+
+
+    def test_inputs(self):
+        with self.io.rundir() as rd:
+            self.assertEqual(sorted(os.listdir(rd.path)), ['.owner',
+                'amr_grid.inp', 'radmc3d.inp'])
+            self.assertTrue(os.path.samefile(rd.io.fullpath('radmc3d.inp'),
+                self.io.fullpath('radmc3d.inp')))
+
+        self.assertFalse(os.path.exists(rd.path))
+
+
+    def test_replace(self):
+        with self.io.rundir() as rd:
+            with rd.io.file_open_write('radmc3d.inp') as f:
+                f.write('nphot = 10\n')
+
+            with open(self.io.fullpath('radmc3d.inp')) as f:
+                self.assertEqual(f.read(), 'radmc3d.inp\n')
+
+            RunDirectory.link(self.io.fullpath('amr_grid.inp'),
+                rd.io.fullpath('grid.inp'))
+            rd.io.file_detach('grid.inp')
+            rd.io.file_detach('radmc3d.inp')
+            with open(rd.io.fullpath('grid.inp'), 'r+') as f:
+                f.write('edited')
+
+            with open(self.io.fullpath('amr_grid.inp')) as f:
+                self.assertEqual(f.read(), 'amr_grid.inp\n')
+
+
+    def test_rewritten(self):
+        with open(self.io.fullpath('dust_temperature.dat'), 'w') as f:
+            f.write('old\n')
+
+        with self.io.rundir(outputs=['dust_temperature.dat']) as rd:
+            self.assertFalse(rd.io.file_check_exists('dust_temperature.dat'))
+            self.assertTrue(rd.io.file_check_exists('radmc3d.inp'))
+
+        with self.io.rundir() as rd:
+            self.assertTrue(os.path.samefile(
+                rd.io.fullpath('dust_temperature.dat'),
+                self.io.fullpath('dust_temperature.dat')))
+
+
+    def test_outputs(self):
+        with self.io.rundir(outputs=['*.out']) as rd:
+            for name in ('spectrum.out', 'image.out', 'log.txt'):
+                with open(rd.io.fullpath(name), 'w') as f:
+                    f.write('%s\n' % name)
+
+        self.assertTrue(self.io.file_check_exists('spectrum.out'))
+        self.assertTrue(self.io.file_check_exists('image.out'))
+        self.assertFalse(self.io.file_check_exists('log.txt'))
+
+
+    def test_failure(self):
+        with self.assertRaises(RuntimeError):
+            with self.io.rundir(keep=True, outputs=['*.out']) as rd:
+                with open(rd.io.fullpath('spectrum.out'), 'w') as f:
+                    f.write('partial\n')
+                raise RuntimeError('run failed')
+
+        self.assertFalse(self.io.file_check_exists('spectrum.out'))
+        self.assertTrue(os.path.isdir(rd.path))
+
+
+    def test_purge(self):
+        host = socket.gethostname()
+        dead = self.fake('%s:%d\n' % (host, dead_pid()))
+        alive = self.fake('%s:%d\n' % (host, os.getpid()))
+        remote = self.fake('elsewhere.example.org:%d\n' % dead_pid())
+        unowned = self.fake(None)
+        garbled = self.fake('%s:\n' % host)
+
+        self.assertEqual(RunDirectory.purge(self.io.outdir), [dead])
+
+        for path in (alive, remote, unowned, garbled):
+            self.assertTrue(os.path.isdir(path))
+
+
+    def test_purge_scratch(self):
+        scratch = tempfile.mkdtemp()
+
+        try:
+            self.io.scratch = scratch
+            rd = self.io.rundir()
+            self.assertEqual(os.path.dirname(rd.path), scratch)
+
+            # Still owned by this process
+            self.assertEqual(self.io.clean_rundirs(), [])
+
+            dead = self.fake('%s:%d\n' % (socket.gethostname(), dead_pid()),
+                scratch)
+            self.assertEqual(self.io.clean_rundirs(), [dead])
+            self.assertTrue(os.path.isdir(rd.path))
+
+            rd.cleanup()
+            self.assertFalse(os.path.exists(rd.path))
+
+        finally:
+            shutil.rmtree(scratch)
+
+
+class TestDirectoryIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+        self.io.clobber = True
+
+        for name in ('dust_density.binp', 'dust_density.inp', 'notes.txt'):
+            self.put(name, '1\n8\n2\n')
+        self.age()
+
+        self.isfile = os.path.isfile
+        self.stats = list()
+
+        def isfile(path):
+            self.stats.append(os.path.basename(path))
+            return self.isfile(path)
+
+        os.path.isfile = isfile
+
+
+    def tearDown(self):
+        os.path.isfile = self.isfile
+        shutil.rmtree(self.io.outdir)
+
+
+    def put(self, name, text):
+        with open(self.io.fullpath(name), 'w') as f:
+            f.write(text)
+
+
+    def age(self):
+        '''Dates the directory and its files back, so they are not racy.'''
+
+        for name in os.listdir(self.io.outdir) + ['']:
+            os.utime(self.io.fullpath(name), (0, 0))
+
+
+    def test_listing(self):
+        index = self.io.index
+        self.assertTrue(index.exists('notes.txt'))
+        self.assertFalse(index.exists('dust_temperature.dat'))
+        self.assertEqual(index.find('dust_density'),
+            ('dust_density.inp', False))
+        self.assertIsNone(index.find('dust_density', inp=False))
+
+        # The listing is trusted, and nothing is looked up again
+        del self.stats[:]
+        self.assertFalse(index.exists('dust_temperature.dat'))
+        self.assertTrue(index.exists('notes.txt'))
+        self.assertEqual(self.stats, [])
+
+        # Other processes change the modification time of the directory
+        self.put('dust_temperature.bdat', '')
+        self.assertEqual(index.find('dust_temperature', inp=False),
+            ('dust_temperature.bdat', True))
+
+
+    def test_own_writes(self):
+        index = self.io.index
+        self.assertFalse(index.exists('radmc3d.inp'))
+
+        # Listing again is not needed to see writes through the context
+        with self.io.file_open_write('radmc3d.inp') as f:
+            f.write('nphot = 10\n')
+        self.io.file_remove('dust_density.inp')
+        self.age()
+
+        self.assertTrue(index.exists('radmc3d.inp'))
+        self.assertEqual(index.find('dust_density'),
+            ('dust_density.binp', True))
+
+        with self.io.rundir() as rd:
+            rd.io.file_open_write('image.out').close()
+            rd.collect('image.out')
+        self.age()
+
+        self.assertTrue(index.exists('image.out'))
+        self.assertFalse(any(n.startswith('.run') for n in os.listdir(
+            self.io.outdir)))
+
+
+    def test_parsed(self):
+        calls = list()
+
+        def parse(f):
+            calls.append(f.name)
+            return f.read().split()
+
+        index = self.io.index
+        self.assertEqual(index.parsed('notes.txt', parse), ['1', '8', '2'])
+        self.assertEqual(index.parsed('notes.txt', parse), ['1', '8', '2'])
+        self.assertEqual(len(calls), 1)
+
+        self.put('notes.txt', '1\n8\n3 4\n')
+        self.assertEqual(index.parsed('notes.txt', parse),
+            ['1', '8', '3', '4'])
+        self.assertEqual(len(calls), 2)
+        self.assertIsNone(index.parsed('missing.txt', parse))
+
+
+    def test_copy(self):
+        self.assertTrue(self.io.index.exists('notes.txt'))
+        index = copy.deepcopy(self.io.index)
+        self.assertIsInstance(index, DirectoryIndex)
+        self.assertTrue(index.exists('notes.txt'))
+
+
+class TestWriteAscii(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+        self.io.clobber = True
+
+        rs = np.random.RandomState(0)
+        self.arr = rs.randn(1001, 3) * 10.**rs.randint(-30, 30, (1001, 3))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.io.outdir)
+
+
+    def round_trip(self, arr, fmt=None):
+        '''
+        Writes an array in ASCII and in binary, and reads back both files.
+        '''
+
+        with self.io.file_open_write('ascii.inp') as f:
+            self.io.write_ascii(f, arr, fmt)
+
+        self.io.binary = True
+        with self.io.file_open_write('binary.binp') as f:
+            self.io.write_array(f, arr)
+        self.io.binary = False
+
+        ascii = np.loadtxt(self.io.fullpath('ascii.inp'), ndmin=2)
+        binary = np.fromfile(self.io.fullpath('binary.binp'),
+            dtype=arr.dtype).reshape(arr.shape)
+        return ascii, binary
+
+
+    def test_values(self):
+        for digits in (6, 9, 16):
+            self.io.digits = digits
+
+            ascii, binary = self.round_trip(self.arr)
+            np.testing.assert_array_equal(binary, self.arr)
+            self.assertEqual(ascii.shape, self.arr.shape)
+            np.testing.assert_allclose(ascii, binary, rtol=.5 * 10.**-digits,
+                atol=0.)
+
+
+    def test_blocks(self):
+        # Blocks that do not divide the rows, a partial last block, and
+        # blocks smaller than a row
+        for blocksize in (1, 2, 7, 3003, 100000):
+            self.io.blocksize = blocksize
+
+            ascii, binary = self.round_trip(self.arr)
+            np.testing.assert_allclose(ascii, binary, rtol=1.e-6)
+
+            ascii, binary = self.round_trip(self.arr[:,0])
+            np.testing.assert_allclose(ascii[:,0], binary, rtol=1.e-6)
+
+
+    def test_format(self):
+        arr = np.arange(-5, 95, dtype=np.int64).reshape((25, 4))
+        ascii, binary = self.round_trip(arr, '%d')
+        np.testing.assert_array_equal(ascii, binary)
+
+        with open(self.io.fullpath('ascii.inp')) as f:
+            self.assertEqual(f.readline(), '-5 -4 -3 -2\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy as np
+from fingerprint import fingerprint
+from coordsys import CartesianCoordinates, SphericalCoordinates
+from star import SpectrumStar
+from tests.test_dust import Slope, make_grid
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_values(self):
+        self.assertEqual(fingerprint(1, 'a', None), fingerprint(1, 'a', None))
+        self.assertNotEqual(fingerprint(1), fingerprint(1.))
+        self.assertNotEqual(fingerprint(1), fingerprint(True))
+        self.assertNotEqual(fingerprint('1'), fingerprint(u'2'))
+        self.assertNotEqual(fingerprint(1, 2), fingerprint((1, 2)))
+
+
+    def test_arrays(self):
+        a = np.arange(6.)
+        fp = fingerprint(a)
+        self.assertEqual(fingerprint(a.copy()), fp)
+        self.assertNotEqual(fingerprint(a.reshape((2, 3))), fp)
+        self.assertNotEqual(fingerprint(a.astype(np.float32)), fp)
+
+        a[3] = -1.
+        self.assertNotEqual(fingerprint(a), fp)
+
+
+    def test_containers(self):
+        self.assertEqual(fingerprint({ 'a' : 1, 'b' : [2, 3] }),
+            fingerprint(dict([('b', [2, 3]), ('a', 1)])))
+        self.assertNotEqual(fingerprint([1, 2]), fingerprint((1, 2)))
+        self.assertNotEqual(fingerprint({ 'a' : 1 }), fingerprint({ 'a' : 2 }))
+
+        loop = list()
+        loop.append(loop)
+        self.assertEqual(fingerprint(loop), fingerprint(loop))
+
+
+    def test_objects(self):
+        self.assertEqual(fingerprint(Slope(2.)), fingerprint(Slope(2.)))
+        self.assertNotEqual(fingerprint(Slope(2.)), fingerprint(Slope(3.)))
+        self.assertNotEqual(fingerprint(CartesianCoordinates),
+            fingerprint(SphericalCoordinates))
+
+        # Caches are left out through __getstate__
+        grid = make_grid()
+        fp = fingerprint(grid)
+        grid.cellcoords.transformTo(SphericalCoordinates)
+        self.assertEqual(fingerprint(grid), fp)
+
+        star = SpectrumStar([1., 10.], [1., 2.])
+        fp = fingerprint(star)
+        star.spectrum(np.array([2., 5.]))
+        self.assertEqual(fingerprint(star), fp)
+
+        star.flux = [1., 3.]
+        self.assertNotEqual(fingerprint(star), fp)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from fileio import Io
+from coordsys import CartesianCoordinates
+from vectorsys import CartesianVectorField
+from gas import GasModel, MoleculeSpecies, MoleculeContainer
+from tests.test_dust import make_grid
+
+
+class Slope(GasModel):
+    '''A gas model whose quantities depend on all three coordinates.'''
+
+    def density(self, coords, simvars):
+        x, y, z = coords.transformTo(CartesianCoordinates)
+        return 1.e-18 * (1. + x**2 + 2. * y + 3. * z)
+
+    def temperature(self, coords, simvars):
+        x, y, z = coords.transformTo(CartesianCoordinates)
+        return 10. + x + y + z
+
+    def velocity(self, coords):
+        x, y, z = coords.transformTo(CartesianCoordinates)
+        return CartesianVectorField(x, y, z, np.ones_like(x), y, z,
+            coords=coords)
+
+
+
+def read_numberdens(io, name):
+    '''Reads back a number density file, skipping its header.'''
+
+    if io.binary:
+        fname = io.fullpath('numberdens_%s.binp' % name)
+        hdr = np.fromfile(fname, dtype=np.int64, count=3)
+        assert (hdr[0], hdr[1]) == (1, io.precis)
+        return np.fromfile(fname, dtype=io.dtype)[3 * 8 // io.precis:]
+
+    values = np.loadtxt(io.fullpath('numberdens_%s.inp' % name))
+    assert values[0] == 1
+    return values[2:]
+
+
+
+class TestMoleculeWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+        self.io.clobber = True
+
+        self.grid = make_grid()
+        self.gas = MoleculeContainer()
+        self.gas.model = Slope()
+        self.gas['co'] = MoleculeSpecies(X=1.e-4, mass=4.65e-23)
+        self.gas['hco+'] = MoleculeSpecies(X=1.e-9, mass=4.82e-23)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.io.outdir)
+
+
+    def check(self, **kwargs):
+        self.gas.write(self.io, self.grid, **kwargs)
+
+        density = np.broadcast_to(self.gas.model.density(
+            self.grid.cellcoords, None), self.grid.shape).ravel(order='F')
+        rtol = 1.e-6 if self.io.binary else 1.e-5
+
+        for k, g in self.gas.items():
+            np.testing.assert_allclose(read_numberdens(self.io, k),
+                density * g.X / g.mass, rtol=rtol)
+
+
+    def test_ascii(self):
+        self.check()
+
+    def test_binary(self):
+        self.io.binary = True
+        self.check()
+
+    def test_ascii_workers(self):
+        for executor in ('thread', 'process'):
+            self.check(workers=2, executor=executor)
+
+    def test_binary_workers(self):
+        self.io.binary = True
+        for executor in ('thread', 'process'):
+            self.check(workers=2, executor=executor)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from fileio import Io
+from grid import RegularGrid, OctreeGrid, LayeredGrid
+from coordsys import CartesianCoordinates, SphericalCoordinates
+from dust import DustSpecies, DustContainer
+from tests.test_dust import Slope, make_grid
+
+
+class Corner(object):
+    '''Splits every cell whose center lies at negative x and y.'''
+
+    def __call__(self, coords, widths):
+        x, y, _ = coords.transformTo(CartesianCoordinates)
+        return (x < 0.) & (y < 0.5)
+
+
+
+class Probe(DustSpecies):
+    '''
+    A species that records the size of the transform cache of a grid each
+    time it is evaluated.
+    '''
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.sizes = list()
+
+    def density(self, coords):
+        x, _, _ = coords.transformTo(CartesianCoordinates)
+        self.sizes.append(self.grid.transform_cache.nbytes)
+        return 1. + x**2
+
+
+
+def read_amr(io, count):
+    '''
+    Reads back a grid file.
+
+    :param int count: Number of integers in the header
+
+    :returns: The header, the three axes, and the remaining integers
+    :rtype: tuple
+    '''
+
+    if io.binary:
+        with open(io.fullpath('amr_grid.binp'), 'rb') as f:
+            hdr = np.fromfile(f, dtype=np.int64, count=count)
+            axes = [np.fromfile(f, dtype=io.dtype, count=n + 1)
+                for n in hdr[7:10]]
+            rest = np.fromfile(f, dtype=np.int64)
+
+    else:
+        with open(io.fullpath('amr_grid.inp')) as f:
+            values = np.array(f.read().split(), dtype=np.float64)
+
+        hdr = values[:count].astype(np.int64)
+        axes, i = list(), count
+        for n in hdr[7:10]:
+            axes.append(values[i:i+n+1])
+            i += n + 1
+        rest = values[i:].astype(np.int64)
+
+    return hdr, axes, rest
+
+
+def count_leaves(flags, i=0):
+    '''
+    Walks one tree of depth-first refinement flags.
+
+    :returns: The position after the tree, its number of leaves, and its
+        depth
+    :rtype: tuple
+    '''
+
+    if flags[i] == 0:
+        return i + 1, 1, 0
+
+    i, leaves, depth = i + 1, 0, 0
+    for _ in range(8):
+        i, n, d = count_leaves(flags, i)
+        leaves, depth = leaves + n, max(depth, d + 1)
+
+    return i, leaves, depth
+
+
+
+class TestChunkMemory(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+        self.io.clobber = True
+        self.io.binary = True
+        self.io.chunksize = 1600
+
+
+    def tearDown(self):
+        shutil.rmtree(self.io.outdir)
+
+
+    def check(self, grid, slab):
+        dust = DustContainer()
+        dust['a'] = Probe(grid)
+        dust['b'] = Probe(grid)
+        dust.write(self.io, grid)
+
+        # One slab of x, y and z, for the slab being evaluated only
+        for d in dust.values():
+            self.assertGreater(len(d.sizes), 1)
+            self.assertLessEqual(max(d.sizes), 3 * 8 * slab)
+        self.assertEqual(grid.transform_cache.nbytes, 0)
+
+
+    def test_regular(self):
+        grid = RegularGrid()
+        grid.coordsys = SphericalCoordinates
+        grid.u = np.linspace(1., 2., 41)
+        grid.v = np.linspace(0.1, 3., 41)
+        grid.w = np.linspace(0., 6., 101)
+        self.check(grid, 1600)
+
+
+    def test_octree(self):
+        grid = OctreeGrid(criterion=Corner(), levelmax=1)
+        grid.coordsys = SphericalCoordinates
+        grid.u = np.linspace(1., 2., 21)
+        grid.v = np.linspace(0.1, 3., 21)
+        grid.w = np.linspace(0., 6., 21)
+        self.check(grid, 1600)
+
+
+    def test_whole(self):
+        grid = make_grid()
+        grid.coordsys = SphericalCoordinates
+        self.io.chunksize = None
+
+        dust = DustContainer()
+        dust['a'] = Probe(grid)
+        dust['b'] = Probe(grid)
+        dust.write(self.io, grid)
+
+        # Without chunks, the species share the transformation of the grid
+        self.assertGreater(dust['a'].sizes[0], 0)
+        self.assertEqual(dust['a'].sizes, dust['b'].sizes)
+
+
+
+class TestOctreeGrid(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+        self.io.clobber = True
+
+        base = make_grid()
+        self.grid = OctreeGrid(criterion=Corner(), levelmax=2)
+        self.grid.u, self.grid.v, self.grid.w = base.u, base.v, base.w
+
+
+    def tearDown(self):
+        shutil.rmtree(self.io.outdir)
+
+
+    def check(self):
+        grid = self.grid
+        grid.write(self.io)
+        hdr, axes, flags = read_amr(self.io, 13)
+
+        self.assertEqual(list(hdr[:10]), [1, 1, 0, 0, 1, 1, 1, grid.nu,
+            grid.nv, grid.nw])
+        for axis, ref in zip(axes, (grid.u, grid.v, grid.w)):
+            np.testing.assert_allclose(axis, ref, rtol=1.e-5)
+
+        self.assertEqual(hdr[12], flags.shape[0])
+        self.assertEqual(hdr[11], grid.nrcells)
+        self.assertEqual(hdr[11], np.count_nonzero(flags == 0))
+
+        i, leaves, depth = 0, 0, 0
+        for _ in range(grid.nu * grid.nv * grid.nw):
+            i, n, d = count_leaves(flags, i)
+            leaves, depth = leaves + n, max(depth, d)
+
+        self.assertEqual(i, flags.shape[0])
+        self.assertEqual(leaves, grid.nrcells)
+        self.assertEqual(depth, hdr[10])
+        self.assertEqual(depth, grid.levelmax)
+
+
+    def test_ascii(self):
+        self.check()
+
+    def test_binary(self):
+        self.io.binary = True
+        self.check()
+
+    def test_refine_again(self):
+        n = self.grid.nrcells
+        self.grid.levelmax = 1
+        self.assertLess(self.grid.nrcells, n)
+        self.check()
+
+    def test_chunks(self):
+        species = Slope()
+        ref = species.density(self.grid.cellcoords)
+
+        for size in (7, 50, None):
+            ret = np.concatenate([species.density(coords)
+                for _, coords, _ in self.grid.chunks(size)])
+            np.testing.assert_allclose(ret, ref)
+
+    def test_vtk(self):
+        with self.assertRaises(ValueError):
+            self.grid.vtk
+
+
+
+class TestLayeredGrid(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+        self.io.clobber = True
+
+        self.patches = [(0, 1, 1, 2, 4, 2, 4), (1, 2, 1, 2, 2, 2, 2)]
+        self.grid = LayeredGrid(make_grid(), self.patches)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.io.outdir)
+
+
+    def check(self):
+        grid, base = self.grid, self.grid.base
+        grid.write(self.io)
+        hdr, axes, patches = read_amr(self.io, 12)
+
+        self.assertEqual(list(hdr), [1, 10, 0, 0, 1, 1, 1, base.nu, base.nv,
+            base.nw, 2, 2])
+        for axis, ref in zip(axes, (base.u, base.v, base.w)):
+            np.testing.assert_allclose(axis, ref, rtol=1.e-5)
+
+        self.assertEqual(patches.reshape((-1, 7)).tolist(),
+            [list(p) for p in self.patches])
+
+
+    def test_ascii(self):
+        self.check()
+
+    def test_binary(self):
+        self.io.binary = True
+        self.check()
+
+    def test_layers(self):
+        layers = self.grid.layers
+        self.assertEqual([l.shape for l in layers],
+            [(4, 3, 7), (4, 2, 4), (2, 2, 2)])
+        self.assertEqual(self.grid.nrcells, 84 + 32 + 8)
+
+        # The first patch splits cells 1-2, 1 and 2-3 of the base grid
+        np.testing.assert_allclose(layers[1].u, np.linspace(-1., 0., 5))
+        np.testing.assert_allclose(layers[1].w, np.linspace(2., 6., 5) / 7.)
+
+    def test_chunks(self):
+        species = Slope()
+        ref = species.density(self.grid.cellcoords)
+
+        for size in (7, 50, None):
+            ret = np.concatenate([np.broadcast_to(species.density(coords),
+                shape).ravel(order='F')
+                for _, coords, shape in self.grid.chunks(size)])
+            np.testing.assert_allclose(ret, ref)
+
+    def test_misfit(self):
+        self.grid.patches = [(0, 4, 1, 1, 4, 2, 2)]
+        with self.assertRaises(ValueError):
+            self.grid.layers
+
+    def test_vtk(self):
+        with self.assertRaises(ValueError):
+            self.grid.vtk
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
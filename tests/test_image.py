@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from StringIO import StringIO
+from fileio import Io
+from mapper import Mapper
+from image import Image, Spectrum
+
+
+def format_image(cube, iformat, pixsize, lmbda):
+    '''
+    Formats a cube, indexed as :code:`[comp, ix, iy, ilam]`, as an ASCII
+    RADMC3D image, with a blank line before each wavelength.
+    '''
+
+    ncomp, nx, ny, nlam = cube.shape
+    lines = ['%d' % iformat, '%d %d' % (nx, ny), '%d' % nlam,
+        '%.9e %.9e' % pixsize]
+    lines += ['%.9e' % l for l in lmbda]
+
+    for i in range(nlam):
+        lines.append('')
+        pixels = cube[...,i].reshape((ncomp, -1), order='F').T
+        lines += [' '.join('%.9e' % v for v in p) for p in pixels]
+
+    return '\n'.join(lines) + '\n'
+
+
+def format_spectrum(lmbda, flux):
+    '''Formats an ASCII RADMC3D spectrum.'''
+
+    lines = ['1', '%d' % lmbda.shape[0], '']
+    lines += ['%.9e %.9e' % p for p in zip(lmbda, flux)]
+    return '\n'.join(lines) + '\n'
+
+
+
+class TestImage(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+
+        self.lmbda = np.array([1., 10., 100.])
+        self.pixsize = (1.5e13, 2.5e13)
+        self.cube = np.random.RandomState(0).rand(4, 3, 2, 3)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.io.outdir)
+
+
+    def put(self, fname, text):
+        with open(self.io.fullpath(fname), 'w') as f:
+            f.write(text)
+
+
+    def check(self, img, cube, iformat):
+        self.assertEqual(img.iformat, iformat)
+        self.assertEqual((img.nx, img.ny, img.nlam), (3, 2, 3))
+        self.assertEqual(img.pixsize, self.pixsize)
+        np.testing.assert_allclose(img.lmbda, self.lmbda)
+
+        np.testing.assert_allclose(img.data, cube)
+        np.testing.assert_allclose(img.channel(1), cube[...,1])
+        np.testing.assert_allclose(img.channel(-1), cube[...,2])
+
+        for i, channel in enumerate(img.channels()):
+            np.testing.assert_allclose(channel, cube[...,i])
+
+
+    def test_ascii(self):
+        self.put('image.out', format_image(self.cube[:1], 1, self.pixsize,
+            self.lmbda))
+        img = Mapper().read_image(self.io)
+        self.assertFalse(img.binary)
+        self.check(img, self.cube[0], 1)
+
+
+    def test_ascii_stokes(self):
+        self.put('image.out', format_image(self.cube, 3, self.pixsize,
+            self.lmbda))
+        img = Mapper().read_image(self.io)
+        self.assertEqual(img.channel_shape, (4, 3, 2))
+        self.check(img, self.cube, 3)
+
+
+    def test_binary(self):
+        with open(self.io.fullpath('image.bout'), 'wb') as f:
+            np.array([1, 3, 2, 3], dtype=np.int64).tofile(f)
+            np.array(self.pixsize + tuple(self.lmbda)).tofile(f)
+            self.cube[0].ravel(order='F').tofile(f)
+
+        img = Mapper().read_image(self.io)
+        self.assertTrue(img.binary)
+        self.assertIsInstance(img.data, np.memmap)
+        self.check(img, self.cube[0], 1)
+
+
+    def test_missing(self):
+        self.assertIsNone(Mapper().read_image(self.io))
+
+
+    def test_stream(self):
+        text = format_image(self.cube, 3, self.pixsize, self.lmbda)
+        f = StringIO('Welcome to RADMC-3D\n 12 \n1.5\n' + text + 'ENOUGH\n')
+
+        img = Image.from_stream(f)
+        self.check(img, self.cube, 3)
+        self.assertEqual(f.readline(), 'ENOUGH\n')
+
+
+    def test_stream_truncated(self):
+        text = format_image(self.cube, 3, self.pixsize, self.lmbda)
+
+        with self.assertRaises(EOFError):
+            Image.from_stream(StringIO(text[:-40]))
+        with self.assertRaises(EOFError):
+            Image.from_stream(StringIO('no image here\n'))
+
+
+
+class TestSpectrum(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+
+        self.lmbda = np.logspace(-1., 3., 7)
+        self.flux = np.logspace(-20., -14., 7)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.io.outdir)
+
+
+    def test_file(self):
+        with open(self.io.fullpath('spectrum.out'), 'w') as f:
+            f.write(format_spectrum(self.lmbda, self.flux))
+
+        spec = Mapper().read_spectrum(self.io)
+        np.testing.assert_allclose(spec.lmbda, self.lmbda)
+        np.testing.assert_allclose(spec.flux, self.flux)
+
+
+    def test_stream(self):
+        text = format_spectrum(self.lmbda, self.flux)
+        f = StringIO('3\nstarting\n' + text + 'ENOUGH\n')
+
+        spec = Spectrum.from_stream(f)
+        np.testing.assert_allclose(spec.lmbda, self.lmbda)
+        np.testing.assert_allclose(spec.flux, self.flux)
+        self.assertEqual(f.readline(), 'ENOUGH\n')
+
+        with self.assertRaises(EOFError):
+            Spectrum.from_stream(StringIO(text[:-30]))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
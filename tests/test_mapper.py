@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from fileio import Io
+from dust import DustContainer
+from mapper import Mapper, LazyMapping
+from tests.test_dust import Slope, make_grid, expected
+
+
+class TestLazyMapping(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = list()
+
+        def loader(key):
+            def load():
+                self.calls.append(key)
+                return key * 2
+            return load
+
+        self.mapping = LazyMapping(dict((k, loader(k)) for k in 'abc'))
+
+
+    def test_lazy(self):
+        self.assertEqual(sorted(self.mapping), ['a', 'b', 'c'])
+        self.assertEqual(len(self.mapping), 3)
+        self.assertTrue('b' in self.mapping)
+        self.assertFalse(any(self.mapping.loaded(k) for k in 'abc'))
+        self.assertEqual(self.calls, [])
+
+        self.assertEqual(self.mapping['b'], 'bb')
+        self.assertTrue(self.mapping.loaded('b'))
+        self.assertFalse(self.mapping.loaded('a'))
+        self.assertEqual(self.calls, ['b'])
+
+
+    def test_once(self):
+        for _ in range(3):
+            self.assertEqual(self.mapping['a'], 'aa')
+            self.assertEqual(self.mapping.get('c'), 'cc')
+
+        self.assertEqual(dict(self.mapping.items()),
+            { 'a' : 'aa', 'b' : 'bb', 'c' : 'cc' })
+        self.assertEqual(sorted(self.calls), ['a', 'b', 'c'])
+
+
+    def test_missing(self):
+        with self.assertRaises(KeyError):
+            self.mapping['d']
+
+        self.assertFalse('d' in self.mapping)
+        self.assertIsNone(self.mapping.get('d'))
+        self.assertFalse(self.mapping.loaded('d'))
+        self.assertEqual(self.calls, [])
+
+
+
+class TestMapper(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+        self.io.clobber = True
+        self.io.binary = True
+
+        self.grid = make_grid()
+        self.dust = DustContainer()
+        self.dust['a'] = Slope(1.)
+        self.dust['b'] = Slope(2.)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.io.outdir)
+
+
+    def test_map_variables(self):
+        variables = Mapper().map_variables(self.io, self.grid)
+
+        # Nothing is read until a key is accessed, so files written later
+        # are seen
+        self.dust.write(self.io, self.grid)
+        density = variables['dust_density']
+        self.assertEqual(sorted(density), ['a', 'b'])
+
+        for k, values in zip(self.dust.keys(), expected(self.dust,
+        self.grid)):
+            self.assertIsInstance(density[k], np.memmap)
+            np.testing.assert_allclose(density[k].ravel(order='F'), values)
+
+        self.assertFalse(variables.loaded('dust_temperature'))
+        self.assertEqual(variables['dust_temperature'], dict())
+        self.assertIs(variables['dust_density'], density)
+
+
+    def test_wrap(self):
+        arr = np.asfortranarray(np.arange(24.).reshape((2, 3, 4)))
+        self.assertIs(Mapper().wrap(arr), arr)
+
+        ret = Mapper(materialize=True).wrap(arr)
+        self.assertTrue(ret.flags['C_CONTIGUOUS'])
+        np.testing.assert_array_equal(ret, arr)
+
+        self.dust.write(self.io, self.grid)
+        density = Mapper(materialize=True).read_dust_scalar('density',
+            self.io, self.grid)
+
+        for k in density:
+            self.assertNotIsInstance(density[k], np.memmap)
+            self.assertTrue(density[k].flags['C_CONTIGUOUS'])
+            self.assertEqual(density[k].shape, self.grid.shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
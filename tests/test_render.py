@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+import re
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from fileio import Io
+from render import VtkRender
+from dust import DustContainer
+from grid import OctreeGrid
+from coordsys import CartesianCoordinates, SphericalCoordinates
+from tests.test_dust import Slope, make_grid, expected
+
+
+def read_legacy(io, fname):
+    '''
+    Reads back a legacy binary VTK file.
+
+    :returns: The arrays of the file keyed by the keyword that introduces
+        them (:code:`X_COORDINATES`, :code:`POINTS`), or by field name
+    :rtype: dict
+    '''
+
+    ret = dict()
+    ncells = None
+
+    with open(io.fullpath(fname), 'rb') as f:
+        assert f.readline().startswith('# vtk DataFile')
+        f.readline()
+        assert f.readline().strip() == 'BINARY'
+
+        for line in iter(f.readline, ''):
+            words = line.split()
+
+            if words[0] in ('X_COORDINATES', 'Y_COORDINATES',
+            'Z_COORDINATES'):
+                key, count = words[0], int(words[1])
+            elif words[0] == 'POINTS':
+                key, count = words[0], 3 * int(words[1])
+            elif words[0] == 'SCALARS':
+                key, count = words[1], ncells
+                assert f.readline().startswith('LOOKUP_TABLE')
+            elif words[0] == 'VECTORS':
+                key, count = words[1], 3 * ncells
+            else:
+                if words[0] == 'CELL_DATA': ncells = int(words[1])
+                continue
+
+            dtype = '>f4' if words[2] == 'float' else '>f8'
+            ret[key] = np.fromfile(f, dtype=dtype, count=count)
+            assert f.read(1) == '\n'
+
+    return ret
+
+
+
+def read_piece(io, fname):
+    '''
+    Reads back a piece of a partitioned XML VTK dataset.
+
+    :returns: The arrays of the piece keyed by name (:code:`Points` for the
+        points of a structured grid)
+    :rtype: dict
+    '''
+
+    with open(io.fullpath(fname), 'rb') as f:
+        text = f.read()
+
+    head, data = text.split('<AppendedData encoding="raw">\n_', 1)
+    ret = dict()
+
+    for tag in re.findall(r'<DataArray [^>]*>', head):
+        attrs = dict(re.findall(r'(\w+)="([^"]*)"', tag))
+        dtype = '>f4' if attrs['type'] == 'Float32' else '>f8'
+        offset = int(attrs['offset'])
+
+        nbytes = int(np.frombuffer(data[offset:offset+8], dtype='>u8')[0])
+        ret[attrs.get('Name', 'Points')] = np.frombuffer(
+            data[offset+8:offset+8+nbytes], dtype=dtype)
+
+    return ret
+
+
+
+class TestVtkRender(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+        self.io.clobber = True
+        self.io.binary = True
+
+        self.grid = make_grid()
+        self.dust = DustContainer()
+        self.dust['a'] = Slope(1.)
+        self.dust['b'] = Slope(2.5)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.io.outdir)
+
+
+    def commit(self):
+        self.grid.write(self.io)
+        self.dust.write(self.io, self.grid)
+        return expected(self.dust, self.grid)
+
+
+    def test_rectilinear(self):
+        ref = self.commit()
+        VtkRender().render(self.io, self.grid)
+        ret = read_legacy(self.io, 'model.vtk')
+
+        for key, axis in zip(('X', 'Y', 'Z'), (self.grid.u, self.grid.v,
+        self.grid.w)):
+            np.testing.assert_array_equal(ret['%s_COORDINATES' % key], axis)
+
+        np.testing.assert_array_equal(ret['dust_density_a'], ref[0])
+        np.testing.assert_array_equal(ret['dust_density_b'], ref[1])
+
+
+    def test_structured(self):
+        self.grid.coordsys = SphericalCoordinates
+        self.grid.u = np.linspace(1., 2., 5)
+        self.grid.v = np.linspace(0.1, 3., 4)
+        self.grid.w = np.linspace(0., 6., 8)
+        ref = self.commit()
+
+        VtkRender(dtype=np.float32).render(self.io, self.grid)
+        ret = read_legacy(self.io, 'model.vtk')
+
+        xyz = np.broadcast_arrays(*self.grid.ptcoords.transformTo(
+            CartesianCoordinates))
+        points = np.column_stack([a.ravel(order='F') for a in xyz])
+        np.testing.assert_allclose(ret['POINTS'].reshape((-1, 3)), points,
+            rtol=1.e-6, atol=1.e-6)
+        np.testing.assert_allclose(ret['dust_density_b'], ref[1], rtol=1.e-6)
+
+
+    def test_fields(self):
+        self.commit()
+        VtkRender(fields=['dust_density_b']).render(self.io, self.grid)
+        ret = read_legacy(self.io, 'model.vtk')
+
+        self.assertIn('dust_density_b', ret)
+        self.assertNotIn('dust_density_a', ret)
+
+
+    def test_chunked(self):
+        self.commit()
+        VtkRender().render(self.io, self.grid, 'whole')
+
+        self.io.chunksize = 20
+        VtkRender().render(self.io, self.grid, 'slabs')
+
+        with open(self.io.fullpath('whole.vtk'), 'rb') as f:
+            whole = f.read()
+        with open(self.io.fullpath('slabs.vtk'), 'rb') as f:
+            slabs = f.read()
+        self.assertEqual(whole.replace('whole', 'slabs'), slabs)
+
+
+    def test_pieces_rectilinear(self):
+        ref = self.commit()
+        VtkRender().render_pieces(self.io, self.grid, 3, executor='thread')
+
+        with open(self.io.fullpath('model.pvtr')) as f:
+            index = f.read()
+
+        names = re.findall(r'Source="([^"]*)"', index)
+        self.assertEqual(names, ['model_0.vtr', 'model_1.vtr', 'model_2.vtr'])
+        self.assertIn('Name="dust_density_a"', index)
+
+        pieces = [read_piece(self.io, name) for name in names]
+        for key, i in (('dust_density_a', 0), ('dust_density_b', 1)):
+            np.testing.assert_array_equal(np.concatenate([p[key]
+                for p in pieces]), ref[i])
+
+        bounds = [0, 2, 4, 7]
+        for p, k0, k1 in zip(pieces, bounds[:-1], bounds[1:]):
+            np.testing.assert_array_equal(p['x'], self.grid.u)
+            np.testing.assert_array_equal(p['z'], self.grid.w[k0:k1+1])
+
+
+    def test_pieces_structured(self):
+        self.grid.coordsys = SphericalCoordinates
+        self.grid.u = np.linspace(1., 2., 5)
+        self.grid.v = np.linspace(0.1, 3., 4)
+        self.grid.w = np.linspace(0., 6., 8)
+        ref = self.commit()
+
+        self.io.chunksize = 20
+        VtkRender().render_pieces(self.io, self.grid, 2)
+        pieces = [read_piece(self.io, 'model_%d.vts' % i) for i in range(2)]
+
+        np.testing.assert_array_equal(np.concatenate([p['dust_density_a']
+            for p in pieces]), ref[0])
+
+        xyz = np.broadcast_arrays(*self.grid.ptcoords.transformTo(
+            CartesianCoordinates))
+        points = np.column_stack([a.ravel(order='F') for a in xyz])
+        layer = (self.grid.nu + 1) * (self.grid.nv + 1)
+
+        # Pieces share their boundary layer of points
+        np.testing.assert_allclose(pieces[0]['Points'].reshape((-1, 3)),
+            points[:4*layer])
+        np.testing.assert_allclose(pieces[1]['Points'].reshape((-1, 3)),
+            points[3*layer:])
+
+
+    def test_pieces_octree(self):
+        with self.assertRaises(ValueError):
+            VtkRender().render_pieces(self.io, OctreeGrid(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
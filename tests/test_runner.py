@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from runner import Run, CompletedRun
+from tests.fakes import FakeExecutable
+
+
+# Sleeps for as long as its second argument says, if given; otherwise
+# prints its working directory and arguments, a variable of its environment
+# and a large amount of output, then exits with the status given by its
+# first argument
+SCRIPT = '''
+if [ "$2" -gt 0 ] 2>/dev/null; then exec sleep "$2"; fi
+pwd
+for arg in "$@"; do echo "arg $arg"; done
+echo "env $STUB_VALUE"
+seq 1 100000
+echo "failing with $1" >&2
+exit "$1"
+'''
+
+
+class TestRun(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+
+        self.fake = FakeExecutable(SCRIPT, 'stub')
+        self.fake.__enter__()
+
+
+    def tearDown(self):
+        self.fake.__exit__(None, None, None)
+        shutil.rmtree(self.dir)
+
+
+    def lines(self, run):
+        return run.stdout.decode().splitlines()
+
+
+    def test_args(self):
+        run = Run('stub 0 0 "two words"', self.dir, echo=False)
+        self.assertEqual(run.args, ['stub', '0', '0', 'two words'])
+        self.assertEqual(run.wait(), 0)
+
+        lines = self.lines(run)
+        self.assertEqual(lines[1:4], ['arg 0', 'arg 0', 'arg two words'])
+        self.assertEqual(len(lines), 5 + 100000)
+        self.assertEqual(lines[-1], '100000')
+
+        run = Run(['stub', '0', '0', 'two words'], self.dir, echo=False)
+        self.assertEqual(run.wait(), 0)
+        self.assertEqual(self.lines(run)[3], 'arg two words')
+
+
+    def test_working_dir(self):
+        run = Run(['stub', '0'], self.dir, echo=False,
+            env=dict(os.environ, STUB_VALUE='42'))
+        self.assertEqual(run.wait(), 0)
+
+        self.assertEqual(run.working_dir, self.dir)
+        self.assertEqual(os.path.realpath(self.lines(run)[0]),
+            os.path.realpath(self.dir))
+        self.assertEqual(self.lines(run)[2], 'env 42')
+        self.assertEqual(os.getcwd(), self.cwd)
+
+
+    def test_failure(self):
+        run = Run(['stub', '3'], self.dir, echo=False)
+        self.assertEqual(run.wait(), 3)
+        self.assertEqual(run.returncode, 3)
+        self.assertEqual(run.poll(), 3)
+        self.assertFalse(run.running)
+        self.assertEqual(run.stderr.decode(), 'failing with 3\n')
+        self.assertGreaterEqual(run.elapsed, 0.)
+
+
+    def test_timeout(self):
+        run = Run(['stub', '0', '10'], self.dir, echo=False)
+        self.assertIsNone(run.wait(timeout=.1))
+        self.assertIsNone(run.returncode)
+        self.assertTrue(run.running)
+
+        run.kill()
+        self.assertNotEqual(run.wait(), 0)
+        self.assertFalse(run.running)
+        self.assertLess(run.elapsed, 10.)
+
+
+    def test_completed(self):
+        run = CompletedRun('radmc3d mctherm', self.dir)
+        self.assertEqual(run.args, ['radmc3d', 'mctherm'])
+        self.assertEqual((run.wait(), run.poll(), run.returncode), (0, 0, 0))
+        self.assertFalse(run.running)
+        self.assertEqual((run.stdout, run.stderr), (b'', b''))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
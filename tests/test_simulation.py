@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from simulation import Simulation
+from star import BlackbodyStar
+from coordsys import SphericalCoordinates
+from tests.test_dust import Slope, make_grid, read_density, expected
+
+
+class TestIncrementalCommit(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = Simulation()
+        self.sim.io.outdir = tempfile.mkdtemp()
+        self.sim.io.clobber = True
+        self.sim.grid = make_grid()
+        self.sim.lmbda = np.logspace(-1., 3., 20)
+        self.sim.dust['a'] = Slope(1.)
+        self.sim.dust['b'] = Slope(2.5)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.sim.io.outdir)
+
+
+    def age(self):
+        '''Backdates every file of the output directory.'''
+
+        for name in os.listdir(self.sim.io.outdir):
+            os.utime(self.sim.io.fullpath(name), (0, 0))
+
+
+    def rewritten(self):
+        '''Lists the files written since :func:`age` was called.'''
+
+        return sorted(name for name in os.listdir(self.sim.io.outdir)
+            if os.stat(self.sim.io.fullpath(name)).st_mtime != 0)
+
+
+    def test_unchanged(self):
+        self.sim.commit_mctherm()
+        self.age()
+        self.sim.commit_mctherm()
+        self.assertEqual(self.rewritten(), [])
+
+
+    def test_mutated(self):
+        self.sim.star[0] = BlackbodyStar(5000.)
+        self.sim.commit_mctherm()
+        self.age()
+
+        # The same array, changed in place
+        self.sim.lmbda[0] = .05
+        self.sim.commit_mctherm()
+        self.assertEqual(self.rewritten(), ['stars.inp',
+            'wavelength_micron.inp'])
+
+        self.age()
+        self.sim.star[0].Teff = 6000.
+        self.sim.commit_mctherm()
+        self.assertEqual(self.rewritten(), ['stars.inp'])
+
+
+    def test_grid(self):
+        self.sim.commit_mctherm()
+        self.age()
+
+        # Cached transformations are not part of the grid's fingerprint
+        self.sim.grid.cellcoords.transformTo(SphericalCoordinates)
+        self.sim.commit_mctherm()
+        self.assertEqual(self.rewritten(), [])
+
+        self.sim.grid.w = np.linspace(0., 3., 8)
+        self.sim.commit_mctherm()
+        self.assertEqual(self.rewritten(), ['amr_grid.inp',
+            'dust_density.inp', 'dustopac.inp'])
+        np.testing.assert_allclose(read_density(self.sim.io, self.sim.grid),
+            expected(self.sim.dust, self.sim.grid), rtol=1.e-5)
+
+
+    def test_removed(self):
+        self.sim.commit_mctherm()
+        self.age()
+        os.remove(self.sim.io.fullpath('amr_grid.inp'))
+        self.sim.commit_mctherm()
+        self.assertEqual(self.rewritten(), ['amr_grid.inp'])
+
+
+    def test_config(self):
+        self.sim.commit_mctherm()
+        self.age()
+        self.sim.config.nphot = 12345
+        self.sim.commit_mctherm()
+        self.assertEqual(self.rewritten(), ['radmc3d.inp'])
+
+
+    def test_species_ascii(self):
+        self.sim.commit_mctherm()
+        self.age()
+        self.sim.dust['b'].scale = 4.
+        self.sim.commit_mctherm()
+
+        self.assertEqual(self.rewritten(), ['dust_density.inp',
+            'dustopac.inp'])
+        np.testing.assert_allclose(read_density(self.sim.io, self.sim.grid),
+            expected(self.sim.dust, self.sim.grid), rtol=1.e-5)
+
+
+    def test_species_binary(self):
+        io, grid = self.sim.io, self.sim.grid
+        io.binary = True
+        self.sim.commit_mctherm()
+
+        # Overwrite the section of the unchanged species, which a partial
+        # commit must leave alone
+        section = io.memmap('dust_density.binp', offset=4 * 8,
+            dtype=io.dtype, shape=(grid.nrcells,), mode='r+')
+        section[:] = -1.
+        section.flush()
+        del section
+
+        self.age()
+        self.sim.dust['b'].scale = 4.
+        self.sim.commit_mctherm()
+
+        self.assertEqual(self.rewritten(), ['dust_density.binp'])
+        ret = read_density(io, grid)
+        np.testing.assert_array_equal(ret[0], -1.)
+        np.testing.assert_allclose(ret[1], expected(self.sim.dust, grid)[1],
+            rtol=1.e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from cgs import cgs
+from fileio import Io
+from coordsys import CartesianCoordinates
+from star import planck, BlackbodyStar, MultiBlackbodyStar, SpectrumStar, \
+    StarContainer
+from tests.test_dust import make_grid
+
+
+def read_stars(io):
+    '''
+    Reads back :code:`stars.inp`.
+
+    :returns: The properties of the stars, one row per star, the
+        wavelengths, and, for each star, either its flux or the negated
+        temperature of a blackbody
+    :rtype: tuple
+    '''
+
+    with open(io.fullpath('stars.inp')) as f:
+        values = f.read().split()
+
+    assert values[0] == '2'
+    nstars, nlam = int(values[1]), int(values[2])
+    values = np.array(values[3:], dtype=np.float64)
+
+    props = values[:5*nstars].reshape((nstars, 5))
+    lmbda = values[5*nstars:5*nstars+nlam]
+
+    spectra, i = list(), 5 * nstars + nlam
+    for _ in range(nstars):
+        n = 1 if values[i] < 0. else nlam
+        spectra.append(values[i:i+n])
+        i += n
+
+    assert i == values.shape[0]
+    return props, lmbda, spectra
+
+
+
+class TestStars(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+        self.io.clobber = True
+        self.io.digits = 9
+
+        self.grid = make_grid()
+        self.lmbda = np.logspace(-1., 3., 30)
+
+        # A power law is interpolated exactly in log-log space
+        table = np.logspace(0., 2., 5)
+        self.table = SpectrumStar(table, 1.e-20 * table**-2, radius=cgs.RSun,
+            mass=cgs.MSun, center=CartesianCoordinates(1., 2., 3.))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.io.outdir)
+
+
+    def test_blackbody(self):
+        stars = StarContainer()
+        stars[0] = BlackbodyStar(5780., radius=2. * cgs.RSun)
+        stars[1] = self.table
+        stars.write(self.io, self.lmbda, self.grid)
+
+        props, lmbda, spectra = read_stars(self.io)
+        np.testing.assert_allclose(lmbda, self.lmbda, rtol=1.e-9)
+        np.testing.assert_allclose(props, [[2. * cgs.RSun, 0., 0., 0., 0.],
+            [cgs.RSun, cgs.MSun, 1., 2., 3.]], rtol=1.e-9)
+
+        self.assertEqual(spectra[0].tolist(), [-5780.])
+
+        inside = (self.lmbda >= 1.) & (self.lmbda <= 100.)
+        np.testing.assert_allclose(spectra[1][inside],
+            1.e-20 * self.lmbda[inside]**-2, rtol=1.e-8)
+        self.assertTrue((spectra[1][~inside] == 0.).all())
+
+
+    def test_spectra(self):
+        stars = StarContainer()
+        stars['spotted'] = MultiBlackbodyStar([6000., 4000.], [.8, .2],
+            radius=cgs.RSun)
+        stars['plain'] = MultiBlackbodyStar(3000., radius=10. * cgs.RSun)
+        stars['table'] = self.table
+        stars.write(self.io, self.lmbda, self.grid)
+
+        props, lmbda, spectra = read_stars(self.io)
+        self.assertEqual([s.shape for s in spectra], [self.lmbda.shape] * 3)
+
+        for star, spectrum in zip(stars.values(), spectra):
+            ref = star.spectrum(self.lmbda)
+            np.testing.assert_allclose(spectrum, ref, rtol=1.e-8)
+
+            if isinstance(star, MultiBlackbodyStar):
+                ref = np.pi * (star.radius / cgs.pc)**2 * \
+                    sum(w * planck(self.lmbda, T)
+                    for T, w in zip(star.Teff, star.fractions))
+                np.testing.assert_allclose(spectrum, ref, rtol=1.e-8)
+
+
+    def test_interpolated(self):
+        ret = self.table.spectrum(self.lmbda)
+        self.assertIs(self.table.spectrum(self.lmbda.copy()), ret)
+
+        self.table.flux = 2.e-20 * self.table.lmbda**-2
+        np.testing.assert_allclose(self.table.spectrum(self.lmbda), 2. * ret)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from cgs import cgs
+from fileio import Io
+from star import BlackbodyStar, MultiBlackbodyStar
+from stellarsrc import StellarSourceComponent, StellarSourceContainer
+from tests.test_dust import Slope, make_grid, read_density
+
+
+class Component(StellarSourceComponent):
+    '''A component whose density is that of a :class:`Slope` species.'''
+
+    def __init__(self, template, scale):
+        super(Component, self).__init__(template)
+        self.slope = Slope(scale)
+
+    def density(self, coords):
+        return self.slope.density(coords)
+
+
+
+def read_templates(io):
+    '''
+    Reads back :code:`stellarsrc_templates.inp`.
+
+    :returns: The wavelengths and, for each template, either its spectrum
+        per unit mass or its negated temperature, radius and mass
+    :rtype: tuple
+    '''
+
+    with open(io.fullpath('stellarsrc_templates.inp')) as f:
+        values = f.read().split()
+
+    assert values[0] == '2'
+    ntemp, nlam = int(values[1]), int(values[2])
+    values = np.array(values[3:], dtype=np.float64)
+    lmbda = values[:nlam]
+
+    templates, i = list(), nlam
+    for _ in range(ntemp):
+        n = 3 if values[i] < 0. else nlam
+        templates.append(values[i:i+n])
+        i += n
+
+    assert i == values.shape[0]
+    return lmbda, templates
+
+
+
+class TestStellarSources(unittest.TestCase):
+
+    def setUp(self):
+        self.io = Io()
+        self.io.outdir = tempfile.mkdtemp()
+        self.io.clobber = True
+        self.io.digits = 9
+
+        self.grid = make_grid()
+        self.lmbda = np.logspace(-1., 3., 20)
+
+        self.sun = BlackbodyStar(5772., radius=cgs.RSun, mass=cgs.MSun)
+        self.dwarf = MultiBlackbodyStar([3000., 3500.], radius=.3 * cgs.RSun,
+            mass=.2 * cgs.MSun)
+
+        self.sources = StellarSourceContainer()
+        self.sources['bulge'] = Component(self.sun, 1.)
+        self.sources['halo'] = Component(self.dwarf, 2.)
+        self.sources['disk'] = Component(self.sun, 3.)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.io.outdir)
+
+
+    def test_templates(self):
+        self.sources.write(self.io, self.lmbda, self.grid)
+        lmbda, templates = read_templates(self.io)
+
+        np.testing.assert_allclose(lmbda, self.lmbda, rtol=1.e-9)
+        order, _ = self.sources.templates()
+        self.assertEqual(len(templates), 2)
+
+        np.testing.assert_allclose(templates[order.index(self.sun)],
+            [-5772., cgs.RSun, cgs.MSun], rtol=1.e-9)
+        np.testing.assert_allclose(templates[order.index(self.dwarf)],
+            self.dwarf.spectrum(self.lmbda) * 4. * np.pi * cgs.pc**2 /
+            self.dwarf.mass, rtol=1.e-8)
+
+
+    def test_density(self):
+        for binary in (False, True):
+            self.io.binary = binary
+            self.sources.write(self.io, self.lmbda, self.grid, workers=2)
+            density = read_density(self.io, self.grid, 'stellarsrc_density')
+
+            # Components sharing a template are summed
+            _, groups = self.sources.templates()
+            ref = [np.broadcast_to(sum(c.slope.density(self.grid.cellcoords)
+                for c in g), self.grid.shape).ravel(order='F')
+                for g in groups]
+            self.assertEqual(sorted(len(g) for g in groups), [1, 2])
+            np.testing.assert_allclose(density, ref, rtol=1.e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
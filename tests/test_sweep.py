@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from simulation import Simulation
+from sweep import Sweep
+from cache import ResultCache
+from runner import CompletedRun
+from tests.fakes import FakeExecutable
+from tests.test_dust import Slope, make_grid
+
+
+# Logs its start and end, fails the first time in a directory if asked to
+# by the configuration, and writes the temperatures otherwise
+SCRIPT = '''
+echo "start $PWD $*" >> "$SWEEP_LOG"
+sleep 0.2
+echo "end $PWD" >> "$SWEEP_LOG"
+if grep -q "nphot = 13" radmc3d.inp && [ ! -e failed ]; then
+    touch failed
+    exit 1
+fi
+cp dust_density.inp dust_temperature.dat
+'''
+
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.log = os.path.join(self.root, 'log')
+        os.environ['SWEEP_LOG'] = self.log
+
+        self.sim = Simulation()
+        self.sim.io.outdir = os.path.join(self.root, 'base')
+        self.sim.io.clobber = True
+        os.makedirs(self.sim.io.outdir)
+
+        self.sim.grid = make_grid()
+        self.sim.lmbda = np.logspace(-1., 3., 20)
+        self.sim.dust['a'] = Slope(1.)
+
+        self.fake = FakeExecutable(SCRIPT)
+        self.fake.__enter__()
+
+
+    def tearDown(self):
+        self.fake.__exit__(None, None, None)
+        del os.environ['SWEEP_LOG']
+        shutil.rmtree(self.root)
+
+
+    def events(self):
+        '''Reads the log of the fake RADMC3D, one list of words per line.'''
+
+        if not os.path.isfile(self.log): return []
+
+        with open(self.log) as f:
+            return [l.split() for l in f]
+
+
+    def test_layout(self):
+        # The base has been committed, which the points must not inherit
+        self.sim.commit_mctherm()
+
+        sweep = Sweep(self.sim, { 'dust.a.scale' : [1., 2., 3.] },
+            root=self.root, workers=3, threads=2)
+        results = sorted(sweep.run(), key=lambda r: r.index)
+
+        self.assertEqual([r.index for r in results], [0, 1, 2])
+        self.assertTrue(all(r.ok and r.attempts == 1 for r in results))
+
+        for r in results:
+            outdir = os.path.join(self.root, 'run%04d' % r.index)
+            self.assertEqual(r.sim.io.outdir, outdir)
+            self.assertEqual(r.sim.dust['a'].scale, r.params['dust.a.scale'])
+
+            with open(os.path.join(outdir, 'dust_temperature.dat')) as f:
+                values = np.array(f.read().split(), dtype=np.float64)
+            self.assertAlmostEqual(values[3] / (1. + (-.75)**2 + 2. / 6. +
+                3. / 7.), r.params['dust.a.scale'], places=5)
+
+        starts = [e for e in self.events() if e[0] == 'start']
+        self.assertEqual(len(starts), 3)
+        self.assertTrue(all(e[2:] == ['mctherm', 'setthreads', '2']
+            for e in starts))
+        self.assertEqual(self.sim.dust['a'].scale, 1.)
+
+
+    def test_maxprocs(self):
+        sweep = Sweep(self.sim, { 'dust.a.scale' : [1., 2., 3., 4., 5.] },
+            root=self.root, workers=5, maxprocs=2)
+        self.assertTrue(all(r.ok for r in sweep.run()))
+
+        running, peak = 0, 0
+        for e in self.events():
+            running += 1 if e[0] == 'start' else -1
+            peak = max(peak, running)
+
+        self.assertEqual(len(self.events()), 10)
+        self.assertEqual(peak, 2)
+
+
+    def test_retries(self):
+        params = { 'config.nphot' : [12, 13] }
+
+        results = sorted(Sweep(self.sim, params, root=self.root,
+            workers=2).run(), key=lambda r: r.index)
+        self.assertTrue(results[0].ok)
+        self.assertFalse(results[1].ok)
+        self.assertEqual(results[1].run.returncode, 1)
+        self.assertEqual(results[1].attempts, 1)
+
+        os.remove(os.path.join(self.root, 'run0001', 'failed'))
+        results = sorted(Sweep(self.sim, params, root=self.root, workers=2,
+            retries=2).run(), key=lambda r: r.index)
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual([r.attempts for r in results], [1, 2])
+
+
+    def test_cache(self):
+        self.sim.cache = ResultCache(os.path.join(self.root, 'cache'))
+        params = { 'dust.a.scale' : [2., 2., 3.] }
+
+        results = sorted(Sweep(self.sim, params, root=self.root).run(),
+            key=lambda r: r.index)
+        self.assertTrue(all(r.ok for r in results))
+
+        # The second point has the same inputs as the first
+        self.assertIsInstance(results[1].run, CompletedRun)
+        self.assertTrue(os.path.isfile(os.path.join(self.root, 'run0001',
+            'dust_temperature.dat')))
+        self.assertEqual(len([e for e in self.events()
+            if e[0] == 'start']), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set ft=python:
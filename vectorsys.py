@@ -7,6 +7,14 @@ from coordsys import CartesianCoordinates, SphericalCoordinates, \
 
 
 class VectorField(object):
+    '''
+    Base class for vector fields. Components are stored as Cartesian; the
+    positions at which they are given are kept in :code:`coords`. Every
+    subclass accepts an optional :code:`coords` keyword which, if given, is
+    used in place of a new container built from the positions; passing
+    :attr:`~grid.Grid.cellcoords` lets transformations reuse the
+    coordinates already computed for the grid.
+    '''
 
     @abc.abstractmethod
     def __init__(self):
@@ -21,7 +29,8 @@ class VectorField(object):
 
         elif sys == SphericalVectorField:
 
-            _, theta, phi = self.coords.transform(SphericalCoordinates)
+            _, theta, phi = self.coords.transformTo(SphericalCoordinates,
+                compact=True)
 
             v_r     = self.v_x * np.sin(theta) * np.cos(phi) + \
                       self.v_y * np.sin(theta) * np.sin(phi) + \
@@ -35,7 +44,8 @@ class VectorField(object):
 
         elif sys == CylindricalVectorField:
 
-            _, phi, _ = self.coords.transform(CylindricalCoordinates)
+            _, phi, _ = self.coords.transformTo(CylindricalCoordinates,
+                compact=True)
 
             v_s   = self.v_x * np.cos(phi) + self.v_y * np.sin(phi)
             v_phi = self.v_x * -np.sin(phi) + self.v_y * np.cos(phi)
@@ -48,20 +58,22 @@ class VectorField(object):
 
 class CartesianVectorField(VectorField):
 
-    def __init__(self, x, y, z, v_x, v_y, v_z):
+    def __init__(self, x, y, z, v_x, v_y, v_z, coords=None):
 
         self.v_x = v_x
         self.v_y = v_y
         self.v_z = v_z
 
-        self.coords = CartesianCoordinates(x, y, z)
+        self.coords = coords if coords is not None else \
+            CartesianCoordinates(x, y, z)
 
 
 class CylindricalVectorField(VectorField):
 
-    def __init__(self, s, phi, z, v_s, v_phi, v_z):
+    def __init__(self, s, phi, z, v_s, v_phi, v_z, coords=None):
 
-        self.coords = CylindricalCoordinates(s, phi, z)
+        self.coords = coords if coords is not None else \
+            CylindricalCoordinates(s, phi, z)
 
         self.v_x = v_s * np.cos(phi) + v_phi * -np.sin(phi)
         self.v_y = v_s * np.sin(phi) + v_phi * np.cos(phi)
@@ -70,9 +82,10 @@ class CylindricalVectorField(VectorField):
 
 class SphericalVectorField(VectorField):
 
-    def __init__(self, r, theta, phi, v_r, v_theta, v_phi):
+    def __init__(self, r, theta, phi, v_r, v_theta, v_phi, coords=None):
 
-        self.coords = SphericalCoordinates(r, theta, phi)
+        self.coords = coords if coords is not None else \
+            SphericalCoordinates(r, theta, phi)
 
         self.v_x = v_r * np.sin(theta) * np.cos(phi) + \
                    v_theta * np.cos(theta) * np.cos(phi) + \